@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class TopicConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "myapps.Topic"
+
+    def ready(self):
+        # 註冊 DifficultyLevels 變更時讓難度快取失效的 signal
+        from . import difficulty_registry  # noqa: F401
+
+        # write-behind 開啟時先建立 dead letter 目錄
+        from . import familiarity_buffer
+        if familiarity_buffer.FAMILIARITY_WRITE_BEHIND:
+            try:
+                familiarity_buffer.ensure_dead_letter_dir()
+            except OSError as e:
+                print(f"⚠️ 無法建立熟悉度 dead letter 目錄 {familiarity_buffer.FAMILIARITY_DEAD_LETTER_FILE}: {str(e)}")
@@ -0,0 +1,155 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Chat, ChatSummary, Topic
+
+FLASK_BASE_URL = os.getenv("FLASK_BASE_URL", "http://localhost:5000")
+
+# 每輪送給 AI 的歷史對話：最多幾則原文、token 預算
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "12"))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500"))
+# 更新摘要時，順便把視窗最舊的幾則也納入，之後幾輪就不用再呼叫摘要
+CHAT_SUMMARY_LOOKAHEAD = int(os.getenv("CHAT_SUMMARY_LOOKAHEAD", "6"))
+# 摘要以「舊摘要 + 一段新訊息」逐段累加：每段最多幾則、每次更新最多幾段（剩下的下次更新接著做）
+CHAT_SUMMARY_MAX_INPUT = int(os.getenv("CHAT_SUMMARY_MAX_INPUT", "40"))
+CHAT_SUMMARY_MAX_CHUNKS = int(os.getenv("CHAT_SUMMARY_MAX_CHUNKS", "5"))
+CHAT_SUMMARY_TIMEOUT = float(os.getenv("CHAT_SUMMARY_TIMEOUT", "20"))
+# 摘要在背景執行緒更新，不佔用對話請求的時間
+CHAT_SUMMARY_WORKERS = int(os.getenv("CHAT_SUMMARY_WORKERS", "2"))
+
+_summary_executor = ThreadPoolExecutor(max_workers=CHAT_SUMMARY_WORKERS, thread_name_prefix="chat-summary")
+# 已排程或更新中的 (user_id, topic_id)，同一組不重複排程
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+
+CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]")
+
+
+def estimate_tokens(text):
+    """粗估 token 數：中日文約一字一 token，其他字元約四個一 token"""
+    text = text or ""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _history_queryset(user, topic):
+    return Chat.objects.filter(user=user, topic=topic, deleted_at__isnull=True)
+
+
+def _recent_window(user, topic):
+    """最近的對話原文（舊到新），在 token 預算內盡量保留，最後一則（目前的提問）一定保留"""
+    recent = list(
+        _history_queryset(user, topic)
+        .order_by('-id')
+        .values('id', 'content', 'sender')[:CHAT_HISTORY_MAX_MESSAGES]
+    )
+    window = []
+    used = 0
+    for chat in recent:
+        cost = estimate_tokens(chat['content'])
+        if window and used + cost > CHAT_HISTORY_TOKEN_BUDGET:
+            break
+        window.append(chat)
+        used += cost
+    window.reverse()
+    return window
+
+
+def _request_summary(previous_summary, messages, topic_title):
+    response = requests.post(
+        f'{FLASK_BASE_URL}/api/chat/summary',
+        json={
+            'previous_summary': previous_summary,
+            'messages': [{'sender': m['sender'], 'content': m['content']} for m in messages],
+            'topic_title': topic_title,
+        },
+        timeout=CHAT_SUMMARY_TIMEOUT
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f'Flask summary error: {response.status_code}')
+    return response.json().get('summary', '')
+
+
+def build_chat_context(user, topic):
+    """
+    回傳 (history_summary, chat_history)：
+    - chat_history 是最近幾則原文（受 CHAT_HISTORY_MAX_MESSAGES 與 token 預算限制）
+    - history_summary 是目前存好的摘要，不在請求中呼叫摘要
+    - 比視窗更舊的對話還沒納入摘要時，交易提交後排程背景更新，下一輪起生效
+    """
+    window = _recent_window(user, topic)
+    summary_row = ChatSummary.objects.filter(user=user, topic=topic).first()
+    summary = summary_row.summary if summary_row else ''
+    last_chat_id = summary_row.last_chat_id if summary_row else 0
+
+    if window and _history_queryset(user, topic).filter(
+        id__gt=last_chat_id, id__lt=window[0]['id']
+    ).exists():
+        schedule_summary_refresh(user.pk, topic.pk)
+    return summary, window
+
+
+def schedule_summary_refresh(user_id, topic_id):
+    """交易提交後才排程，摘要呼叫不會落在對話請求的交易裡，也不會讀到未提交的訊息"""
+    transaction.on_commit(lambda: _submit_refresh((user_id, topic_id)))
+
+
+def _submit_refresh(key):
+    with _scheduled_lock:
+        if key in _scheduled:
+            return
+        _scheduled.add(key)
+    _summary_executor.submit(_run_refresh, key)
+
+
+def _run_refresh(key):
+    try:
+        refresh_chat_summary(*key)
+    except Exception as e:
+        print(f"~~~~~ 對話摘要失敗，沿用舊摘要: {str(e)} ~~~~~")
+    finally:
+        with _scheduled_lock:
+            _scheduled.discard(key)
+        # 背景執行緒自己的資料庫連線，用完就關
+        connection.close()
+
+
+def refresh_chat_summary(user_id, topic_id):
+    """
+    把視窗之前還沒納入摘要的對話（連同視窗最舊的 CHAT_SUMMARY_LOOKAHEAD 則）由舊到新併入摘要
+    - 每段最多 CHAT_SUMMARY_MAX_INPUT 則，以上一段的摘要為基礎累加，不會丟掉更早的對話
+    - 每段完成就存檔；別的行程先更新了同一筆時停止，避免進度倒退
+    """
+    topic = Topic.objects.filter(pk=topic_id).only('title').first()
+    if topic is None:
+        return
+    window = _recent_window(user_id, topic_id)
+    if not window:
+        return
+    lookahead = window[:-1][:CHAT_SUMMARY_LOOKAHEAD]
+    upto_id = lookahead[-1]['id'] if lookahead else window[0]['id'] - 1
+
+    row, _ = ChatSummary.objects.get_or_create(user_id=user_id, topic_id=topic_id)
+    summary, last_chat_id = row.summary, row.last_chat_id
+    for _ in range(CHAT_SUMMARY_MAX_CHUNKS):
+        chunk = list(
+            _history_queryset(user_id, topic_id)
+            .filter(id__gt=last_chat_id, id__lte=upto_id)
+            .order_by('id')
+            .values('id', 'content', 'sender')[:CHAT_SUMMARY_MAX_INPUT]
+        )
+        if not chunk:
+            return
+        new_summary = _request_summary(summary, chunk, topic.title)
+        updated = ChatSummary.objects.filter(pk=row.pk, last_chat_id=last_chat_id).update(
+            summary=new_summary, last_chat_id=chunk[-1]['id'], updated_at=timezone.now()
+        )
+        if not updated:
+            return
+        summary, last_chat_id = new_summary, chunk[-1]['id']
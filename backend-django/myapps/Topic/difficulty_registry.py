@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import DifficultyLevels
+
+# 行程內的難度快取：本行程的修改由 signal 立即失效，其他行程的修改最慢 TTL 秒後生效
+DIFFICULTY_REGISTRY_TTL = float(os.getenv("DIFFICULTY_REGISTRY_TTL", "300"))
+
+DEC4 = Decimal('0.0001')
+
+
+class DifficultyInfo:
+    """預先解析好的難度資料（cap / alpha 為 0~1 的 Decimal，cap_pct 為百分比）"""
+
+    __slots__ = ("id", "level_name", "cap", "alpha", "cap_pct", "instance")
+
+    def __init__(self, level):
+        self.id = level.pk
+        self.level_name = level.level_name
+        self.cap = Decimal(str(level.familiarity_cap)).quantize(DEC4)
+        # weight_coefficients 例：{"alpha": 0.25}，預設 0.20
+        self.alpha = Decimal(str((level.weight_coefficients or {}).get('alpha', 0.20))).quantize(DEC4)
+        self.cap_pct = self.cap * 100
+        self.instance = level
+
+
+_by_id = {}
+_by_name = {}
+_loaded_at = None
+_lock = threading.Lock()
+
+
+def _load():
+    global _by_id, _by_name, _loaded_at
+    levels = [DifficultyInfo(level) for level in DifficultyLevels.objects.all()]
+    with _lock:
+        _by_id = {info.id: info for info in levels}
+        _by_name = {info.level_name: info for info in levels}
+        _loaded_at = time.monotonic()
+
+
+def _ensure_loaded():
+    if _loaded_at is None or time.monotonic() - _loaded_at > DIFFICULTY_REGISTRY_TTL:
+        _load()
+
+
+def get_level(pk=None, name=None):
+    """
+    以 id 或 level_name 取得 DifficultyInfo，找不到時丟 DifficultyLevels.DoesNotExist
+    快取裡沒有時重新載入一次（可能是別的行程剛新增）
+    """
+    if pk is None and name is None:
+        raise ValueError("difficulty_level_id 或 difficulty_level_name 需擇一提供")
+    _ensure_loaded()
+    for attempt in range(2):
+        info = _by_id.get(int(pk)) if pk is not None else _by_name.get(name)
+        if info is not None:
+            return info
+        if attempt == 0:
+            _load()
+    raise DifficultyLevels.DoesNotExist(f"DifficultyLevels {pk if pk is not None else name} not found")
+
+
+def all_levels():
+    """{id: DifficultyInfo}"""
+    _ensure_loaded()
+    return _by_id
+
+
+def level_name(pk, default=None):
+    _ensure_loaded()
+    info = _by_id.get(pk)
+    return info.level_name if info else default
+
+
+def invalidate():
+    global _loaded_at
+    with _lock:
+        _loaded_at = None
+
+
+@receiver(post_save, sender=DifficultyLevels)
+@receiver(post_delete, sender=DifficultyLevels)
+def _on_difficulty_changed(sender, **kwargs):
+    # 交易提交後才失效，避免重新載入時讀到（或錯過）未提交的資料
+    transaction.on_commit(invalidate)
@@ -0,0 +1,211 @@
+import atexit
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import UserFamiliarity
+from .services import apply_attempt, build_attempt, ensure_live_quiz, ewma_step, update_familiarity_weighted_average
+
+# write-behind 模式：作答在交易提交後進行程內的緩衝區，由背景執行緒批次寫入 UserFamiliarity
+# 注意緩衝區是每個行程各自一份：
+# - 同一個行程的讀取會疊上緩衝區的預估值（read-your-writes）
+# - 其他行程（gunicorn 的其他 worker）要等寫入後才讀得到，最多落後 FAMILIARITY_FLUSH_INTERVAL 秒
+# - 行程被強制結束（kill -9）時尚未寫入的作答會遺失
+FAMILIARITY_WRITE_BEHIND = os.getenv("FAMILIARITY_WRITE_BEHIND", "false").lower() == "true"
+FAMILIARITY_FLUSH_INTERVAL = float(os.getenv("FAMILIARITY_FLUSH_INTERVAL", "2"))
+# 一個交易最多寫入幾組 (user, quiz)
+FAMILIARITY_FLUSH_BATCH = int(os.getenv("FAMILIARITY_FLUSH_BATCH", "200"))
+# 寫入失敗而丟棄的作答逐行記到這個 JSON Lines 檔（絕對路徑，由 settings 決定；None 則只印 log）
+FAMILIARITY_DEAD_LETTER_FILE = getattr(settings, "FAMILIARITY_DEAD_LETTER_FILE", None)
+
+FLUSH_FIELDS = [
+    "note", "difficulty_level", "total_questions", "correct_answers",
+    "weighted_total", "weighted_correct", "cap_weighted_sum",
+    "familiarity", "updated_at",
+]
+
+# (user_id, quiz_topic_id) -> {"attempts": [...], "familiarity": 預估的最新熟悉度}
+_pending = {}
+_lock = threading.Lock()
+# 背景執行緒與 atexit 不能同時寫，否則同一筆作答會被套用兩次
+_flush_lock = threading.Lock()
+_flusher = None
+
+
+def record_attempt(*, user, quiz_topic_id, **kwargs) -> Decimal:
+    """
+    記錄一次作答並回傳更新後熟悉度（參數同 update_familiarity_weighted_average）
+    - 未開啟 write-behind：直接寫入資料庫
+    - 開啟 write-behind：交易提交後才放進緩衝區，回傳套用權重平均後的預估值
+      （外層交易回滾時這次作答不會被寫入）
+    """
+    if not FAMILIARITY_WRITE_BEHIND:
+        return update_familiarity_weighted_average(user=user, quiz_topic_id=quiz_topic_id, **kwargs)
+
+    ensure_live_quiz(quiz_topic_id)
+    attempt = build_attempt(**kwargs)
+    key = (user.pk, int(quiz_topic_id))
+    # 緩衝區沒有這組時，以資料庫目前的值為起點
+    current = pending_familiarity(*key)
+    if current is None:
+        current = UserFamiliarity.objects.filter(
+            user_id=key[0], quiz_topic_id=key[1]
+        ).values_list("familiarity", flat=True).first() or Decimal("0.00")
+    transaction.on_commit(lambda: _enqueue(key, attempt, current))
+    return ewma_step(current, attempt)
+
+
+def _enqueue(key, attempt, current):
+    with _lock:
+        entry = _pending.get(key)
+        if entry is None:
+            entry = _pending[key] = {"attempts": [], "familiarity": current}
+        entry["attempts"].append(attempt)
+        entry["familiarity"] = ewma_step(entry["familiarity"], attempt)
+    _ensure_flusher()
+
+
+def pending_familiarity(user_id, quiz_topic_id=None):
+    """
+    read-your-writes：回傳還沒寫入資料庫的預估熟悉度
+    - 有給 quiz_topic_id：回傳該測驗的值或 None
+    - 沒給：回傳 {quiz_topic_id: 熟悉度}
+    """
+    with _lock:
+        if quiz_topic_id is not None:
+            entry = _pending.get((user_id, int(quiz_topic_id)))
+            return entry["familiarity"] if entry else None
+        return {
+            quiz_id: entry["familiarity"]
+            for (uid, quiz_id), entry in _pending.items()
+            if uid == user_id
+        }
+
+
+def flush():
+    """把緩衝區寫入資料庫；寫入成功的作答才從緩衝區移除，寫入期間的讀取仍拿得到預估值"""
+    with _flush_lock:
+        _flush()
+
+
+def _flush():
+    with _lock:
+        batch = [(key, list(entry["attempts"])) for key, entry in _pending.items()]
+    for i in range(0, len(batch), FAMILIARITY_FLUSH_BATCH):
+        chunk = batch[i:i + FAMILIARITY_FLUSH_BATCH]
+        try:
+            _write_chunk(chunk)
+        except Exception as e:
+            # 整批失敗（例如別的行程剛好新增同一筆）時改成逐筆寫，避免一筆壞資料卡住整批
+            print(f"熟悉度批次寫入失敗，改逐筆寫入: {str(e)}")
+            for item in chunk:
+                try:
+                    _write_chunk([item])
+                except Exception as e:
+                    _dead_letter(item, e)
+                    _discard(item)
+                    continue
+                _discard(item)
+        else:
+            for item in chunk:
+                _discard(item)
+
+
+def _write_chunk(chunk):
+    """一個交易內：一次鎖定讀出既有記錄，依序套用每組的作答，再 bulk_create / bulk_update"""
+    with transaction.atomic():
+        condition = Q()
+        for user_id, quiz_topic_id in (key for key, _ in chunk):
+            condition |= Q(user_id=user_id, quiz_topic_id=quiz_topic_id)
+        rows = {
+            (uf.user_id, uf.quiz_topic_id): uf
+            for uf in UserFamiliarity.objects.select_for_update().filter(condition)
+        }
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        for (user_id, quiz_topic_id), attempts in chunk:
+            uf = rows.get((user_id, quiz_topic_id))
+            if uf is None:
+                uf = UserFamiliarity(user_id=user_id, quiz_topic_id=quiz_topic_id)
+                to_create.append(uf)
+            else:
+                to_update.append(uf)
+            for attempt in attempts:
+                apply_attempt(uf, attempt)
+            uf.updated_at = now
+
+        if to_create:
+            UserFamiliarity.objects.bulk_create(to_create)
+        if to_update:
+            UserFamiliarity.objects.bulk_update(to_update, FLUSH_FIELDS)
+
+
+def _dead_letter(item, error):
+    """寫入失敗的作答不能無聲消失：印出完整內容，並追加到 FAMILIARITY_DEAD_LETTER_FILE 供事後補寫"""
+    (user_id, quiz_topic_id), attempts = item
+    record = {
+        "user_id": user_id,
+        "quiz_topic_id": quiz_topic_id,
+        "attempts": attempts,
+        "error": str(error),
+        "failed_at": timezone.now().isoformat(),
+    }
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    print(f"熟悉度寫入失敗，丟棄 {len(attempts)} 筆作答: {line}")
+    if not FAMILIARITY_DEAD_LETTER_FILE:
+        return
+    try:
+        ensure_dead_letter_dir()
+        with open(FAMILIARITY_DEAD_LETTER_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"熟悉度 dead letter 寫入失敗: {str(e)}")
+
+
+def ensure_dead_letter_dir():
+    """建立 dead letter 檔所在的目錄（啟動時先建，目錄不能寫時在啟動 log 就看得到）"""
+    if FAMILIARITY_DEAD_LETTER_FILE:
+        Path(FAMILIARITY_DEAD_LETTER_FILE).parent.mkdir(parents=True, exist_ok=True)
+
+
+def _discard(item):
+    key, attempts = item
+    with _lock:
+        entry = _pending.get(key)
+        if entry is None:
+            return
+        del entry["attempts"][:len(attempts)]
+        if not entry["attempts"]:
+            del _pending[key]
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FAMILIARITY_FLUSH_INTERVAL)
+        if not _pending:
+            continue
+        close_old_connections()
+        try:
+            flush()
+        except Exception as e:
+            print(f"熟悉度背景寫入失敗: {str(e)}")
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="familiarity-flusher", daemon=True)
+            _flusher.start()
+            atexit.register(flush)
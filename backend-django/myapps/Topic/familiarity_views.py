@@ -2,8 +2,9 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from .services import update_familiarity_weighted_average
+from .familiarity_buffer import record_attempt, pending_familiarity
 from .models import DifficultyLevels , UserFamiliarity , Quiz
+from .difficulty_registry import get_level
 from .serializers import UserFamiliaritySerializer ,QuizSimplifiedSerializer ,QuizSerializer
 from django.core.validators import MinValueValidator
 from decimal import Decimal
@@ -50,8 +51,7 @@ class SubmitAttemptView(APIView):
         # 難度處理：支援 ID 或名稱
         if difficulty_level_id is not None:
             try:
-                difficulty_level = DifficultyLevels.objects.get(pk=difficulty_level_id)
-                difficulty_level_name = difficulty_level.level_name
+                difficulty_level_name = get_level(pk=difficulty_level_id).level_name
             except DifficultyLevels.DoesNotExist:
                 return Response({"error": f"DifficultyLevels with ID {difficulty_level_id} not found"}, status=400)
         elif difficulty_level_name is None:
@@ -63,25 +63,23 @@ class SubmitAttemptView(APIView):
 
         try:
             # 檢查當前熟悉度是否已達上限
-            from .models import UserFamiliarity
-            current_uf = UserFamiliarity.objects.filter(
-                user=request.user, 
-                quiz_topic_id=quiz_topic_id
-            ).first()
+            # 緩衝區裡還沒寫入的值比資料庫新，優先使用
+            current_fam = pending_familiarity(request.user.pk, quiz_topic_id)
+            if current_fam is None:
+                current_fam = UserFamiliarity.objects.filter(
+                    user=request.user, 
+                    quiz_topic_id=quiz_topic_id
+                ).values_list('familiarity', flat=True).first()
             
-            if difficulty_level_id:
-                difficulty_level = DifficultyLevels.objects.get(pk=difficulty_level_id)
-            else:
-                difficulty_level = DifficultyLevels.objects.get(level_name=difficulty_level_name)
-            
-            cap_pct = difficulty_level.familiarity_cap * 100  # 轉成百分比
+            difficulty_level = get_level(name=difficulty_level_name)
+            cap_pct = difficulty_level.cap_pct  # 轉成百分比
             already_reached_cap = False
             
-            if current_uf and current_uf.familiarity >= cap_pct:
+            if current_fam is not None and current_fam >= cap_pct:
                 already_reached_cap = True
 
             # 呼叫服務函數
-            new_fam = update_familiarity_weighted_average(
+            new_fam = record_attempt(
                 user=request.user,
                 quiz_topic_id=quiz_topic_id,
                 difficulty_level_name=difficulty_level_name,
@@ -110,6 +108,8 @@ class SubmitAttemptView(APIView):
         try:
             # 獲取用戶的所有熟悉度記錄，並使用 select_related 或 prefetch_related 優化查詢
             familiarities = UserFamiliarity.objects.filter(user=user, quiz_topic__deleted_at__isnull=True).select_related('quiz_topic')
+            # read-your-writes：write-behind 緩衝區中尚未寫入的熟悉度
+            pending = pending_familiarity(user.pk)
             # 將結果序列化
             data = []
             for uf in familiarities:
@@ -125,9 +125,17 @@ class SubmitAttemptView(APIView):
                 
                 data.append({
                     "quiz_topic": quiz_topic_data,
-                    "familiarity": float(uf.familiarity)
+                    "familiarity": float(pending.pop(uf.quiz_topic_id, uf.familiarity))
                 })
 
+            # 第一次作答、還沒寫進資料庫的測驗
+            if pending:
+                for quiz in Quiz.objects.filter(id__in=pending.keys(), deleted_at__isnull=True):
+                    data.append({
+                        "quiz_topic": QuizSimplifiedSerializer(quiz).data,
+                        "familiarity": float(pending[quiz.id])
+                    })
+
             return Response(data)
         
         except Exception as e:
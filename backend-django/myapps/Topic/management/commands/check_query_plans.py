@@ -0,0 +1,92 @@
+import json
+import re
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from myapps.Topic.models import Chat, ChatSummary, Note, Quiz, Topic, UserFamiliarity, UserFavorite
+
+# 熱門查詢清單：與 views 內的查詢條件、排序一致（參數值不影響執行計畫）
+HOT_QUERIES = [
+    ("quiz list", lambda: Quiz.objects.filter(user_id=1, deleted_at__isnull=True).order_by('-id')),
+    ("quiz by name", lambda: Quiz.objects.filter(user_id=1, quiz_topic='x', deleted_at__isnull=True)),
+    ("quiz topics", lambda: Topic.objects.filter(quiz_topic_id=1, deleted_at__isnull=True).order_by('created_at')),
+    ("notes list", lambda: Note.objects.filter(
+        user_id=1, deleted_at__isnull=True, quiz_topic__deleted_at__isnull=True
+    ).order_by('-created_at')),
+    ("notes by quiz", lambda: Note.objects.filter(
+        user_id=1, quiz_topic_id=1, deleted_at__isnull=True, quiz_topic__deleted_at__isnull=True
+    ).order_by('-created_at')),
+    ("chat history", lambda: Chat.objects.filter(topic_id=1, deleted_at__isnull=True).order_by('created_at')),
+    ("chat history by user", lambda: Chat.objects.filter(
+        topic_id=1, user_id=1, deleted_at__isnull=True
+    ).order_by('created_at')),
+    ("chat window", lambda: Chat.objects.filter(
+        user_id=1, topic_id=1, deleted_at__isnull=True
+    ).order_by('-id')[:12]),
+    ("chat summary", lambda: ChatSummary.objects.filter(user_id=1, topic_id=1)),
+    ("favorites", lambda: UserFavorite.objects.filter(user_id=1, deleted_at__isnull=True)),
+    ("familiarity list", lambda: UserFamiliarity.objects.filter(
+        user_id=1, quiz_topic__deleted_at__isnull=True
+    ).select_related('quiz_topic')),
+]
+
+# SQLite：SCAN <table> 且沒有 USING ... INDEX 就是全表掃描
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?"?(\w+)"?( USING)?')
+
+
+def _sqlite_full_scans(plan, tables):
+    return sorted({
+        m.group(1) for m in SQLITE_SCAN.finditer(plan)
+        if not m.group(2) and m.group(1) in tables
+    })
+
+
+def _mysql_full_scans(plan, tables):
+    """MySQL：JSON 格式的 EXPLAIN 中 access_type 為 ALL 的表"""
+    scans = set()
+
+    def walk(node):
+        if isinstance(node, dict):
+            if node.get('access_type') == 'ALL' and node.get('table_name') in tables:
+                scans.add(node['table_name'])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(json.loads(plan))
+    return sorted(scans)
+
+
+class Command(BaseCommand):
+    help = "對熱門查詢執行 EXPLAIN，任何一個退化成全表掃描就失敗（請在有代表性資料的資料庫上執行）"
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        tables = {model._meta.db_table for model in apps.get_app_config('Topic').get_models()}
+
+        if connection.vendor == 'sqlite':
+            explain_kwargs, find_scans = {}, _sqlite_full_scans
+        elif connection.vendor == 'mysql':
+            explain_kwargs, find_scans = {'format': 'JSON'}, _mysql_full_scans
+        else:
+            raise CommandError(f"不支援的資料庫: {connection.vendor}")
+
+        failures = []
+        for name, build in HOT_QUERIES:
+            plan = build().explain(**explain_kwargs)
+            scans = find_scans(plan, tables)
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"✗ {name}: 全表掃描 {', '.join(scans)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"✓ {name}"))
+            if verbosity >= 2 or scans:
+                self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f"{len(failures)} 個查詢沒有走索引: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS(f"全部 {len(HOT_QUERIES)} 個查詢都有走索引"))
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Topic", "0007_chatsummary"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="userfavorite",
+            index=models.Index(fields=["user", "deleted_at"], name="fav_user_live_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="topic",
+            index=models.Index(fields=["quiz_topic", "deleted_at", "created_at"], name="topic_quiz_live_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="quiz",
+            index=models.Index(fields=["user", "deleted_at", "created_at"], name="quiz_user_live_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="note",
+            index=models.Index(fields=["user", "deleted_at", "created_at"], name="note_user_live_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="note",
+            index=models.Index(
+                fields=["user", "quiz_topic", "deleted_at", "created_at"], name="note_user_quiz_live_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(fields=["topic", "deleted_at", "created_at"], name="chat_topic_live_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(fields=["user", "topic", "deleted_at"], name="chat_user_topic_live_idx"),
+        ),
+    ]
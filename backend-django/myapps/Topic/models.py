@@ -1,7 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from django.core.validators import MinValueValidator
 from decimal import Decimal
+import hashlib
+import json
 # Create your models here.
 
 # 軟刪除管理器
@@ -29,6 +32,10 @@ class UserFavorite(models.Model):
     deleted_at = models.DateTimeField(null=True, blank=True)
     class Meta:
         db_table = "UserFavorite"
+        # 軟刪除欄位放在等值前綴：MySQL 不支援 partial index，(..., deleted_at) 在 SQLite / MySQL 都能走 IS NULL 的 ref
+        indexes = [
+            models.Index(fields=["user", "deleted_at"], name="fav_user_live_idx"),
+        ]
 # 題目資料
 # 儲存題目資訊
 # quiz_topic: 題目名稱
@@ -68,6 +75,9 @@ class Topic(models.Model):
     
     class Meta:
         db_table = "Topic"
+        indexes = [
+            models.Index(fields=["quiz_topic", "deleted_at", "created_at"], name="topic_quiz_live_idx"),
+        ]
 
     def soft_delete(self):
         """軟刪除 Topic"""
@@ -79,6 +89,19 @@ class Topic(models.Model):
         self.deleted_at = None
         self.save()
 
+    # AI 對話用的題目內容欄位
+    CHAT_CONTEXT_FIELDS = ('title', 'option_A', 'option_B', 'option_C', 'option_D', 'Ai_answer', 'explanation_text')
+
+    def chat_context(self):
+        """
+        回傳 (version, topic_data)
+        version 是題目內容的雜湊：題目被修改後自動改變，不需要另外清快取
+        """
+        topic_data = {'id': self.id}
+        topic_data.update({field: getattr(self, field) for field in self.CHAT_CONTEXT_FIELDS})
+        raw = json.dumps(topic_data, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16], topic_data
+
 # 考題題目
 #儲存考題名稱
 # quiz_topic: 考題名稱
@@ -98,32 +121,31 @@ class Quiz(models.Model):
     
     class Meta:
         db_table = "Quiz"
+        indexes = [
+            models.Index(fields=["user", "deleted_at", "created_at"], name="quiz_user_live_idx"),
+        ]
     
     def soft_delete(self):
-        """軟刪除 Quiz 及其相關的 Topic"""
-        # 軟刪除自己
-        self.deleted_at = timezone.now()
-        self.save()
-        
-        # 軟刪除所有相關的 Topic
-        topics = Topic.all_objects.filter(quiz_topic=self, deleted_at__isnull=True)
-        for topic in topics:
-            topic.soft_delete()
+        """軟刪除 Quiz 及其相關的 Topic、Note、收藏"""
+        deleted_at, counts = soft_delete_quizzes([self.pk])
+        if counts['quizzes']:
+            self.deleted_at = deleted_at
+        return counts
     
     def restore(self):
-        """恢復軟刪除的 Quiz"""
+        """恢復軟刪除的 Quiz 及跟著它一起被刪除的 Topic、Note、收藏"""
+        counts = restore_quizzes([self.pk])
         self.deleted_at = None
-        self.save()
+        return counts
     
     @classmethod
     def soft_delete_old_quizzes_except_latest(cls, quiz_topic_name, latest_quiz_id):
         """軟刪除同名的舊 Quiz，保留最新的"""
-        old_quizzes = cls.objects.filter(
+        old_quiz_ids = cls.objects.filter(
             quiz_topic=quiz_topic_name
-        ).exclude(id=latest_quiz_id)
+        ).exclude(id=latest_quiz_id).values_list('id', flat=True)
         
-        for quiz in old_quizzes:
-            quiz.soft_delete()
+        return soft_delete_quizzes(old_quiz_ids)
 
 # 使用者熟悉度
 # 儲存使用者對考題的熟悉度
@@ -206,6 +228,10 @@ class Note(models.Model):
     
     class Meta:
         db_table = "Note"
+        indexes = [
+            models.Index(fields=["user", "deleted_at", "created_at"], name="note_user_live_idx"),
+            models.Index(fields=["user", "quiz_topic", "deleted_at", "created_at"], name="note_user_quiz_live_idx"),
+        ]
     
     def soft_delete(self):
         """軟刪除 Note"""
@@ -235,6 +261,29 @@ class Chat(models.Model):
     deleted_at = models.DateTimeField(null=True, blank=True)
     class Meta:
         db_table = "Chat"
+        indexes = [
+            # 對話紀錄依題目、時間排序（id 由索引隱含帶上，可做 (created_at, id) keyset）
+            models.Index(fields=["topic", "deleted_at", "created_at"], name="chat_topic_live_idx"),
+            # 送給 AI 的歷史視窗：依使用者＋題目取最新幾則（order by id）
+            models.Index(fields=["user", "topic", "deleted_at"], name="chat_user_topic_live_idx"),
+        ]
+
+# 對話滾動摘要
+# 每個 (user, topic) 一筆，較舊的對話壓縮成摘要，只保留最近幾輪原文送給 AI
+# summary: 摘要內容
+# last_chat_id: 已納入摘要的最後一筆 Chat id
+# updated_at: 更新時間
+class ChatSummary(models.Model):
+    user = models.ForeignKey("Authorization.User", on_delete=models.CASCADE)
+    topic = models.ForeignKey("Topic.Topic", on_delete=models.CASCADE)
+    summary = models.TextField(blank=True, default="")
+    last_chat_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    class Meta:
+        db_table = "ChatSummary"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "topic"], name="uq_chat_summary_user_topic"),
+        ]
 
 # AI 提示資料庫
 # 儲存 AI 提示內容
@@ -265,3 +314,73 @@ class AiInteraction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     class Meta:
         db_table = "AiInteraction"
+
+
+# 軟刪除 cascade
+# 同一次刪除的 Quiz 與其 Topic / Note / UserFavorite 共用同一個 deleted_at，全部以幾條 set-based UPDATE 在同一個交易內完成
+# 恢復時只帶回 deleted_at >= Quiz.deleted_at 的子資料，刪除 Quiz 之前就被單獨刪掉的不會跟著恢復
+def _quiz_favorites(quiz_ids):
+    return (
+        Q(quiz_id__in=quiz_ids)
+        | Q(topic__quiz_topic_id__in=quiz_ids)
+        | Q(note__quiz_topic_id__in=quiz_ids)
+    )
+
+
+def soft_delete_quizzes(quiz_ids, deleted_at=None):
+    """
+    軟刪除多個 Quiz（已刪除的略過）及其相關資料
+    回傳 (deleted_at, {'quizzes': n, 'topics': n, 'notes': n, 'favorites': n})
+    """
+    deleted_at = deleted_at or timezone.now()
+    with transaction.atomic():
+        live_ids = list(
+            Quiz.all_objects.filter(id__in=list(quiz_ids), deleted_at__isnull=True).values_list('id', flat=True)
+        )
+        if not live_ids:
+            return deleted_at, {'quizzes': 0, 'topics': 0, 'notes': 0, 'favorites': 0}
+
+        counts = {
+            'topics': Topic.all_objects.filter(
+                quiz_topic_id__in=live_ids, deleted_at__isnull=True
+            ).update(deleted_at=deleted_at),
+            'notes': Note.all_objects.filter(
+                quiz_topic_id__in=live_ids, deleted_at__isnull=True
+            ).update(deleted_at=deleted_at),
+            'favorites': UserFavorite.objects.filter(
+                _quiz_favorites(live_ids), deleted_at__isnull=True
+            ).update(deleted_at=deleted_at),
+            # Quiz 最後更新：前面的子資料都以刪除前的狀態判斷
+            'quizzes': Quiz.all_objects.filter(id__in=live_ids).update(deleted_at=deleted_at),
+        }
+    return deleted_at, counts
+
+
+def restore_quizzes(quiz_ids):
+    """
+    恢復多個軟刪除的 Quiz 及跟著一起被刪除的相關資料
+    回傳 {'quizzes': n, 'topics': n, 'notes': n, 'favorites': n}
+    """
+    with transaction.atomic():
+        deleted_ids = list(
+            Quiz.all_objects.filter(id__in=list(quiz_ids), deleted_at__isnull=False).values_list('id', flat=True)
+        )
+        if not deleted_ids:
+            return {'quizzes': 0, 'topics': 0, 'notes': 0, 'favorites': 0}
+
+        counts = {
+            'topics': Topic.all_objects.filter(
+                quiz_topic_id__in=deleted_ids, deleted_at__gte=F('quiz_topic__deleted_at')
+            ).update(deleted_at=None),
+            'notes': Note.all_objects.filter(
+                quiz_topic_id__in=deleted_ids, deleted_at__gte=F('quiz_topic__deleted_at')
+            ).update(deleted_at=None),
+            'favorites': UserFavorite.objects.filter(
+                Q(quiz_id__in=deleted_ids, deleted_at__gte=F('quiz__deleted_at'))
+                | Q(topic__quiz_topic_id__in=deleted_ids, deleted_at__gte=F('topic__quiz_topic__deleted_at'))
+                | Q(note__quiz_topic_id__in=deleted_ids, deleted_at__gte=F('note__quiz_topic__deleted_at'))
+            ).update(deleted_at=None),
+            # Quiz 最後恢復：前面的子資料要用 Quiz.deleted_at 判斷
+            'quizzes': Quiz.all_objects.filter(id__in=deleted_ids).update(deleted_at=None),
+        }
+    return counts
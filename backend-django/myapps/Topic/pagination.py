@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination
+
+
+# 以 id 遞減排序的 cursor 分頁：翻頁成本固定，不受資料量與新增資料影響
+class IdCursorPagination(CursorPagination):
+    ordering = '-id'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    @classmethod
+    def requested(cls, request):
+        """有帶 cursor 或 page_size 參數時才分頁，維持舊呼叫端拿到完整列表的行為"""
+        return 'cursor' in request.query_params or cls.page_size_query_param in request.query_params
+
+
+# 對話紀錄：依 (created_at, id) 由新到舊，第一頁是最新的訊息，next 往更舊的訊息翻
+class ChatCursorPagination(IdCursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 50
@@ -55,6 +55,13 @@ class ChatSerializer(serializers.ModelSerializer):
         }
 
 
+# 精簡版對話訊息：題目與使用者只在回應外層出現一次，訊息內只帶 user id
+class ChatMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Chat
+        fields = ['id', 'user', 'sender', 'content', 'created_at']
+
+
 class NoteSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     topic = TopicSerializer(read_only=True)
@@ -112,6 +119,15 @@ class AddFavoriteTopicSerializer(serializers.ModelSerializer):
         model = Topic
         fields = ['id','title', 'quiz_topic']
 
+# 筆記列表用的扁平格式：關聯只帶 id（加上 Quiz 名稱），不巢狀 user / topic / quiz
+class NoteListSerializer(serializers.ModelSerializer):
+    quiz_topic_title = serializers.CharField(source='quiz_topic.quiz_topic', read_only=True)
+
+    class Meta:
+        model = Note
+        fields = ['id', 'title', 'content', 'quiz_topic', 'quiz_topic_title', 'topic', 'is_retake', 'created_at', 'updated_at']
+
+
 class NoteSimplifiedSerializer(serializers.ModelSerializer):
     quiz_topic_id = serializers.PrimaryKeyRelatedField(source='quiz_topic', read_only=True)
     class Meta:
@@ -1,11 +1,11 @@
 # apps/learning/services.py
 from decimal import Decimal, ROUND_HALF_UP
-from django.db import transaction
-from django.db.models import F
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
-from .models import UserFamiliarity ,Quiz, Note, DifficultyLevels 
+from .models import UserFamiliarity ,Quiz, Note
+from .difficulty_registry import get_level
 # 你的 UserFamiliarity 定義在這個 app
 
 User = get_user_model()
@@ -22,19 +22,6 @@ def _q(x) -> Decimal:
 def _clamp01(x: Decimal) -> Decimal:
     return max(Decimal('0'), min(ONE, x))
 
-def _get_alpha(level: DifficultyLevels) -> Decimal:
-    """
-    從 DifficultyLevels.weight_coefficients 取 alpha，預設 0.20
-    例：{"alpha": 0.25}
-    """
-    wc = level.weight_coefficients or {}
-    alpha = wc.get('alpha', 0.20)
-    return _q(alpha)
-
-def _get_cap(level: DifficultyLevels) -> Decimal:
-    # familiarity_cap 期望是 0.30 / 0.50 / 0.70 / 1.00 這類 0~1 的上限
-    return _q(level.familiarity_cap)
-
 @transaction.atomic
 def update_familiarity_weighted_average(
     *,
@@ -61,19 +48,49 @@ def update_familiarity_weighted_average(
     回傳：
       - 更新後 familiarity（百分比，Decimal，兩位小數）
     """
+    ensure_live_quiz(quiz_topic_id)
+
+    return _upsert_familiarity(
+        user_id=user.pk,
+        quiz_topic_id=quiz_topic_id,
+        **build_attempt(
+            difficulty_level_id=difficulty_level_id,
+            difficulty_level_name=difficulty_level_name,
+            accuracy=accuracy,
+            total_questions_this_run=total_questions_this_run,
+            correct_answers_this_run=correct_answers_this_run,
+            note_id=note_id,
+        )
+    )
 
-    # 1) 取 Quiz / Difficulty level
-    quiz = Quiz.objects.select_for_update().get(pk=quiz_topic_id)
 
-    if difficulty_level_id is not None:
-        level = DifficultyLevels.objects.get(pk=difficulty_level_id)
-    elif difficulty_level_name is not None:
-        level = DifficultyLevels.objects.get(level_name=difficulty_level_name)
-    else:
-        raise ValueError("difficulty_level_id 或 difficulty_level_name 需擇一提供")
+def ensure_live_quiz(quiz_topic_id) -> None:
+    """
+    Quiz 不存在或已軟刪除時丟 Quiz.DoesNotExist
+    不能只靠外鍵：SQLite 的外鍵檢查延後到 commit 才失敗，而且擋不住軟刪除的 Quiz
+    """
+    if not Quiz.objects.filter(pk=quiz_topic_id, deleted_at__isnull=True).exists():
+        raise Quiz.DoesNotExist(f"Quiz {quiz_topic_id} not found")
 
-    cap   = _get_cap(level)      # 0.3 / 0.5 / 0.7 / 1.0
-    alpha = _get_alpha(level)    # 例：0.20
+
+def build_attempt(
+    *,
+    difficulty_level_id: int | None = None,
+    difficulty_level_name: str | None = None,
+    accuracy: float | Decimal | None = None,
+    total_questions_this_run: int | None = None,
+    correct_answers_this_run: int | None = None,
+    note_id: int | None = None,
+) -> dict:
+    """
+    把一次作答換算成熟悉度更新需要的量（與 user / quiz 無關，可先算好再決定何時寫入）
+    熟悉度：new = old*keep + gain（百分比），已達 cap_pct 時不變
+    """
+    # 1) 取 Difficulty level（行程內快取，cap / alpha 已解析好）
+    level = get_level(pk=difficulty_level_id, name=difficulty_level_name)
+
+    cap   = level.cap      # 0.3 / 0.5 / 0.7 / 1.0
+    alpha = level.alpha    # 例：0.20
 
     # 2) 算 accuracy（0~1）
     if accuracy is None:
@@ -89,73 +106,123 @@ def update_familiarity_weighted_average(
     # 3) this_run = accuracy * cap（0~1 區間）
     this_run = (acc * cap).quantize(DEC4)
 
-    # 4) 取或創 UserFamiliarity
-    uf, created = UserFamiliarity.objects.select_for_update().get_or_create(
-        user=user,
-        quiz_topic=quiz,
-        defaults={
-            "note_id": note_id,
-            "difficulty_level": level,
-            "total_questions": 0,
-            "correct_answers": 0,
-            "weighted_total": Decimal('0.00'),
-            "weighted_correct": Decimal('0.00'),
-            "cap_weighted_sum": Decimal('0.00'),
-            "familiarity": Decimal('0.00'),  # 百分比
-        }
-    )
-
-    # 5) 舊熟悉度（先轉回 0~1 區間再算）
-    old_pct = _q(uf.familiarity) / HUNDRED
-    old = _clamp01(old_pct)
-
-    # 5.5) 檢查是否已達到該難度上限，如果是則不更新熟悉度
-    current_familiarity_pct = _q(uf.familiarity)  # 當前熟悉度百分比 (0~100)
-    difficulty_cap_pct = cap * HUNDRED  # 難度上限轉成百分比 (0~100)
-    
-    if current_familiarity_pct >= difficulty_cap_pct:
-        # 已達到或超過該難度上限，不更新熟悉度，但仍更新統計資料
-        new_pct = current_familiarity_pct
-    else:
-        # 6) 權重平均更新（0~1）
-        new01 = (old * (ONE - alpha) + this_run * alpha)
-        new01 = _clamp01(new01)
-
-        # 7) 轉回百分比並四捨五入兩位
-        new_pct = (new01 * HUNDRED).quantize(DEC2, rounding=ROUND_HALF_UP)
-
-    # 8) 累加其它統計欄位（可做分析用；不影響熟悉度主邏輯）
+    # 4) 累加的統計欄位（可做分析用；不影響熟悉度主邏輯）
+    add_total = add_correct = 0
+    add_w_total = add_w_correct = add_cap_sum = Decimal('0.00')
     if total_questions_this_run:
-        uf.total_questions = F('total_questions') + int(total_questions_this_run)
-        if correct_answers_this_run is not None:
-            uf.correct_answers = F('correct_answers') + int(correct_answers_this_run)
-
+        add_total = int(total_questions_this_run)
+        add_correct = int(correct_answers_this_run or 0)
         # 加權統計（以 cap 當作權重範例：也可以改 α 當權重，看你想分析什麼）
-        # 這裡用 2 位小數即可（你的欄位 decimal_places=2）
         add_w_total   = (Decimal(str(total_questions_this_run)) * cap).quantize(DEC2)
         add_w_correct = (Decimal(str(correct_answers_this_run or 0)) * cap).quantize(DEC2)
+        add_cap_sum   = cap.quantize(DEC2)
+
+    # 5) 這次的 Note（可選，不存在就不覆蓋）
+    if note_id is not None and not Note.objects.filter(pk=note_id).exists():
+        note_id = None
+
+    # 6) 權重平均改寫成百分比：new = old*(1 - alpha) + this_run*alpha*100
+    #    已達該難度上限時不更新熟悉度，但仍更新統計資料
+    return {
+        "note_id": note_id,
+        "level_id": level.id,
+        "cap_pct": level.cap_pct,
+        "keep": (ONE - alpha).quantize(DEC4),
+        "gain": (this_run * alpha * HUNDRED).quantize(DEC4),
+        "add_total": add_total,
+        "add_correct": add_correct,
+        "add_w_total": add_w_total,
+        "add_w_correct": add_w_correct,
+        "add_cap_sum": add_cap_sum,
+    }
+
+
+def ewma_step(pct: Decimal, attempt: dict) -> Decimal:
+    """在 Python 算一次權重平均（與 _upsert_familiarity 的 CASE 相同）"""
+    pct = _q(pct).quantize(DEC2)
+    if pct >= attempt["cap_pct"]:
+        return pct
+    return (pct * attempt["keep"] + attempt["gain"]).quantize(DEC2, rounding=ROUND_HALF_UP)
+
+
+def apply_attempt(uf: UserFamiliarity, attempt: dict) -> None:
+    """把一次作答套用到記憶體中的 UserFamiliarity（write-behind 批次寫入用，不存檔）"""
+    uf.familiarity = ewma_step(uf.familiarity, attempt)
+    uf.total_questions += attempt["add_total"]
+    uf.correct_answers += attempt["add_correct"]
+    uf.weighted_total = _q(uf.weighted_total).quantize(DEC2) + attempt["add_w_total"]
+    uf.weighted_correct = _q(uf.weighted_correct).quantize(DEC2) + attempt["add_w_correct"]
+    uf.cap_weighted_sum = _q(uf.cap_weighted_sum).quantize(DEC2) + attempt["add_cap_sum"]
+    if attempt["note_id"] is not None:
+        uf.note_id = attempt["note_id"]
+    uf.difficulty_level_id = attempt["level_id"]
+
+
+def _upsert_familiarity(*, user_id, quiz_topic_id, note_id, level_id, cap_pct, keep, gain,
+                        add_total, add_correct, add_w_total, add_w_correct, add_cap_sum) -> Decimal:
+    """
+    一條 INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE 完成熟悉度更新（靠 uq_user_quiz_topic）
+    - 沒有記錄：從 0 算一次權重平均，連同本次統計新增一筆
+    - 已有記錄：在資料庫內以 CASE 判斷上限、算權重平均並累加統計，不需要先讀再寫
+    回傳更新後 familiarity（百分比）
+    """
+    meta = UserFamiliarity._meta
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
 
-        uf.weighted_total   = F('weighted_total') + add_w_total
-        uf.weighted_correct = F('weighted_correct') + add_w_correct
-        uf.cap_weighted_sum = F('cap_weighted_sum') + cap.quantize(DEC2)
-
-    # 9) 這次的 Note 與難度記錄（可選）
-    if note_id is not None:
-        try:
-            uf.note = Note.objects.get(pk=note_id)
-        except ObjectDoesNotExist:
-            pass
-    uf.difficulty_level = level
-
-    # 10) 寫回熟悉度
-    uf.familiarity = new_pct  # 百分比
-    uf.save(update_fields=[
-        "note", "difficulty_level", "total_questions", "correct_answers",
-        "weighted_total", "weighted_correct", "cap_weighted_sum",
-        "familiarity", "updated_at"
-    ])
+    def col(name):
+        return qn(meta.get_field(name).column)
 
-    # 拿 F() 後的實值
-    uf.refresh_from_db(fields=["familiarity"])
+    def cur(name):
+        return f"{table}.{col(name)}"
 
-    return uf.familiarity  # 百分比（0~100）
+    now = timezone.now()
+    insert_cols = [
+        "user", "quiz_topic", "note", "difficulty_level",
+        "total_questions", "correct_answers",
+        "weighted_total", "weighted_correct", "cap_weighted_sum",
+        "familiarity", "updated_at",
+    ]
+    insert_params = [
+        user_id, quiz_topic_id, note_id, level_id,
+        add_total, add_correct,
+        add_w_total, add_w_correct, add_cap_sum,
+        ewma_step(Decimal('0.00'), {"cap_pct": cap_pct, "keep": keep, "gain": gain}), now,
+    ]
+    assignments = [
+        (f"{col('familiarity')} = CASE WHEN {cur('familiarity')} >= %s THEN {cur('familiarity')} "
+         f"ELSE ROUND({cur('familiarity')} * %s + %s, 2) END", [cap_pct, keep, gain]),
+        (f"{col('total_questions')} = {cur('total_questions')} + %s", [add_total]),
+        (f"{col('correct_answers')} = {cur('correct_answers')} + %s", [add_correct]),
+        (f"{col('weighted_total')} = {cur('weighted_total')} + %s", [add_w_total]),
+        (f"{col('weighted_correct')} = {cur('weighted_correct')} + %s", [add_w_correct]),
+        (f"{col('cap_weighted_sum')} = {cur('cap_weighted_sum')} + %s", [add_cap_sum]),
+        (f"{col('note')} = COALESCE(%s, {cur('note')})", [note_id]),
+        (f"{col('difficulty_level')} = %s", [level_id]),
+        (f"{col('updated_at')} = %s", [now]),
+    ]
+
+    sql = (
+        f"INSERT INTO {table} ({', '.join(col(name) for name in insert_cols)}) "
+        f"VALUES ({', '.join(['%s'] * len(insert_cols))}) "
+    )
+    if connection.vendor == 'mysql':
+        sql += "ON DUPLICATE KEY UPDATE "
+    else:
+        sql += f"ON CONFLICT ({col('user')}, {col('quiz_topic')}) DO UPDATE SET "
+    sql += ", ".join(clause for clause, _ in assignments)
+    params = insert_params + [p for _, clause_params in assignments for p in clause_params]
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            # MySQL 沒有 RETURNING；這筆 row 鎖在交易結束前都由我們持有，直接讀回即可
+            cursor.execute(sql, params)
+            cursor.execute(
+                f"SELECT {col('familiarity')} FROM {table} WHERE {col('user')} = %s AND {col('quiz_topic')} = %s",
+                [user_id, quiz_topic_id],
+            )
+        else:
+            cursor.execute(sql + f" RETURNING {col('familiarity')}", params)
+        familiarity = cursor.fetchone()[0]
+
+    return _q(familiarity).quantize(DEC2, rounding=ROUND_HALF_UP)  # 百分比（0~100）
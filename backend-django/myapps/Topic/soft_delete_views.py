@@ -1,8 +1,7 @@
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.utils import timezone
-from .models import Quiz, Topic, Note
+from .models import Quiz
 
 # 軟刪除管理視圖
 class SoftDeleteManagementViewSet(APIView):
@@ -13,21 +12,15 @@ class SoftDeleteManagementViewSet(APIView):
         try:
             quiz = Quiz.objects.get(id=quiz_id)
             
-            # 獲取相關的 Note 數量（在軟刪除前）
-            related_notes = Note.objects.filter(quiz_topic=quiz, deleted_at__isnull=True)
-            notes_count = related_notes.count()
-            
-            # 軟刪除 Quiz（這會自動軟刪除相關的 Topic）
-            quiz.soft_delete()
-            
-            # 軟刪除相關的 Note
-            current_time = timezone.now()
-            related_notes.update(deleted_at=current_time)
+            # 軟刪除 Quiz，相關的 Topic、Note、收藏一起以同一個時間戳記刪除
+            counts = quiz.soft_delete()
             
             return Response({
                 'message': f'Quiz "{quiz.quiz_topic}" and all its topics have been soft deleted',
-                'deleted_notes_count': notes_count,
-                'deleted_at': current_time.isoformat()
+                'deleted_topics_count': counts['topics'],
+                'deleted_notes_count': counts['notes'],
+                'deleted_favorites_count': counts['favorites'],
+                'deleted_at': quiz.deleted_at.isoformat()
             })
             
         except Quiz.DoesNotExist:
@@ -40,23 +33,17 @@ class SoftDeleteManagementViewSet(APIView):
             }, status=500)
     
     def post(self, request, quiz_id):
-        """恢復軟刪除的 Quiz 及其相關 Note"""
+        """恢復軟刪除的 Quiz 及跟著它一起被刪除的 Topic、Note、收藏"""
         try:
             quiz = Quiz.all_objects.get(id=quiz_id)
             
-            # 獲取相關的軟刪除 Note 數量（使用 all_objects 管理器）
-            related_notes = Note.all_objects.filter(quiz_topic=quiz, deleted_at__isnull=False)
-            notes_count = related_notes.count()
-            
-            # 恢復 Quiz
-            quiz.restore()
-            
-            # 恢復相關的 Note
-            related_notes.update(deleted_at=None)
+            counts = quiz.restore()
             
             return Response({
                 'message': f'Quiz "{quiz.quiz_topic}" has been restored',
-                'restored_notes_count': notes_count
+                'restored_topics_count': counts['topics'],
+                'restored_notes_count': counts['notes'],
+                'restored_favorites_count': counts['favorites']
             })
             
         except Quiz.DoesNotExist:
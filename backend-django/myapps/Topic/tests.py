@@ -1,3 +1,565 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from myapps.Authorization.models import User
+from . import chat_history, difficulty_registry, familiarity_buffer
+from .models import (
+    Chat, ChatSummary, DifficultyLevels, Note, Quiz, Topic, UserFamiliarity, UserFavorite,
+    restore_quizzes, soft_delete_quizzes,
+)
+from .services import update_familiarity_weighted_average
+
+
+def make_user(email="u@example.com"):
+    return User.objects.create(username=email.split("@")[0], email=email)
+
+
+def quiz_question(i):
+    return {
+        "title": f"Q{i}", "option_A": "a", "option_B": "b", "option_C": "c", "option_D": "d",
+        "Ai_answer": "A", "explanation_text": "e", "difficulty_id": 1,
+    }
+
+
+class QuizCreateTests(TestCase):
+    """非串流出題：回傳的 Topic id 必須是這次請求自己建立的"""
+
+    def setUp(self):
+        difficulty_registry.invalidate()
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _create(self):
+        flask_response = mock.Mock(status_code=201)
+        flask_response.json.return_value = {
+            "quiz_topic": "python", "questions": [quiz_question(1), quiz_question(2)],
+        }
+        with mock.patch("myapps.Topic.views.requests.post", return_value=flask_response):
+            return self.client.post("/api/quiz/", {"user_id": self.user.id, "topic": "python"}, format="json")
+
+    def _assert_own_topics(self, response):
+        self.assertEqual(response.status_code, 200)
+        ids = [t["id"] for t in response.data["topics"]]
+        self.assertEqual(
+            list(Topic.objects.filter(id__in=ids).order_by("id").values_list("title", flat=True)), ["Q1", "Q2"]
+        )
+
+    def test_bulk_insert_returns_ids(self):
+        self._assert_own_topics(self._create())
+
+    def test_backend_without_returned_ids_inserts_row_by_row(self):
+        with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert", False), \
+                mock.patch.object(Topic.objects, "bulk_create") as bulk_create:
+            response = self._create()
+        bulk_create.assert_not_called()
+        self._assert_own_topics(response)
+        # 同一個 Quiz 再出一次題，回傳的仍是這次的兩題而不是混到前一次的
+        with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert", False):
+            second = self._create()
+        self._assert_own_topics(second)
+        self.assertTrue(set(t["id"] for t in second.data["topics"]).isdisjoint(
+            t["id"] for t in response.data["topics"]
+        ))
+
+
+class QuizStreamTests(TestCase):
+    """串流出題：每收到一題就存成 Topic 並轉送，最後的 done 帶資料庫 id"""
+
+    def setUp(self):
+        difficulty_registry.invalidate()
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _stream(self, lines, status_code=201):
+        flask_response = mock.Mock(status_code=status_code, text="boom")
+        flask_response.iter_lines.return_value = iter(lines)
+        with mock.patch("myapps.Topic.views.requests.post", return_value=flask_response) as post:
+            response = self.client.post("/api/quiz/", {
+                "user_id": self.user.id, "topic": "python", "difficulty": "beginner",
+                "question_count": 2, "stream": True,
+            }, format="json")
+            if status_code not in (200, 201):
+                return response, post, []
+            events = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        return response, post, events
+
+    def test_questions_are_saved_as_they_arrive(self):
+        response, post, events = self._stream([
+            json.dumps({"type": "question", "index": 1, "question": quiz_question(1)}),
+            json.dumps({"type": "question", "index": 2, "question": quiz_question(2)}),
+            json.dumps({"type": "done", "quiz_topic": "python", "count": 2}),
+        ])
+        self.assertEqual(post.call_args.kwargs["json"]["stream_format"], "ndjson")
+        self.assertEqual([e["type"] for e in events], ["question", "question", "done"])
+        saved = list(Topic.objects.order_by("id"))
+        self.assertEqual([t.title for t in saved], ["Q1", "Q2"])
+        self.assertEqual(events[0]["topic"]["id"], saved[0].id)
+        self.assertEqual([t["id"] for t in events[-1]["topics"]], [t.id for t in saved])
+        quiz = Quiz.objects.get()
+        self.assertEqual((events[-1]["quiz"]["id"], quiz.quiz_topic), (quiz.id, "python"))
+
+    def test_malformed_line_keeps_saved_questions(self):
+        _, _, events = self._stream([
+            json.dumps({"type": "question", "index": 1, "question": quiz_question(1)}),
+            "{oops",
+        ])
+        self.assertEqual([e["type"] for e in events], ["question", "error"])
+        self.assertEqual(Topic.objects.count(), 1)
+
+    def test_flask_error_creates_nothing(self):
+        response, _, _ = self._stream([], status_code=500)
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(Quiz.objects.exists())
+
+
+class ChatHistoryPaginationTests(TestCase):
+    """精簡格式的對話紀錄：(created_at, id) keyset 分頁"""
+
+    def setUp(self):
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        quiz = Quiz.objects.create(quiz_topic="q", user=self.user)
+        self.topic = Topic.objects.create(quiz_topic=quiz, title="t")
+        Chat.objects.bulk_create([
+            Chat(topic=self.topic, user=self.user, content=f"m{i}", sender="user")
+            for i in range(120)
+        ])
+        base = timezone.now()
+        for i, chat in enumerate(Chat.objects.order_by("id")):
+            Chat.objects.filter(pk=chat.pk).update(created_at=base + timedelta(seconds=i))
+
+    def _contents(self, response):
+        return [m["content"] for m in response.data["messages"]]
+
+    def test_scroll_back_through_pages(self):
+        response = self.client.get("/api/chat/", {"topic_id": self.topic.id, "compact": "true"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._contents(response), [f"m{i}" for i in range(70, 120)])
+        self.assertIsNone(response.data["newer"])
+
+        response = self.client.get(response.data["older"])
+        self.assertEqual(self._contents(response), [f"m{i}" for i in range(20, 70)])
+
+        response = self.client.get(response.data["older"])
+        self.assertEqual(self._contents(response), [f"m{i}" for i in range(0, 20)])
+        self.assertIsNone(response.data["older"])
+
+        response = self.client.get(response.data["newer"])
+        self.assertEqual(self._contents(response), [f"m{i}" for i in range(20, 70)])
+
+    def test_same_timestamp_does_not_repeat_messages(self):
+        Chat.objects.update(created_at=timezone.now())
+        seen = []
+        url, params = "/api/chat/", {"topic_id": self.topic.id, "compact": "true"}
+        while url:
+            response = self.client.get(url, params)
+            seen += self._contents(response)
+            url, params = response.data["older"], None
+        self.assertEqual(sorted(seen), sorted(f"m{i}" for i in range(120)))
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get("/api/chat/", {"topic_id": self.topic.id, "cursor": "bogus"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_non_numeric_topic_is_400(self):
+        response = self.client.get("/api/chat/", {"topic_id": "abc", "compact": "true"})
+        self.assertEqual(response.status_code, 400)
+
+
+class NoteListPaginationTests(TestCase):
+    """扁平格式的筆記列表：id 遞減的 cursor 分頁"""
+
+    def setUp(self):
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.quiz = Quiz.objects.create(quiz_topic="q", user=self.user)
+        other_quiz = Quiz.objects.create(quiz_topic="other", user=self.user)
+        self.notes = [
+            Note.objects.create(user=self.user, quiz_topic=self.quiz if i % 2 else other_quiz, content=f"n{i}")
+            for i in range(25)
+        ]
+        # 別人的筆記、已刪除的筆記、已刪除測驗底下的筆記都不該出現
+        Note.objects.create(user=make_user("x@example.com"), quiz_topic=self.quiz, content="other user")
+        Note.objects.create(user=self.user, quiz_topic=self.quiz, content="deleted", deleted_at=timezone.now())
+        gone = Quiz.objects.create(quiz_topic="gone", user=self.user, deleted_at=timezone.now())
+        Note.objects.create(user=self.user, quiz_topic=gone, content="deleted quiz")
+
+    def _walk(self, params):
+        seen, url = [], "/api/notes/"
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            seen += [n["content"] for n in response.data["results"]]
+            url, params = response.data["next"], None
+        return seen
+
+    def test_pages_cover_all_live_notes_newest_first(self):
+        response = self.client.get("/api/notes/", {"page_size": 10})
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertEqual(response.data["results"][0]["quiz_topic_title"], "other")
+        self.assertEqual(self._walk({"page_size": 10}), [f"n{i}" for i in reversed(range(25))])
+
+    def test_filter_by_quiz(self):
+        seen = self._walk({"compact": "true", "quiz_topic": self.quiz.id})
+        self.assertEqual(seen, [f"n{i}" for i in reversed(range(25)) if i % 2])
+
+    def test_non_numeric_quiz_topic_is_400(self):
+        response = self.client.get("/api/notes/", {"compact": "true", "quiz_topic": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get("/api/notes/", {"cursor": "bogus"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ChatSummaryTests(TestCase):
+    """對話摘要：請求中不呼叫摘要，背景逐段累加"""
+
+    def setUp(self):
+        self.user = make_user()
+        quiz = Quiz.objects.create(quiz_topic="q", user=self.user)
+        self.topic = Topic.objects.create(quiz_topic=quiz, title="t")
+        Chat.objects.bulk_create([
+            Chat(topic=self.topic, user=self.user, content=f"m{i}", sender="user")
+            for i in range(100)
+        ])
+        self.ids = list(Chat.objects.order_by("id").values_list("id", flat=True))
+        self.calls = []
+
+        def fake_summary(previous, messages, title):
+            self.calls.append((previous, [m["content"] for m in messages]))
+            return f"{previous}|{messages[0]['content']}-{messages[-1]['content']}"
+
+        patcher = mock.patch.object(chat_history, "_request_summary", side_effect=fake_summary)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_request_path_only_schedules_refresh(self):
+        with self.captureOnCommitCallbacks() as callbacks, \
+                mock.patch.object(chat_history, "_submit_refresh") as submit:
+            summary, window = chat_history.build_chat_context(self.user, self.topic)
+            submit.assert_not_called()
+        self.assertEqual(summary, "")
+        self.assertEqual(window[-1]["content"], "m99")
+        self.assertEqual(self.calls, [])
+        self.assertEqual(len(callbacks), 1)
+
+    def test_refresh_folds_all_older_messages_in_chunks(self):
+        with mock.patch.object(chat_history, "CHAT_SUMMARY_MAX_INPUT", 40):
+            chat_history.refresh_chat_summary(self.user.id, self.topic.id)
+        # 視窗 m88~m99，摘要到視窗最舊的 6 則（m93）為止，分三段送出
+        self.assertEqual([c[1][0] for c in self.calls], ["m0", "m40", "m80"])
+        self.assertEqual(self.calls[-1][1][-1], "m93")
+        row = ChatSummary.objects.get(user=self.user, topic=self.topic)
+        self.assertEqual(row.summary, "|m0-m39|m40-m79|m80-m93")
+        self.assertEqual(row.last_chat_id, self.ids[93])
+
+        summary, _ = chat_history.build_chat_context(self.user, self.topic)
+        self.assertEqual(summary, row.summary)
+
+    def test_refresh_stops_when_another_worker_advanced(self):
+        def advance_elsewhere(previous, messages, title):
+            ChatSummary.objects.update(last_chat_id=self.ids[50], summary="other")
+            return "mine"
+
+        chat_history._request_summary.side_effect = advance_elsewhere
+        chat_history.refresh_chat_summary(self.user.id, self.topic.id)
+        row = ChatSummary.objects.get(user=self.user, topic=self.topic)
+        self.assertEqual((row.summary, row.last_chat_id), ("other", self.ids[50]))
+
+
+class SoftDeleteCascadeTests(TestCase):
+    """Quiz 軟刪除連帶 Topic / Note / 收藏，恢復時只帶回一起被刪除的"""
+
+    def setUp(self):
+        self.user = make_user()
+        self.quiz = Quiz.objects.create(quiz_topic="q", user=self.user)
+        self.topics = [Topic.objects.create(quiz_topic=self.quiz, title=f"t{i}") for i in range(2)]
+        self.note = Note.objects.create(user=self.user, quiz_topic=self.quiz, topic=self.topics[0], content="n")
+        self.favorites = [
+            UserFavorite.objects.create(user=self.user, quiz=self.quiz),
+            UserFavorite.objects.create(user=self.user, topic=self.topics[1]),
+            UserFavorite.objects.create(user=self.user, note=self.note),
+        ]
+        self.other_quiz = Quiz.objects.create(quiz_topic="other", user=self.user)
+        self.other_topic = Topic.objects.create(quiz_topic=self.other_quiz, title="keep")
+
+    def _deleted_at(self, model, obj):
+        manager = getattr(model, "all_objects", model.objects)
+        return manager.get(pk=obj.pk).deleted_at
+
+    def test_cascade_shares_one_timestamp(self):
+        deleted_at, counts = soft_delete_quizzes([self.quiz.id])
+        self.assertEqual(counts, {"quizzes": 1, "topics": 2, "notes": 1, "favorites": 3})
+        stamps = {self._deleted_at(Quiz, self.quiz), self._deleted_at(Note, self.note)}
+        stamps |= {self._deleted_at(Topic, t) for t in self.topics}
+        stamps |= {self._deleted_at(UserFavorite, f) for f in self.favorites}
+        self.assertEqual(stamps, {deleted_at})
+        self.assertIsNone(self._deleted_at(Topic, self.other_topic))
+
+        # 已刪除的 Quiz 再刪一次不會動到時間戳記
+        self.assertEqual(soft_delete_quizzes([self.quiz.id])[1]["quizzes"], 0)
+        self.assertEqual(self._deleted_at(Quiz, self.quiz), deleted_at)
+
+    def test_restore_skips_children_deleted_earlier(self):
+        earlier = timezone.now() - timedelta(days=1)
+        Topic.all_objects.filter(pk=self.topics[1].pk).update(deleted_at=earlier)
+        UserFavorite.objects.filter(pk=self.favorites[2].pk).update(deleted_at=earlier)
+
+        soft_delete_quizzes([self.quiz.id])
+        counts = restore_quizzes([self.quiz.id])
+        self.assertEqual(counts, {"quizzes": 1, "topics": 1, "notes": 1, "favorites": 2})
+        self.assertIsNone(self._deleted_at(Quiz, self.quiz))
+        self.assertIsNone(self._deleted_at(Topic, self.topics[0]))
+        self.assertEqual(self._deleted_at(Topic, self.topics[1]), earlier)
+        self.assertIsNone(self._deleted_at(Note, self.note))
+        self.assertEqual(self._deleted_at(UserFavorite, self.favorites[2]), earlier)
+
+    def test_endpoint_round_trip(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f"/api/quiz/{self.quiz.id}/soft-delete/"
+
+        response = client.delete(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data["deleted_topics_count"], response.data["deleted_notes_count"],
+             response.data["deleted_favorites_count"]),
+            (2, 1, 3),
+        )
+        self.assertEqual(client.delete(url).status_code, 404)
+
+        response = client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["restored_topics_count"], 2)
+        self.assertFalse(UserFavorite.objects.filter(deleted_at__isnull=False).exists())
+
+
+class FamiliarityUpsertTests(TestCase):
+    """單一 UPSERT 的權重平均、上限與統計累加"""
+
+    def setUp(self):
+        # 難度快取以 on_commit 失效，TestCase 不會 commit，手動清掉
+        difficulty_registry.invalidate()
+        self.user = make_user()
+        self.quiz = Quiz.objects.create(quiz_topic="q", user=self.user)
+        self.level = DifficultyLevels.objects.create(
+            level_name="beginner", familiarity_cap=Decimal("0.50"), weight_coefficients={"alpha": 0.2}
+        )
+
+    def _submit(self, total, correct, quiz_id=None):
+        return update_familiarity_weighted_average(
+            user=self.user,
+            quiz_topic_id=quiz_id or self.quiz.id,
+            difficulty_level_id=self.level.id,
+            total_questions_this_run=total,
+            correct_answers_this_run=correct,
+        )
+
+    def test_ewma_sequence_and_counters(self):
+        # this_run = 1.0 * 0.5，gain = 0.5 * 0.2 * 100 = 10
+        self.assertEqual(self._submit(5, 5), Decimal("10.00"))
+        self.assertEqual(self._submit(5, 5), Decimal("18.00"))
+        # accuracy 0.4 -> gain 4；18 * 0.8 + 4 = 18.4
+        self.assertEqual(self._submit(5, 2), Decimal("18.40"))
+
+        uf = UserFamiliarity.objects.get(user=self.user, quiz_topic=self.quiz)
+        self.assertEqual(uf.familiarity, Decimal("18.40"))
+        self.assertEqual((uf.total_questions, uf.correct_answers), (15, 12))
+        self.assertEqual(uf.weighted_total, Decimal("7.50"))
+        self.assertEqual(uf.weighted_correct, Decimal("6.00"))
+        self.assertEqual(uf.cap_weighted_sum, Decimal("1.50"))
+        self.assertEqual(uf.difficulty_level_id, self.level.id)
+
+    def test_cap_reached_keeps_familiarity_but_counts(self):
+        self._submit(5, 5)
+        UserFamiliarity.objects.filter(user=self.user).update(familiarity=Decimal("50.00"))
+        self.assertEqual(self._submit(5, 0), Decimal("50.00"))
+        uf = UserFamiliarity.objects.get(user=self.user, quiz_topic=self.quiz)
+        self.assertEqual((uf.total_questions, uf.correct_answers), (10, 5))
+
+    def test_unknown_quiz_raises_does_not_exist(self):
+        with self.assertRaises(Quiz.DoesNotExist):
+            self._submit(5, 5, quiz_id=self.quiz.id + 1000)
+        self.assertFalse(UserFamiliarity.objects.exists())
+
+    def test_soft_deleted_quiz_is_rejected(self):
+        Quiz.all_objects.filter(pk=self.quiz.pk).update(deleted_at=timezone.now())
+        with self.assertRaises(Quiz.DoesNotExist):
+            self._submit(5, 5)
+        self.assertFalse(UserFamiliarity.objects.exists())
+
+
+class FamiliarityWriteBehindTests(TestCase):
+    """write-behind：提交後才進緩衝區，寫入失敗的作答留下紀錄"""
+
+    def setUp(self):
+        difficulty_registry.invalidate()
+        self.user = make_user()
+        self.quiz = Quiz.objects.create(quiz_topic="q", user=self.user)
+        self.level = DifficultyLevels.objects.create(
+            level_name="beginner", familiarity_cap=Decimal("0.50"), weight_coefficients={"alpha": 0.2}
+        )
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # 目錄還不存在：寫入時要自己建立
+        self.dead_letter = os.path.join(tmp.name, "var", "dead_letter.jsonl")
+        for patcher in [
+            mock.patch.object(familiarity_buffer, "FAMILIARITY_WRITE_BEHIND", True),
+            mock.patch.object(familiarity_buffer, "FAMILIARITY_DEAD_LETTER_FILE", self.dead_letter),
+            mock.patch.object(familiarity_buffer, "_ensure_flusher"),
+            mock.patch.dict(familiarity_buffer._pending, clear=True),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _record(self):
+        return familiarity_buffer.record_attempt(
+            user=self.user, quiz_topic_id=self.quiz.id, difficulty_level_id=self.level.id,
+            total_questions_this_run=5, correct_answers_this_run=5,
+        )
+
+    def test_rolled_back_attempt_is_not_buffered(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self._record()
+                    raise RuntimeError("rollback")
+            except RuntimeError:
+                pass
+        self.assertIsNone(familiarity_buffer.pending_familiarity(self.user.pk, self.quiz.id))
+
+    def test_committed_attempts_are_buffered_then_flushed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self._record(), Decimal("10.00"))
+        self.assertEqual(familiarity_buffer.pending_familiarity(self.user.pk, self.quiz.id), Decimal("10.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self._record(), Decimal("18.00"))
+
+        familiarity_buffer.flush()
+        uf = UserFamiliarity.objects.get(user=self.user, quiz_topic=self.quiz)
+        self.assertEqual((uf.familiarity, uf.total_questions), (Decimal("18.00"), 10))
+        self.assertEqual(familiarity_buffer.pending_familiarity(self.user.pk), {})
+
+    def test_failed_write_is_dead_lettered(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._record()
+        with mock.patch.object(UserFamiliarity.objects, "bulk_create", side_effect=IntegrityError("db down")):
+            familiarity_buffer.flush()
+        self.assertFalse(UserFamiliarity.objects.exists())
+        self.assertEqual(familiarity_buffer.pending_familiarity(self.user.pk), {})
+        with open(self.dead_letter, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]["user_id"], records[0]["quiz_topic_id"]), (self.user.pk, self.quiz.id))
+        self.assertEqual(len(records[0]["attempts"]), 1)
+        self.assertEqual(records[0]["error"], "db down")
+
+    def test_default_dead_letter_path_is_absolute(self):
+        # 預設放在 backend-django/var 底下，不受啟動目錄影響
+        path = settings.FAMILIARITY_DEAD_LETTER_FILE
+        self.assertTrue(path.is_absolute())
+        self.assertEqual(path.parent.parent, Path(__file__).resolve().parent.parent.parent)
+
+
+class SubmitAnswerBatchTests(TestCase):
+    """批次作答的格式檢查與批改"""
+
+    def setUp(self):
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        quiz = Quiz.objects.create(quiz_topic="q", user=self.user)
+        self.topics = [
+            Topic.objects.create(quiz_topic=quiz, title=f"t{i}", Ai_answer="A") for i in range(3)
+        ]
+
+    def _post(self, data):
+        return self.client.post("/api/submit_answer/", data, format="json")
+
+    def test_bad_entries_are_400_and_named(self):
+        cases = [
+            ([{"id": "abc", "user_answer": "A"}], "updates[0].id"),
+            ([{"id": self.topics[0].id, "user_answer": "A"}, {"user_answer": "B"}], "updates[1].id"),
+            ([{"id": self.topics[0].id, "user_answer": "A"}, "oops"], "updates[1]"),
+            ({"updates": "oops"}, "'updates' must be a list"),
+        ]
+        for data, expected in cases:
+            response = self._post(data)
+            self.assertEqual(response.status_code, 400, data)
+            self.assertIn(expected, response.data["error"])
+        self.assertFalse(Topic.objects.filter(User_answer__isnull=False).exists())
+
+    def test_batch_is_graded_against_stored_answers(self):
+        response = self._post({
+            "is_test": True,
+            "updates": [
+                {"id": self.topics[0].id, "user_answer": "A"},
+                {"id": self.topics[1].id, "user_answer": "B"},
+                {"id": self.topics[2].id, "user_answer": "A", "Ai_answer": "B"},
+            ],
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data["total_questions"], response.data["correct_answers"]), (3, 2))
+        self.assertEqual(
+            list(Topic.objects.order_by("id").values_list("User_answer", flat=True)), ["A", "B", "A"]
+        )
+
+    def test_unknown_topic_is_404(self):
+        response = self._post([{"id": self.topics[0].id + 1000, "user_answer": "A"}])
+        self.assertEqual(response.status_code, 404)
+
+
+class ChatStreamTests(TestCase):
+    """串流對話：Flask 送來無法解析的內容時轉成 error 事件"""
+
+    def setUp(self):
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        quiz = Quiz.objects.create(quiz_topic="q", user=self.user)
+        self.topic = Topic.objects.create(quiz_topic=quiz, title="t")
+
+    def _stream(self, lines):
+        flask_response = mock.Mock(status_code=200)
+        flask_response.iter_lines.return_value = iter(lines)
+        with mock.patch("myapps.Topic.views.requests.post", return_value=flask_response):
+            response = self.client.post("/api/chat/", {
+                "user_id": self.user.id, "topic_id": self.topic.id, "content": "hi", "stream": True,
+            }, format="json")
+            events = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        return events
+
+    def test_malformed_line_yields_error_and_keeps_partial(self):
+        events = self._stream([
+            json.dumps({"type": "delta", "content": "部分"}),
+            "{not json",
+            json.dumps({"type": "delta", "content": "不會送出"}),
+        ])
+        self.assertEqual([e["type"] for e in events], ["delta", "error"])
+        ai = Chat.objects.get(topic=self.topic, sender="ai")
+        self.assertEqual(ai.content, "部分")
 
-# Create your tests here.
+    def test_done_saves_response(self):
+        events = self._stream([
+            json.dumps({"type": "delta", "content": "答"}),
+            json.dumps({"type": "done", "response": "答案"}),
+        ])
+        self.assertEqual([e["type"] for e in events], ["delta", "done"])
+        self.assertEqual(events[-1]["ai_response"]["content"], "答案")
+        self.assertEqual(Chat.objects.filter(topic=self.topic, sender="ai").count(), 1)
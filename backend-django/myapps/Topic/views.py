@@ -1,9 +1,9 @@
 
 from django.shortcuts import render , get_object_or_404
-from django.http import JsonResponse
-from .serializers import UserFavoriteSerializer, TopicSerializer,  NoteSerializer, ChatSerializer, AiPromptSerializer ,AiInteractionSerializer ,QuizSerializer, UserFamiliaritySerializer, DifficultyLevelsSerializer , QuizSimplifiedSerializer ,UserFamiliaritySimplifiedSerializer , NoteSimplifiedSerializer , TopicSimplifiedSerializer , AddFavoriteTopicSerializer
+from django.http import JsonResponse, StreamingHttpResponse, Http404
+from .serializers import UserFavoriteSerializer, TopicSerializer,  NoteSerializer, ChatSerializer, AiPromptSerializer ,AiInteractionSerializer ,QuizSerializer, UserFamiliaritySerializer, DifficultyLevelsSerializer , QuizSimplifiedSerializer ,UserFamiliaritySimplifiedSerializer , NoteSimplifiedSerializer , TopicSimplifiedSerializer , AddFavoriteTopicSerializer , ChatMessageSerializer , NoteListSerializer
 from .models import UserFavorite, Topic,  Note, Chat, AiPrompt,AiInteraction , Quiz , UserFamiliarity, DifficultyLevels
-from myapps.Authorization.serializers import UserSerializer
+from myapps.Authorization.serializers import UserSerializer, UserSimplifiedSerializer
 from myapps.Authorization.models import User
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.views import APIView
@@ -11,8 +11,13 @@ from rest_framework.permissions import AllowAny , IsAuthenticated
 from rest_framework.decorators import api_view , permission_classes
 from django.utils import timezone
 from rest_framework.response import Response
-from django.db import transaction
-import os , requests
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from .chat_history import build_chat_context
+from .pagination import IdCursorPagination, ChatCursorPagination
+from .difficulty_registry import all_levels, level_name
+from .familiarity_buffer import record_attempt
+import os , requests , json
 
 FLASK_BASE_URL = os.getenv("FLASK_BASE_URL", "http://localhost:5000")
 DJANGO_BASE_URL = os.getenv("DJANGO_BASE_URL", "http://localhost:8000")
@@ -24,6 +29,9 @@ class QuizViewSet(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
+        # 串流模式：Flask 每生成一題就轉送一題，Django 邊收邊存
+        if request.data.get('stream') in (True, 'true', '1', 1):
+            return self._stream_quiz(request)
         try:
             # 傳給 Flask 做處理
             flask_response = requests.post(
@@ -61,66 +69,25 @@ class QuizViewSet(APIView):
                     'error': f'User with ID {user_id} not found'
                 }, status=400)
             
-            # 返回結果 寫回資料庫
-            # 先判斷 quiz_topic 是否有未軟刪除的 Quiz，有則不再新建
-            quiz_topic_name = result.get('quiz_topic')
-            quiz = Quiz.objects.filter(quiz_topic=quiz_topic_name, user_id=user_id, deleted_at__isnull=True).first()
-            if quiz:
-                print(f"Found existing Quiz: {quiz.quiz_topic} (ID: {quiz.id}) for user: {user_instance}")
-            else:
-                quiz = Quiz.objects.create(
-                    quiz_topic=quiz_topic_name,
-                    user=user_instance
-                )
-                print(f"Created new Quiz: {quiz.quiz_topic} (ID: {quiz.id}) for user: {user_instance}")
+            # 返回結果 寫回資料庫（Quiz、收藏、Topic 在同一個交易內完成）
+            questions = result.get('questions', [])
+            with transaction.atomic():
+                quiz = self._get_or_create_quiz(result.get('quiz_topic'), user_instance)
                 
-                # 自動添加到用戶收藏
-                try:
-                    UserFavorite.objects.create(
-                        user=user_instance,
-                        quiz=quiz
-                    )
-                    print(f"✅ 自動添加Quiz到用戶收藏: {quiz.quiz_topic}")
-                except Exception as e:
-                    print(f"⚠️ 添加收藏失敗: {str(e)}")
-                    # 不阻止主流程繼續
-            
-            # 然後創建 Topic，並關聯到 Quiz
-            topics = []
-            new_topic_ids = []
-            print(f"=== 開始創建 Topic ===")
-            print(f"準備創建 {len(result.get('questions', []))} 個 Topic")
-            
-            for i, q in enumerate(result.get('questions', []), 1):
-                print(f"創建第 {i} 個 Topic: {q.get('title', 'No title')}")
-                
-                # 處理難度等級
-                difficulty_id = q.get('difficulty_id', 1)
-                try:
-                    difficulty_instance = DifficultyLevels.objects.get(id=difficulty_id)
-                except DifficultyLevels.DoesNotExist:
-                    difficulty_instance = DifficultyLevels.objects.get(id=1)  # 預設 beginner
-                
-                topic = Topic.objects.create(
-                    quiz_topic=quiz,  # 關聯到 Quiz 實例
-                    title=q.get('title'),
-                    option_A=q.get('option_A'),
-                    option_B=q.get('option_B'),
-                    option_C=q.get('option_C'),
-                    option_D=q.get('option_D'),
-                    difficulty=difficulty_instance,  # 使用 difficulty 外鍵
-                    Ai_answer=q.get('Ai_answer'),
-                    explanation_text=q.get('explanation_text')
-                )
-                topics.append(topic)
-                new_topic_ids.append(topic.id)
-                print(f"成功創建 Topic ID: {topic.id}")
+                # 然後一次建立所有 Topic，難度等級從行程內的難度快取取得
+                print(f"=== 開始創建 Topic ===")
+                print(f"準備創建 {len(questions)} 個 Topic")
+                topics = [self._build_topic(quiz, q) for q in questions]
+                if connection.features.can_return_rows_from_bulk_insert:
+                    topics = Topic.objects.bulk_create(topics)
+                else:
+                    # MySQL 的 bulk_create 不會回填主鍵；事後依 Quiz 撈最新 N 筆會和同時出題的請求互相搶到對方的題目
+                    # 改成同一個交易內逐筆 INSERT，每筆都拿得到自己的主鍵
+                    for topic in topics:
+                        topic.save(force_insert=True)
             
             print(f"總共創建了 {len(topics)} 個 Topic")
             print("=" * 50)
-
-            # 重新從資料庫獲取 quiz 實例以確保最新資料
-            quiz.refresh_from_db()
             
             # 序列化返回資料
             quiz_serializer = QuizSerializer(quiz)
@@ -141,41 +108,180 @@ class QuizViewSet(APIView):
                 'error': f'Internal server error: {str(e)}'
             }, status=500)
     
+    @staticmethod
+    def _get_or_create_quiz(quiz_topic_name, user_instance):
+        """同名且未軟刪除的 Quiz 直接沿用，否則新建並自動加入收藏"""
+        quiz = Quiz.objects.select_related('user').filter(
+            quiz_topic=quiz_topic_name, user=user_instance, deleted_at__isnull=True
+        ).first()
+        if quiz:
+            print(f"Found existing Quiz: {quiz.quiz_topic} (ID: {quiz.id}) for user: {user_instance}")
+            return quiz
+
+        quiz = Quiz.objects.create(
+            quiz_topic=quiz_topic_name,
+            user=user_instance
+        )
+        print(f"Created new Quiz: {quiz.quiz_topic} (ID: {quiz.id}) for user: {user_instance}")
+
+        # 自動添加到用戶收藏（savepoint：失敗時不影響外層交易）
+        try:
+            with transaction.atomic():
+                UserFavorite.objects.create(
+                    user=user_instance,
+                    quiz=quiz
+                )
+            print(f"✅ 自動添加Quiz到用戶收藏: {quiz.quiz_topic}")
+        except Exception as e:
+            print(f"⚠️ 添加收藏失敗: {str(e)}")
+            # 不阻止主流程繼續
+        return quiz
+
+    @staticmethod
+    def _build_topic(quiz, q):
+        """Flask 回傳的一題轉成 Topic（未存檔），難度等級從行程內的難度快取取得"""
+        levels = all_levels()
+        default_level = levels.get(1)  # 預設 beginner
+        default_difficulty = default_level.instance if default_level else None
+        return Topic(
+            quiz_topic=quiz,  # 關聯到 Quiz 實例
+            title=q.get('title'),
+            option_A=q.get('option_A'),
+            option_B=q.get('option_B'),
+            option_C=q.get('option_C'),
+            option_D=q.get('option_D'),
+            difficulty=levels[q['difficulty_id']].instance if q.get('difficulty_id') in levels else default_difficulty,
+            Ai_answer=q.get('Ai_answer'),
+            explanation_text=q.get('explanation_text')
+        )
+
+    def _stream_quiz(self, request):
+        """
+        轉送 Flask 的 NDJSON 題目串流：
+        - 每收到一題就存成 Topic，送出 question 事件（含資料庫 id）
+        - 串流結束後送出 done 事件（格式與非串流回應相同：quiz / topics / message）
+        - Flask 中斷或送來無法解析的內容時，送出 error 事件；已存的題目保留
+        """
+        user_id = request.data.get('user_id')
+        try:
+            user_instance = User.objects.get(id=user_id)
+        except (User.DoesNotExist, ValueError, TypeError):
+            return Response({'error': f'User with ID {user_id} not found'}, status=400)
+
+        try:
+            flask_response = requests.post(
+                f'{FLASK_BASE_URL}/api/quiz',
+                json={**request.data, 'stream': True, 'stream_format': 'ndjson'},
+                stream=True,
+                timeout=(5, 120)
+            )
+        except requests.exceptions.ConnectionError:
+            return Response({
+                'error': 'Cannot connect to Flask service. Make sure it is running on port 5000.'
+            }, status=503)
+        if flask_response.status_code not in (200, 201):
+            return Response({
+                'error': f'Flask service error: {flask_response.status_code}',
+                'details': flask_response.text
+            }, status=500)
+        flask_response.encoding = 'utf-8'
+        quiz_topic_name = request.data.get('topic')
+
+        def generate():
+            quiz = None
+            topics = []
+            try:
+                # chunk_size=None：收到多少就處理多少，不等湊滿緩衝區
+                for line in flask_response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        print(f"~~~~~ Flask 題目串流格式錯誤: {line[:200]!r} ~~~~~")
+                        yield json.dumps({'type': 'error', 'error': '題目格式錯誤'}, ensure_ascii=False) + '\n'
+                        break
+                    if event.get('type') == 'question':
+                        # 第一題到了才建立 Quiz，Flask 一開始就失敗時不會留下空的 Quiz
+                        if quiz is None:
+                            with transaction.atomic():
+                                quiz = self._get_or_create_quiz(quiz_topic_name, user_instance)
+                        topic = self._build_topic(quiz, event.get('question') or {})
+                        topic.save()
+                        topics.append(topic)
+                        yield json.dumps({
+                            'type': 'question',
+                            'index': event.get('index', len(topics)),
+                            'topic': TopicSerializer(topic).data,
+                        }, ensure_ascii=False, default=str) + '\n'
+                    elif event.get('type') == 'done':
+                        print(f"總共創建了 {len(topics)} 個 Topic")
+                        yield json.dumps({
+                            'type': 'done',
+                            'quiz': QuizSerializer(quiz).data if quiz else None,
+                            'topics': TopicSerializer(topics, many=True).data,
+                            'message': f"Successfully created {len(topics)} topics"
+                        }, ensure_ascii=False, default=str) + '\n'
+            except requests.exceptions.RequestException as e:
+                print(f"~~~~~ Flask 題目串流中斷: {str(e)} ~~~~~")
+                yield json.dumps({'type': 'error', 'error': '題目生成中斷'}, ensure_ascii=False) + '\n'
+            finally:
+                flask_response.close()
+
+        response = StreamingHttpResponse(generate(), content_type='application/x-ndjson')
+        response['Cache-Control'] = 'no-cache'
+        # 避免 nginx 緩衝整個回應
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
     def get(self, request):
         # 直接從 Django 資料庫獲取資料，不調用 Flask
+        # 查詢次數固定：Quiz 一次 + Topic 一次（prefetch），與 Quiz 數量無關
+        # ?include_topics=false 只回傳 Quiz；帶 cursor / page_size 時以 cursor 分頁
         try:
-            # 獲取當前用戶的所有 Quiz 和相關的 Topic
-            quizzes = Quiz.objects.filter(user=request.user, deleted_at__isnull=True)
-            print(f"=== GET 方法除錯 ===")
-            print(f"用戶: {request.user}")
-            print(f"找到 {quizzes.count()} 個 Quiz")
+            include_topics = request.query_params.get('include_topics', 'true').lower() != 'false'
+            quizzes = Quiz.objects.filter(user=request.user, deleted_at__isnull=True).only(
+                'id', 'quiz_topic', 'created_at'
+            )
+            if include_topics:
+                quizzes = quizzes.prefetch_related(Prefetch(
+                    'topic_set',
+                    queryset=Topic.objects.filter(deleted_at__isnull=True).only(
+                        'id', 'quiz_topic_id', 'title', 'User_answer', 'Ai_answer',
+                        'explanation_text', 'difficulty_id', 'created_at'
+                    ).order_by('id'),
+                    to_attr='active_topics'
+                ))
+
+            paginator = None
+            if IdCursorPagination.requested(request):
+                paginator = IdCursorPagination()
+                quizzes = paginator.paginate_queryset(quizzes, request, view=self)
             
             quiz_list = []
             for quiz in quizzes:
-                # 獲取該 Quiz 相關的 Topics
-                topics = Topic.objects.filter(quiz_topic=quiz)
-                
                 quiz_data = {
                     'id': quiz.id,
                     'quiz_topic': quiz.quiz_topic,
                     'created_at': quiz.created_at.isoformat() if quiz.created_at else None,
-                    'topics': []
                 }
-                
-                for topic in topics:
-                    topic_data = {
-                        'id': topic.id,
-                        'title': topic.title,
-                        'User_answer': topic.User_answer,
-                        'Ai_answer': topic.Ai_answer,
-                        'explanation_text': topic.explanation_text,
-                        'difficulty_id': topic.difficulty_id,
-                        'created_at': topic.created_at.isoformat() if topic.created_at else None
-                    }
-                    quiz_data['topics'].append(topic_data)
-                
+                if include_topics:
+                    quiz_data['topics'] = [
+                        {
+                            'id': topic.id,
+                            'title': topic.title,
+                            'User_answer': topic.User_answer,
+                            'Ai_answer': topic.Ai_answer,
+                            'explanation_text': topic.explanation_text,
+                            'difficulty_id': topic.difficulty_id,
+                            'created_at': topic.created_at.isoformat() if topic.created_at else None
+                        }
+                        for topic in quiz.active_topics
+                    ]
                 quiz_list.append(quiz_data)
             
+            if paginator is not None:
+                return paginator.get_paginated_response(quiz_list)
             return Response(quiz_list)
             
         except Exception as e:
@@ -368,27 +474,38 @@ class ChatViewSet(APIView):
 
     def get(self, request):
         """獲取聊天記錄"""
+        topic_id = request.GET.get('topic_id')
+        user_id = request.GET.get('user_id')
+        
+        if not topic_id:
+            return Response({'error': 'topic_id is required'}, status=400)
+        
+        # 構建查詢條件
+        filters = {'topic_id': topic_id, 'deleted_at__isnull': True}
+        if user_id:
+            filters['user_id'] = user_id
+        
+        # 精簡格式：題目與使用者只出現一次，訊息以 (created_at, id) keyset 分頁
+        # 放在 try 外面，讓分頁的 NotFound（cursor 無效）照 DRF 回 404
+        if request.query_params.get('compact') in ('1', 'true') or 'cursor' in request.query_params:
+            try:
+                filters['topic_id'] = int(topic_id)
+                if user_id:
+                    filters['user_id'] = int(user_id)
+            except ValueError:
+                return Response({'error': 'topic_id and user_id must be integers'}, status=400)
+            return self._compact_history(request, filters)
+
         try:
-            topic_id = request.GET.get('topic_id')
-            user_id = request.GET.get('user_id')
-            
-            if not topic_id:
-                return Response({'error': 'topic_id is required'}, status=400)
-            
-            # 構建查詢條件
-            filters = {'topic_id': topic_id, 'deleted_at__isnull': True}
-            if user_id:
-                filters['user_id'] = user_id
-            
-            # 獲取聊天記錄，按時間排序
-            chats = Chat.objects.filter(**filters).order_by('created_at')
+            # 獲取聊天記錄，按時間排序（舊格式，每則訊息都帶完整 topic / user）
+            chats = list(Chat.objects.filter(**filters).select_related('user', 'topic').order_by('created_at'))
             
             # 序列化並返回
             serializer = ChatSerializer(chats, many=True)
             return Response({
                 'topic_id': topic_id,
                 'chat_history': serializer.data,
-                'total_messages': chats.count()
+                'total_messages': len(chats)
             }, status=200)
             
         except Exception as e:
@@ -396,6 +513,33 @@ class ChatViewSet(APIView):
                 'error': f'Internal server error: {str(e)}'
             }, status=500)
 
+    def _compact_history(self, request, filters):
+        """
+        回傳 {topic, users, messages, older, newer}
+        - 第一頁是最新的 page_size 則，messages 由舊到新
+        - older / newer 是往前、往後翻頁的連結
+        """
+        topic_id = filters['topic_id']
+        topic = Topic.objects.filter(id=topic_id, deleted_at__isnull=True).first()
+        if topic is None:
+            return Response({'error': f'Topic {topic_id} not found'}, status=404)
+
+        chats = Chat.objects.filter(**filters).only('id', 'user_id', 'sender', 'content', 'created_at')
+        paginator = ChatCursorPagination()
+        page = paginator.paginate_queryset(chats, request, view=self)
+        # 翻頁連結由 paginator.page（新到舊）計算，必須在反轉顯示順序之前取得，且不能動到 page 本身
+        older = paginator.get_next_link()
+        newer = paginator.get_previous_link()
+
+        users = User.objects.filter(id__in={chat.user_id for chat in page}).only('id', 'username')
+        return Response({
+            'topic': TopicSerializer(topic).data,
+            'users': UserSimplifiedSerializer(users, many=True).data,
+            'messages': ChatMessageSerializer(list(reversed(page)), many=True).data,
+            'older': older,
+            'newer': newer,
+        }, status=200)
+
     def post(self, request):
         """處理聊天訊息"""
         try:
@@ -437,39 +581,31 @@ class ChatViewSet(APIView):
                 sender='user'
             )
             
-            # 2. 獲取歷史對話記錄用於 AI 思考
-            chat_history = Chat.objects.filter(
-                topic=topic_instance, 
-                deleted_at__isnull=True
-            ).order_by('created_at').values('content', 'sender')
+            # 2. 獲取歷史對話：較舊的對話以摘要帶入，只送最近幾則原文（固定 token 預算）
+            history_summary, chat_history = build_chat_context(user_instance, topic_instance)
             
-            # 準備傳送給 Flask 的資料，包含歷史對話
-            topic_data = {
-                'id': topic_instance.id,
-                'title': topic_instance.title,
-                'option_A': topic_instance.option_A,
-                'option_B': topic_instance.option_B,
-                'option_C': topic_instance.option_C,
-                'option_D': topic_instance.option_D,
-                'Ai_answer': topic_instance.Ai_answer,
-                'explanation_text': topic_instance.explanation_text
-            }
+            # 準備傳送給 Flask 的資料：題目只送版本，Flask 沒有這個版本時才補送完整內容
+            topic_version, topic_data = topic_instance.chat_context()
 
             flask_data = {
                 'user_id': user_id,
                 'topic_id': topic_id,
-                'topic_data': topic_data,
+                'topic_ref': {'id': topic_instance.id, 'version': topic_version},
                 'content': content,
-                'chat_history': list(chat_history)  # 包含歷史對話供 AI 參考
+                'history_summary': history_summary,
+                'chat_history': [
+                    {'content': chat['content'], 'sender': chat['sender']} for chat in chat_history
+                ]  # 最近的歷史對話供 AI 參考（最後一則是目前的提問）
             }
             
             print(f"~~~~~ 傳送給 Flask 的資料: {flask_data} ~~~~~")
+
+            # 串流模式：Flask 逐段回傳，Django 邊收邊轉送給前端
+            if request.data.get('stream') in (True, 'true', '1', 1):
+                return self._stream_chat(flask_data, topic_data, user_instance, topic_instance, user_chat, topic_id)
             
             # 3. 傳給 Flask 做處理
-            flask_response = requests.post(
-                f'{FLASK_BASE_URL}/api/chat',
-                json=flask_data
-            )
+            flask_response = self._post_chat(flask_data, topic_data)
         
             # 檢查 Flask 響應狀態
             if flask_response.status_code not in [200, 201]:
@@ -505,6 +641,87 @@ class ChatViewSet(APIView):
                 'error': f'Internal server error: {str(e)}'
             }, status=500)
 
+    def _post_chat(self, flask_data, topic_data, **kwargs):
+        """先只送題目版本；Flask 回 409（沒有這個版本的 prompt）時附上完整題目內容重送"""
+        flask_response = requests.post(f'{FLASK_BASE_URL}/api/chat', json=flask_data, **kwargs)
+        if flask_response.status_code == 409:
+            flask_response.close()
+            flask_response = requests.post(
+                f'{FLASK_BASE_URL}/api/chat',
+                json={**flask_data, 'topic_data': topic_data},
+                **kwargs
+            )
+        return flask_response
+
+    def _stream_chat(self, flask_data, topic_data, user_instance, topic_instance, user_chat, topic_id):
+        """
+        轉送 Flask 的 NDJSON 串流：
+        - delta 事件原樣轉送給前端
+        - 串流結束後儲存 AI 回應，最後送出 done 事件（格式與非串流回應相同）
+        - Flask 中斷或送來無法解析的內容時，送出 error 事件
+        - 前端中途斷線或串流出錯時，已收到的內容仍會存成 AI 回應
+        """
+        flask_response = self._post_chat(
+            {**flask_data, 'stream': True}, topic_data, stream=True, timeout=(5, 60)
+        )
+        if flask_response.status_code != 200:
+            return Response({
+                'error': f'Flask service error: {flask_response.status_code}',
+                'details': flask_response.text
+            }, status=500)
+        flask_response.encoding = 'utf-8'
+
+        def generate():
+            parts = []
+            saved = False
+            try:
+                # chunk_size=None：收到多少就處理多少，不等湊滿緩衝區
+                for line in flask_response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # 收到壞掉的一行就停止轉送；已收到的內容在 finally 照樣存起來
+                        print(f"~~~~~ Flask 串流格式錯誤: {line[:200]!r} ~~~~~")
+                        yield json.dumps({'type': 'error', 'error': 'AI 回應格式錯誤'}, ensure_ascii=False) + '\n'
+                        break
+                    if event.get('type') == 'delta':
+                        parts.append(event.get('content', ''))
+                        yield line + '\n'
+                    elif event.get('type') == 'done':
+                        ai_chat = Chat.objects.create(
+                            user=user_instance,
+                            topic=topic_instance,
+                            content=event.get('response') or ''.join(parts),
+                            sender='ai'
+                        )
+                        saved = True
+                        yield json.dumps({
+                            'type': 'done',
+                            'user_message': ChatSerializer(user_chat).data,
+                            'ai_response': ChatSerializer(ai_chat).data,
+                            'conversation_id': topic_id
+                        }, ensure_ascii=False, default=str) + '\n'
+            except requests.exceptions.RequestException as e:
+                print(f"~~~~~ Flask 串流中斷: {str(e)} ~~~~~")
+                yield json.dumps({'type': 'error', 'error': 'AI 回應中斷'}, ensure_ascii=False) + '\n'
+            finally:
+                flask_response.close()
+                if not saved and parts:
+                    Chat.objects.create(
+                        user=user_instance,
+                        topic=topic_instance,
+                        content=''.join(parts),
+                        sender='ai'
+                    )
+
+        response = StreamingHttpResponse(generate(), content_type='application/x-ndjson')
+        response['Cache-Control'] = 'no-cache'
+        # 避免 nginx 緩衝整個回應
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 class ChatContentToNoteView(APIView):
     permission_classes = [IsAuthenticated]
     
@@ -658,33 +875,53 @@ class NoteListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        """獲取使用者的所有筆記"""
+        """
+        獲取使用者的所有筆記
+        - ?quiz_topic=<id> 篩選（舊呼叫端放在 body 的也支援）
+        - 帶 compact=true 或 cursor / page_size 時回傳扁平格式並以 cursor 分頁（cursor 無效時回 404）
+        """
+        quiz_topic = request.query_params.get('quiz_topic') or request.data.get('quiz_topic')
+        if quiz_topic:
+            try:
+                quiz_topic = int(quiz_topic)
+            except (TypeError, ValueError):
+                return Response({'error': 'quiz_topic must be an integer'}, status=400)
+
+        notes = Note.objects.filter(
+            user=request.user,
+            deleted_at__isnull=True,
+            quiz_topic__deleted_at__isnull=True
+        )
+        if quiz_topic:
+            notes = notes.filter(quiz_topic=quiz_topic)
+
+        if request.query_params.get('compact') in ('1', 'true') or IdCursorPagination.requested(request):
+            return self._compact_notes(request, notes)
+
         try:
-            if 'quiz_topic' in request.data:
-                quiz_topic = request.data.get('quiz_topic')
-                notes = Note.objects.filter(
-                    quiz_topic=quiz_topic,
-                    user=request.user,
-                    deleted_at__isnull=True,
-                    quiz_topic__deleted_at__isnull=True
-                ).order_by('-created_at')  # 按創建時間倒序排列
-            else:
-                # 使用 filter 而不是 get，獲取多個筆記
-                notes = Note.objects.filter(
-                    user=request.user,
-                    deleted_at__isnull=True,
-                    quiz_topic__deleted_at__isnull=True
-                ).order_by('-created_at')  # 按創建時間倒序排列
-            
+            # 舊格式：完整巢狀資料，一次查出關聯避免每筆筆記各查一次
+            notes = list(
+                notes.select_related('user', 'topic', 'quiz_topic__user').order_by('-created_at')  # 按創建時間倒序排列
+            )
             return Response({
                 'notes': NoteSerializer(notes, many=True).data,
-                'count': notes.count()
+                'count': len(notes)
             }, status=200)
             
         except Exception as e:
             return Response({
                 'error': f'Error fetching notes: {str(e)}'
             }, status=500)
+
+    def _compact_notes(self, request, notes):
+        """扁平格式 + cursor 分頁；NotFound（cursor 無效）交給 DRF 回 404"""
+        notes = notes.select_related('quiz_topic').only(
+            'id', 'title', 'content', 'quiz_topic', 'quiz_topic__quiz_topic',
+            'topic', 'is_retake', 'created_at', 'updated_at'
+        )
+        paginator = IdCursorPagination()
+        page = paginator.paginate_queryset(notes, request, view=self)
+        return paginator.get_paginated_response(NoteListSerializer(page, many=True).data)
     
     # 手動新增空白筆記
     def post(self, request):
@@ -907,100 +1144,89 @@ class UsersQuizAndNote(APIView):
 # 前端回傳 用戶答案
 class SubmitAnswerView(APIView):
     permission_classes = [IsAuthenticated]
+
+    @staticmethod
+    def _batch_topic_ids(items):
+        """檢查批次作答格式，回傳 (topic_ids, error)；error 指出第幾筆、哪裡有問題"""
+        if not isinstance(items, list):
+            return None, "'updates' must be a list of {\"id\", \"user_answer\"} objects"
+        topic_ids = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                return None, f"updates[{index}] must be an object, got {item!r}"
+            try:
+                topic_ids.append(int(item.get("id")))
+            except (TypeError, ValueError):
+                return None, f"updates[{index}].id must be an integer, got {item.get('id')!r}"
+        return topic_ids, None
+
+    def _grade_batch(self, topic_ids, items):
+        """
+        批次作答：一次查出所有題目、在記憶體中批改，再以一次 bulk_update 寫回 User_answer
+        任何一題不存在（或已軟刪除）時回傳 404，不寫入任何答案
+        """
+        topics = Topic.objects.filter(deleted_at__isnull=True).only(
+            'id', 'quiz_topic_id', 'difficulty_id', 'Ai_answer', 'User_answer'
+        ).in_bulk(topic_ids)
+        missing = [topic_id for topic_id in topic_ids if topic_id not in topics]
+        if missing:
+            raise Http404(f"Topic {missing[0]} not found")
+
+        correct_answers = 0
+        for topic_id, item in zip(topic_ids, items):
+            topic = topics[topic_id]
+            topic.User_answer = item.get("user_answer")
+            # 使用從資料庫抓出來的 topic.Ai_answer，而不是 item.get("Ai_answer")
+            if item.get("user_answer") == topic.Ai_answer:
+                correct_answers += 1
+        Topic.objects.bulk_update(topics.values(), ['User_answer'])
+
+        # 從第一個 topic 抓取 quiz_topic_id 和 difficulty
+        first = topics[topic_ids[0]]
+        difficulty_id = first.difficulty_id or 1
+        difficulty_name = level_name(difficulty_id, "beginner")
+        print(f"Final values - quiz_topic_id: {first.quiz_topic_id}, difficulty_name: {difficulty_name}")
+        return first.quiz_topic_id, difficulty_id, difficulty_name, correct_answers
+
     def post(self, request):
         from django.db import transaction
         
         with transaction.atomic():
             user = request.user
-            topic_id = request.data.get("topic")
-            quiz_topic_id = request.data.get("quiz_topic_id")
-            difficulty = request.data.get("difficulty")
-            user_answer = request.data.get("user_answer")
-            updates = request.data.get("updates", [])
-            is_test = request.data.get("is_test", False)  # 前端回傳是否為 TEST 模式
-            token = request.META.get("HTTP_AUTHORIZATION", "").split(" ")[1]
+            # 支援直接傳陣列的格式 [{"id": 276, "user_answer": "A"}]
+            data = request.data if isinstance(request.data, dict) else {}
+            topic_id = data.get("topic")
+            quiz_topic_id = data.get("quiz_topic_id")
+            difficulty = data.get("difficulty")
+            user_answer = data.get("user_answer")
+            updates = data.get("updates", []) if data else request.data
+            is_test = data.get("is_test", False)  # 前端回傳是否為 TEST 模式
 
             print(f"=== SubmitAnswerView Debug ===")
             print(f"topic_id: {topic_id}")
             print(f"user_answer: {user_answer}")
-            print(f"updates: {updates}")
             print(f"updates 長度: {len(updates) if updates else 0}")
-            print(f"request.data type: {type(request.data)}")
             print(f"quiz_topic_id {quiz_topic_id}  ===")
             print(f"使用者: {user.id}")
-            print(f"題目 ID: {topic_id}")
             print(f"難度: {difficulty}")
-            print(f"使用者答案: {user_answer}")
             
             # 處理單一題目更新
             if topic_id and user_answer is not None:
                 print("=== 進入單一題目更新分支 ===")
-                topic = get_object_or_404(Topic, id=topic_id, deleted_at__isnull=True)
-                topic.User_answer = user_answer
-                topic.save()
-                Ai_answer = topic.Ai_answer
+                updated = Topic.objects.filter(id=topic_id, deleted_at__isnull=True).update(User_answer=user_answer)
+                if not updated:
+                    raise Http404(f"Topic {topic_id} not found")
                 return Response({"message": "Answer submitted successfully"}, status=201)
-                # 計算總題數與正確數
 
             elif updates:
-                print("=== 進入 updates 分支 ===")
-                updated_topics = []
-                correct_answers = 0
+                print("=== 進入批次作答分支 ===")
+                topic_ids, error = self._batch_topic_ids(updates)
+                if error:
+                    return Response({"error": error}, status=400)
                 total_questions = len(updates)
-                quiz_topic_id = None
-                difficulty_name = None
+                quiz_topic_id, difficulty_id, difficulty_name, correct_answers = self._grade_batch(topic_ids, updates)
                 
-                # 難度 ID 轉英文名稱的對照表
-                difficulty_mapping = {
-                    1: "beginner",
-                    2: "intermediate", 
-                    3: "advanced",
-                    4: "master",
-                    5: "error"
-                }
-                
-                for item in updates:
-                    topic = get_object_or_404(Topic, id=item.get("id"), deleted_at__isnull=True)
-                    topic.User_answer = item.get("user_answer")
-                    topic.save()
-                    
-                    # 從第一個 topic 抓取 quiz_topic_id 和 difficulty
-                    if quiz_topic_id is None:
-                        quiz_topic_id = topic.quiz_topic.id  # 使用正確的關聯字段
-                        print(f"Topic ID: {topic.id}, difficulty object: {topic.difficulty}")
-                        if topic.difficulty:
-                            difficulty_id = topic.difficulty.id
-                            difficulty_name = difficulty_mapping.get(difficulty_id, "beginner")
-                            print(f"Found difficulty_id: {difficulty_id}, mapped to: {difficulty_name}")
-                        else:
-                            difficulty_id = 1
-                            difficulty_name = "beginner"
-                            print(f"No difficulty found, using default: {difficulty_name}")
-                        print(f"Final values - quiz_topic_id: {quiz_topic_id}, difficulty_name: {difficulty_name}")
-                    
-                    # 使用從資料庫抓出來的 topic.Ai_answer，而不是 item.get("Ai_answer")
-                    if item.get("user_answer") == topic.Ai_answer:
-                        correct_answers += 1
-                    updated_topics.append({
-                        "id": topic.id,
-                        "Ai_answer": topic.Ai_answer,
-                        "User_answer": topic.User_answer,
-                        "quiz_topic_id": topic.quiz_topic.id,
-                        "difficulty": difficulty_name,
-                        "difficulty_id": topic.difficulty.id if topic.difficulty else None,
-                        "title": topic.title,
-                        "is_correct": item.get("user_answer") == topic.Ai_answer
-                    })
-                
-                # 準備傳送到熟悉度 API 的資料
-                payload = {
-                    "quiz_topic_id": quiz_topic_id,
-                    "difficulty": difficulty_name,
-                    "total_questions": total_questions,
-                    "correct_answers": correct_answers,
-                }
-                
-                # 判斷是否為 TEST 模式或 error 難度（id=5），直接回傳，不呼叫API
+                # 判斷是否為 TEST 模式或 error 難度（id=5），直接回傳，不更新熟悉度
                 if is_test or difficulty_id == 5:
                     message = "Test mode - no API call" if is_test else "Error level - no API call"
                     return Response({
@@ -1009,109 +1235,29 @@ class SubmitAnswerView(APIView):
                         "correct_answers": correct_answers
                     }, status=201)
                 
-                print(f"=== 傳送到熟悉度 API 的資料 ===")
-                print(f"Payload: {payload}")
-                
-                # 獲取當前請求的 Authorization token
-                auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-                headers = {}
-                if auth_header:
-                    headers['Authorization'] = auth_header
-                    print(f"Using Authorization header: {auth_header}")
-                
+                # 直接在同一個請求內更新熟悉度（不再打 /api/familiarity/ 回自己的 server）
+                # service 本身是 atomic，失敗時只回滾自己的 savepoint，答案照樣寫入
+                # 開啟 FAMILIARITY_WRITE_BEHIND 時只進緩衝區，回傳的是預估值
+                familiarity = None
                 try:
-                    response = requests.post(
-                        f"{DJANGO_BASE_URL}/api/familiarity/", 
-                        json=payload,
-                        headers=headers
-                    )
-                    data = response.json().get("familiarity")
-                    print(f"熟悉度 API 回應狀態: {response.status_code}")
-                    print(f"熟悉度 API 回應內容: {data}")
+                    familiarity = float(record_attempt(
+                        user=user,
+                        quiz_topic_id=quiz_topic_id,
+                        difficulty_level_id=difficulty_id,
+                        total_questions_this_run=total_questions,
+                        correct_answers_this_run=correct_answers,
+                    ))
+                    print(f"熟悉度更新結果: {familiarity}")
                 except Exception as e:
-                    print(f"呼叫熟悉度 API 失敗: {str(e)}")
+                    print(f"更新熟悉度失敗: {str(e)}")
 
                 return Response({
                     "message": "Batch answers submitted successfully",
                     "total_questions": total_questions,
                     "correct_answers": correct_answers,
-                    "familiarity_api_response": data
-                }, status=201)
-            
-            # 處理直接傳陣列的格式 [{"id": 276, "user_answer": "A"}]
-            elif isinstance(request.data, list):
-                updated_topics = []
-                correct_answers = 0
-                total_questions = len(request.data)
-                quiz_topic_id = None
-                difficulty_name = None
-                
-                # 難度 ID 轉英文名稱的對照表
-                difficulty_mapping = {
-                    1: "beginner",
-                    2: "intermediate", 
-                    3: "advanced",
-                    4: "master",
-                    5: "error"
-                }
-                
-                for item in request.data:
-                    topic = get_object_or_404(Topic, id=item.get("id"), deleted_at__isnull=True)
-                    topic.User_answer = item.get("user_answer")
-                    topic.save()
-                    
-                    # 從第一個 topic 抓取 quiz_topic_id 和 difficulty
-                    if quiz_topic_id is None:
-                        quiz_topic_id = topic.quiz_topic.id  # 使用正確的關聯字段
-                        difficulty_id = topic.difficulty.id if topic.difficulty else 1
-                        difficulty_name = difficulty_mapping.get(difficulty_id, "beginner")
-                    
-                    # 使用從資料庫抓出來的 topic.Ai_answer
-                    if item.get("user_answer") == topic.Ai_answer:
-                        correct_answers += 1
-                    updated_topics.append({
-                        "id": topic.id,
-                        "Ai_answer": topic.Ai_answer,
-                        "User_answer": topic.User_answer,
-                        "quiz_topic_id": topic.quiz_topic.id,
-                        "difficulty": difficulty_name,
-                        "title": topic.title,
-                        "is_correct": item.get("user_answer") == topic.Ai_answer
-                    })
-                
-                # 準備傳送到熟悉度 API 的資料
-                payload = {
-                    "quiz_topic_id": quiz_topic_id,
-                    "difficulty": difficulty_name,
-                    "total_questions": total_questions,
-                    "correct_answers": correct_answers,
-                }
-                
-                # 判斷是否為 TEST 模式或 error 難度（id=5），直接回傳，不呼叫API
-                if is_test or difficulty_id == 5:
-                    message = "Test mode - no API call" if is_test else "Error level - no API call"
-                    return Response({
-                        "message": f"Batch answers submitted successfully ({message})",
-                        "total_questions": total_questions,
-                        "correct_answers": correct_answers
-                    }, status=201)
-                
-                print(f"=== 傳送到熟悉度 API 的資料 (List格式) ===")
-                print(f"Payload: {payload}")
-                
-                try:
-                    response = requests.post(f"{DJANGO_BASE_URL}/api/familiarity/", json=payload)
-                    data = response.json().get("familiarity")
-                    print(f"熟悉度 API 回應狀態: {response.status_code}")
-                    print(f"熟悉度 API 回應內容: {data}")
-                except Exception as e:
-                    print(f"呼叫熟悉度 API 失敗: {str(e)}")
-                
-                return Response({
-                    "message": "Batch answers submitted successfully",
-                    "total_questions": total_questions,
-                    "correct_answers": correct_answers,
-                    "familiarity_api_response": data
+                    "familiarity": familiarity,
+                    # 相容舊欄位名稱
+                    "familiarity_api_response": familiarity
                 }, status=201)
             
             else:
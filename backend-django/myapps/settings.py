@@ -194,4 +194,10 @@ EMAIL_PORT = 465
 EMAIL_USE_SSL = True
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD') 
-DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
\ No newline at end of file
+DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+# 熟悉度 write-behind 寫入失敗時的 dead letter 檔（JSON Lines，供事後補寫）
+# 相對路徑以 backend-django 目錄為準（容器內是掛載出來的 /app），不受 gunicorn 啟動目錄影響；設為空字串只印 log
+_familiarity_dead_letter = os.getenv('FAMILIARITY_DEAD_LETTER_FILE', 'var/familiarity_dead_letter.jsonl')
+FAMILIARITY_DEAD_LETTER_FILE = (
+    Path(__file__).resolve().parent.parent / _familiarity_dead_letter if _familiarity_dead_letter else None
+)
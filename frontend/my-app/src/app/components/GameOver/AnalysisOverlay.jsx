@@ -144,23 +144,65 @@ export default function AnalysisOverlay({
           sender: user,
           message: text,
           topic_id: currentTopic?.id ?? null,
+          stream: true,
         }),
       });
 
-      const data = await res.json();
-
-      // 兼容 data.ai-response.content、data.ai_response.content、data.content、data.reply
-      const aiText =
-        data?.ai_response?.content ??
-        data?.["ai-response"]?.content ??
-        data?.content ??
-        data?.reply ??
-        "（沒有收到 AI 內容）";
-
-      // 更新當前題目的聊天記錄
-
-      const updatedMessages = [...newMessages, { role: "ai", content: aiText }];
-      updateCurrentChatRoom(updatedMessages);
+      // 非串流回應（例如錯誤訊息）維持原本的 JSON 處理
+      if (!res.ok || !res.body || !(res.headers.get("Content-Type") || "").includes("ndjson")) {
+        const data = await res.json();
+
+        // 兼容 data.ai-response.content、data.ai_response.content、data.content、data.reply
+        const aiText =
+          data?.ai_response?.content ??
+          data?.["ai-response"]?.content ??
+          data?.content ??
+          data?.reply ??
+          "（沒有收到 AI 內容）";
+
+        updateCurrentChatRoom([...newMessages, { role: "ai", content: aiText }]);
+        return;
+      }
+
+      // 串流回應：每收到一段就更新 AI 訊息
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let aiText = "";
+      let errorText = "";
+      // 有錯誤時接在已收到的內容後面顯示
+      const display = () =>
+        errorText ? (aiText ? `${aiText}\n\n（${errorText}）` : errorText) : aiText;
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          let event;
+          try {
+            event = JSON.parse(line);
+          } catch {
+            console.error("無法解析的串流內容：", line);
+            continue;
+          }
+          if (event.type === "delta") {
+            aiText += event.content || "";
+          } else if (event.type === "done") {
+            aiText = event.ai_response?.content ?? aiText;
+          } else if (event.type === "error") {
+            errorText = event.error || "AI 回應中斷，請稍後再試。";
+          }
+        }
+        updateCurrentChatRoom([...newMessages, { role: "ai", content: display() }]);
+      }
+
+      updateCurrentChatRoom([
+        ...newMessages,
+        { role: "ai", content: display() || "（沒有收到 AI 內容）" },
+      ]);
     } catch (err) {
       console.error("AI 對話錯誤：", err);
       // 更新當前題目的聊天記錄
@@ -306,7 +348,8 @@ export default function AnalysisOverlay({
                     </div>
                   ))}
 
-                  {isLoading && (
+                  {/* 串流開始後 AI 訊息已出現，不再顯示思考中 */}
+                  {isLoading && currentMessages[currentMessages.length - 1]?.role !== "ai" && (
                     <div className={`${styles.message} ${styles.placeholder}`}>
                       正在思考中…
                     </div>
@@ -21,6 +21,8 @@ export default function HomeGamePage() {
   const [showDecryption, setShowDecryption] = useState(false);
   const [decryptionStep, setDecryptionStep] = useState(0);
   const [isGenerating, setIsGenerating] = useState(false);
+  // 串流出題時已收到的題數
+  const [generatedCount, setGeneratedCount] = useState(0);
 
   // 初始化路由器
   const router = useRouter();
@@ -132,6 +134,7 @@ export default function HomeGamePage() {
     setShowDecryption(true);
     setIsGenerating(true);
     setDecryptionStep(0);
+    setGeneratedCount(0);
     
     // 立即開始生題
     generateQuestions();
@@ -220,10 +223,11 @@ export default function HomeGamePage() {
           topic: newTopic,
           difficulty: selectedDifficulty,
           question_count: parseInt(questionCount, 10),
+          stream: true,
         }),
       });
 
-      const result = await res.json();
+      const result = await readQuizResponse(res);
       
       // 將主題信息也存儲到 sessionStorage，供筆記頁面使用
       sessionStorage.setItem(
@@ -254,6 +258,52 @@ export default function HomeGamePage() {
     }
   };
 
+  // 讀取出題回應：串流（NDJSON）時每收到一題就更新進度，最後的 done 事件格式與非串流回應相同
+  const readQuizResponse = async (res) => {
+    if (!res.ok || !res.body || !(res.headers.get("Content-Type") || "").includes("ndjson")) {
+      const data = await res.json();
+      if (!res.ok) throw new Error(data?.error || `HTTP ${res.status}`);
+      return data;
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let result = null;
+    const topics = [];
+    const handleLine = (line) => {
+      if (!line.trim()) return;
+      let event;
+      try {
+        event = JSON.parse(line);
+      } catch (e) {
+        console.error("無法解析的出題串流內容:", line);
+        return;
+      }
+      if (event.type === "question") {
+        topics.push(event.topic);
+        setGeneratedCount(topics.length);
+      } else if (event.type === "done") {
+        result = event;
+      } else if (event.type === "error") {
+        console.error("出題串流錯誤:", event.error);
+      }
+    };
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split("\n");
+      buffer = lines.pop();
+      lines.forEach(handleLine);
+    }
+    handleLine(buffer);
+
+    // 串流中斷但已存下部分題目時，用已收到的題目繼續
+    if (!result && topics.length === 0) throw new Error("題目生成中斷");
+    return result || { topics };
+  };
+
   // 鍵盤事件處理
   useEffect(() => {
     const handleKeyDown = (event) => {
@@ -398,6 +448,11 @@ export default function HomeGamePage() {
               className={styles.decryptionText}
               key="decryption-text" 
             />
+            {isGenerating && generatedCount > 0 && decryptionStep !== 4 && (
+              <p className={styles.decryptionProgress}>
+                已生成 {generatedCount} / {questionCount} 題
+              </p>
+            )}
           </div>
         </div>
       )}
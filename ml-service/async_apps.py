@@ -0,0 +1,409 @@
+"""
+ml-service 的 asyncio 服務模式
+- 與 topic_apps.py 提供相同的 /api/quiz、/api/chat、/api/retest、/api/generate_topic_from_note 介面
+- 使用 AsyncOpenAI，上游呼叫數由 LLM_MAX_INFLIGHT 限制，其餘請求在 event loop 內排隊
+- 一個 process 即可同時等待數百個慢速的 LLM 呼叫，不再依賴 eventlet monkey patch
+
+啟動方式：hypercorn async_apps:app --bind 0.0.0.0:5000
+（題目的串流模式仍由 topic_apps.py 提供）
+"""
+import asyncio
+import json
+from contextlib import aclosing
+
+from quart import Quart, jsonify, request
+from quart_cors import cors
+
+from llm_client import async_chat_completion, has_api_key
+from single_flight import AsyncSingleFlight
+from topic_apps import (
+    QUIZ_BATCH_SIZE,
+    QUIZ_REMAINDER_ROUNDS,
+    QUIZ_TOPUP_ROUNDS,
+    _normalize_title,
+    _reshuffle_cached,
+    _split_batches,
+    _take_from_warm_pool,
+    build_chat_messages,
+    build_chat_request,
+    build_chat_summary_request,
+    build_quiz_request,
+    build_retest_request,
+    build_topic_from_note_request,
+    chat_answer_cache,
+    chat_cache_key,
+    format_question,
+    generate_enhanced_fallback_topic_from_note,
+    generate_mock_questions,
+    generate_smart_response,
+    mock_chat_reply,
+    parse_question_list_response,
+    resolve_topic_prompt,
+    question_cache,
+    split_valid_questions,
+    topic_from_note_result,
+)
+
+app = cors(Quart(__name__))
+quiz_flight = AsyncSingleFlight()
+
+
+@app.route("/health", methods=["GET"])
+async def health():
+    return {"status": "ok"}, 200
+
+
+async def _generate_questions_batch(topic, difficulty, count, avoid_titles=None):
+    """topic_apps._generate_questions_batch 的 async 版本（截斷補題、驗證失敗重生邏輯相同）"""
+    questions = []
+    fix_notes = None
+    for _ in range(QUIZ_REMAINDER_ROUNDS + 1):
+        missing = count - len(questions)
+        if missing <= 0:
+            break
+        avoid = list(avoid_titles or []) + [q["title"] for q in questions]
+        response = await async_chat_completion(
+            "quiz", **build_quiz_request(topic, difficulty, missing, avoid or None, fix_notes)
+        )
+        raw_questions, finish_reason = parse_question_list_response(response, missing)
+        accepted, rejected_notes = split_valid_questions(raw_questions[:missing])
+        questions.extend(format_question(q) for q in accepted)
+        fix_notes = rejected_notes or None
+        if finish_reason != "length" and not raw_questions:
+            break
+    return questions
+
+
+async def generate_questions_parallel(topic, difficulty, count, batch_size=None):
+    """子批次以 asyncio.gather 同時送出，合併去重後不足的題數再補生成"""
+    batch_size = batch_size or QUIZ_BATCH_SIZE
+    questions = []
+    seen_titles = set()
+
+    for round_no in range(QUIZ_TOPUP_ROUNDS + 1):
+        missing = count - len(questions)
+        if missing <= 0:
+            break
+
+        batches = _split_batches(missing, batch_size)
+        avoid_titles = [q["title"] for q in questions] or None
+        print(f"第 {round_no + 1} 輪：缺 {missing} 題，分成 {len(batches)} 批")
+
+        results = await asyncio.gather(
+            *(_generate_questions_batch(topic, difficulty, size, avoid_titles) for size in batches),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"❌ 子批次生成失敗: {type(result).__name__}: {str(result)}")
+                continue
+            for q in result:
+                key = _normalize_title(q.get("title"))
+                if not key or key in seen_titles:
+                    continue
+                seen_titles.add(key)
+                questions.append(q)
+
+    return questions[:count]
+
+
+async def _generate_fresh_questions(topic, difficulty, count, parallel, batch_size, cache_key):
+    questions = []
+    try:
+        if parallel:
+            questions = await generate_questions_parallel(topic, difficulty, count, batch_size)
+        else:
+            questions = await _generate_questions_batch(topic, difficulty, count)
+    except Exception as e:
+        print(f"❌ OpenAI API 錯誤: {type(e).__name__}: {str(e)}")
+
+    # 題庫快取設定 QUIZ_CACHE_DIR 時會讀寫磁碟，放到執行緒裡做，不卡住 event loop
+    await asyncio.to_thread(question_cache.put, cache_key, questions)
+
+    if len(questions) < count:
+        stale = await asyncio.to_thread(
+            question_cache.get_stale, cache_key, count - len(questions), exclude=questions
+        )
+        if stale:
+            print(f"⚠️ AI 生成不足，使用快取題庫補 {len(stale)} 題")
+            questions.extend(_reshuffle_cached(stale))
+
+    if len(questions) < count:
+        questions.extend(generate_mock_questions(topic, count - len(questions)))
+    return questions
+
+
+async def generate_quiz_questions(topic, difficulty, count, parallel=False, batch_size=None):
+    """題目來源順序與 topic_apps.generate_quiz_questions 相同：預熱池 → 題庫快取 → AI → 過期題庫 → 模擬題目"""
+    if not has_api_key():
+        return generate_mock_questions(topic, count)
+
+    pooled = _take_from_warm_pool(topic, difficulty, count)
+    if pooled:
+        return pooled
+
+    cache_key = question_cache.make_key(topic, difficulty)
+    cached = await asyncio.to_thread(question_cache.get_fresh, cache_key, count)
+    if cached:
+        print(f"✅ 題庫快取命中: {topic} / {difficulty}, 取 {count} 題")
+        return _reshuffle_cached(cached)
+
+    flight_key = (cache_key, count, bool(parallel), batch_size)
+    questions, shared = await quiz_flight.do(
+        flight_key,
+        lambda: _generate_fresh_questions(topic, difficulty, count, parallel, batch_size, cache_key)
+    )
+    if shared:
+        return _reshuffle_cached(questions)
+    return questions
+
+
+@app.route('/api/quiz', methods=['POST'])
+async def create_quiz():
+    try:
+        data = await request.get_json()
+        topic = data.get('topic', '')
+        difficulty = data.get('difficulty', 'test')
+        question_count = int(data.get('question_count', 1))
+        parallel = data.get('parallel', question_count > QUIZ_BATCH_SIZE)
+        print(f"=== async 生成題目: {topic} / {difficulty} / {question_count} 題 ===")
+
+        valid_difficulties = ['beginner', 'intermediate', 'advanced', 'master', 'test']
+        if difficulty not in valid_difficulties:
+            return jsonify({
+                "error": f"Invalid difficulty level. Valid options are: {', '.join(valid_difficulties)}"
+            }), 400
+
+        if not topic:
+            return jsonify({"error": "Topic is required"}), 400
+
+        if data.get('stream', False):
+            return jsonify({"error": "Streaming is only available on the topic_apps service"}), 400
+
+        generated_questions = await generate_quiz_questions(
+            topic, difficulty, question_count, parallel, data.get('batch_size')
+        )
+        return jsonify({
+            "quiz_topic": topic,
+            "questions": generated_questions,
+            "message": "Questions generated successfully"
+        }), 201
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/chat', methods=['POST'])
+async def chat_with_ai():
+    try:
+        data = await request.get_json()
+        topic_id = data.get('topic_id')
+        user_id = data.get('user_id')
+        content = data.get('content')
+        chat_history = data.get('chat_history', [])
+        history_summary = data.get('history_summary', '')
+
+        if not topic_id or not user_id or not content:
+            return jsonify({"error": "topic_id, user_id, and content are required"}), 400
+
+        topic_key, topic_prompt = resolve_topic_prompt(data)
+        if topic_prompt is None:
+            return jsonify({"error": "topic_context_required"}), 409
+
+        if data.get('stream', False):
+            return stream_chat_response(
+                topic_id, user_id, content, topic_key, topic_prompt, chat_history, history_summary
+            )
+
+        if not has_api_key():
+            return jsonify({
+                "topic_id": topic_id,
+                "user_id": user_id,
+                "response": mock_chat_reply(content),
+                "sender": "ai"
+            }), 200
+
+        cache_key = chat_cache_key(topic_key, chat_history, history_summary)
+        cached = chat_answer_cache.lookup(cache_key, content) if cache_key else None
+        if cached:
+            return jsonify({
+                "topic_id": topic_id,
+                "user_id": user_id,
+                "response": cached,
+                "sender": "ai",
+                "tokens_used": 0,
+                "cached": True
+            }), 200
+
+        try:
+            messages = build_chat_messages(content, topic_prompt, chat_history, history_summary)
+            response = await async_chat_completion("chat", **build_chat_request(messages))
+            ai_response = response.choices[0].message.content
+            if cache_key:
+                chat_answer_cache.store(cache_key, content, ai_response)
+            return jsonify({
+                "topic_id": topic_id,
+                "user_id": user_id,
+                "response": ai_response,
+                "sender": "ai",
+                "tokens_used": response.usage.total_tokens if hasattr(response, 'usage') else 0
+            }), 200
+
+        except Exception as e:
+            print(f"❌ OpenAI API 錯誤: {str(e)}")
+            return jsonify({
+                "topic_id": topic_id,
+                "user_id": user_id,
+                "response": generate_smart_response(content, chat_history),
+                "sender": "ai",
+                "note": "使用本地回應（OpenAI API 不可用）"
+            }), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def stream_chat_response(topic_id, user_id, content, topic_key, topic_prompt, chat_history, history_summary=''):
+    """topic_apps.stream_chat_response 的 async 版本，事件格式相同"""
+
+    def line(event, payload):
+        return json.dumps({"type": event, **payload}, ensure_ascii=False) + "\n"
+
+    async def generate():
+        parts = []
+        extra = {}
+        cache_key = chat_cache_key(topic_key, chat_history, history_summary) if has_api_key() else None
+        cached = chat_answer_cache.lookup(cache_key, content) if cache_key else None
+        if not has_api_key():
+            parts.append(mock_chat_reply(content))
+            yield line("delta", {"content": parts[0]})
+        elif cached:
+            parts.append(cached)
+            yield line("delta", {"content": cached})
+            extra = {"tokens_used": 0, "cached": True}
+        else:
+            try:
+                messages = build_chat_messages(content, topic_prompt, chat_history, history_summary)
+                stream = await async_chat_completion(
+                    "chat", stream=True, stream_options={"include_usage": True}, **build_chat_request(messages)
+                )
+                # 前端中途斷線時也要關閉上游串流，釋放同時呼叫數的名額
+                async with aclosing(stream):
+                    async for chunk in stream:
+                        if getattr(chunk, "usage", None):
+                            extra["tokens_used"] = chunk.usage.total_tokens
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content or ""
+                        if delta:
+                            parts.append(delta)
+                            yield line("delta", {"content": delta})
+                if cache_key:
+                    chat_answer_cache.store(cache_key, content, "".join(parts))
+            except Exception as e:
+                print(f"❌ OpenAI 串流錯誤: {type(e).__name__}: {str(e)}")
+                if parts:
+                    extra = {"note": "AI 回應中斷"}
+                else:
+                    parts.append(generate_smart_response(content, chat_history))
+                    yield line("delta", {"content": parts[0]})
+                    extra = {"note": "使用本地回應（OpenAI API 不可用）"}
+        yield line("done", {
+            "topic_id": topic_id,
+            "user_id": user_id,
+            "response": "".join(parts),
+            "sender": "ai",
+            **extra
+        })
+
+    return generate(), 200, {
+        "Content-Type": "application/x-ndjson",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    }
+
+
+@app.route('/api/chat/summary', methods=['POST'])
+async def summarize_chat():
+    try:
+        data = await request.get_json()
+        messages = data.get('messages', [])
+        if not messages:
+            return jsonify({"error": "messages are required"}), 400
+        if not has_api_key():
+            return jsonify({"error": "API key is missing"}), 503
+
+        response = await async_chat_completion("chat_summary", **build_chat_summary_request(
+            data.get('previous_summary', ''), messages, data.get('topic_title', '')
+        ))
+        return jsonify({"summary": response.choices[0].message.content.strip()}), 200
+    except Exception as e:
+        print(f"❌ 對話摘要失敗: {type(e).__name__}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/retest', methods=['POST'])
+async def retest():
+    try:
+        data = await request.get_json()
+        content = data.get('content', '內容未提供')
+
+        if content == "內容未提供":
+            return jsonify({"error": "內容未提供"}), 400
+
+        if not has_api_key():
+            return jsonify({"content": content}), 200
+
+        try:
+            response = await async_chat_completion("retest", **build_retest_request(content))
+            parse_content = response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"GPT 處理錯誤: {str(e)}")
+            parse_content = content
+        return jsonify({"content": parse_content}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/generate_topic_from_note', methods=['POST'])
+async def generate_topic_from_note():
+    data = await request.get_json()
+    note_content = data.get('note_content', '')
+    note_title = data.get('note_title', '')
+
+    if not note_content:
+        return jsonify({"success": False, "message": "筆記內容不能為空"}), 400
+
+    if len(note_content) > 10000:
+        return jsonify({"success": False, "message": "筆記內容過長，請縮短後再試"}), 400
+
+    if not has_api_key():
+        return jsonify({
+            "success": True,
+            "topic": generate_enhanced_fallback_topic_from_note(note_content, note_title),
+            "message": "使用改進的備用邏輯生成主題",
+            "is_fallback": True
+        })
+
+    try:
+        response = await async_chat_completion(
+            "topic_from_note", **build_topic_from_note_request(note_content, note_title)
+        )
+        ai_response = response.choices[0].message.content.strip()
+        return jsonify(topic_from_note_result(ai_response, note_content, note_title))
+
+    except Exception as e:
+        print(f"生成主題時發生錯誤: {str(e)}")
+        try:
+            return jsonify({
+                "success": True,
+                "topic": generate_enhanced_fallback_topic_from_note(note_content, note_title),
+                "message": "AI服務錯誤，使用改進的備用邏輯",
+                "is_fallback": True
+            })
+        except Exception as fallback_error:
+            print(f"改進的備用邏輯也失敗: {str(fallback_error)}")
+            return jsonify({
+                "success": False,
+                "message": f"生成主題失敗: {str(e)}"
+            }), 500
@@ -0,0 +1,105 @@
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+# 提問常見的客套、語助詞，比對時去掉
+FILLER_PATTERN = re.compile(r"^(請問|請教|想問|我想問|老師|你好|您好)+|(呢|嗎|啊|呀|耶|吧)+$")
+# 選項字母與數字：字面相似但選項不同的提問（答案是 B / 答案是 C）不能共用回答
+MARK_PATTERN = re.compile(r"(?<![a-z])[a-d](?![a-z])|\d+")
+
+
+def normalize_question(text):
+    """正規化提問：全半形統一、轉小寫、去掉空白標點與客套語"""
+    text = unicodedata.normalize("NFKC", str(text or "")).lower()
+    text = re.sub(r"[\s\W_]+", "", text)
+    return FILLER_PATTERN.sub("", text)
+
+
+def _marks(text):
+    text = unicodedata.normalize("NFKC", str(text or "")).lower()
+    return frozenset(MARK_PATTERN.findall(text))
+
+
+def _ngrams(text):
+    """字元 bigram + trigram 計數（中文不需斷詞也能比對）"""
+    grams = Counter()
+    for n in (2, 3):
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    if not grams and text:
+        grams[text] = 1
+    return grams
+
+
+def _cosine(a, b):
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b.get(gram, 0) for gram, count in a.items())
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+
+class ChatAnswerCache:
+    """
+    每個題目一組的 AI 回答快取
+    - 以正規化提問的字元 n-gram cosine 相似度比對，超過 threshold 視為同一個問題
+    - 提到的選項字母與數字必須完全相同
+    - 每題最多 per_topic 筆（LRU），最多 max_topics 題（LRU），回答超過 ttl 秒失效
+    """
+
+    def __init__(self, threshold=0.85, per_topic=50, max_topics=2000, ttl=7 * 24 * 3600):
+        self.threshold = threshold
+        self.per_topic = per_topic
+        self.max_topics = max_topics
+        self.ttl = ttl
+        self._topics = OrderedDict()  # topic_key -> OrderedDict(normalized -> entry)
+        self._lock = threading.Lock()
+
+    def lookup(self, topic_key, question):
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        grams = _ngrams(normalized)
+        marks = _marks(question)
+        now = time.time()
+        with self._lock:
+            entries = self._topics.get(topic_key)
+            if not entries:
+                return None
+            self._topics.move_to_end(topic_key)
+
+            best, best_score = None, 0.0
+            for key, entry in list(entries.items()):
+                if now - entry["created_at"] > self.ttl:
+                    entries.pop(key)
+                    continue
+                if entry["marks"] != marks:
+                    continue
+                score = 1.0 if key == normalized else _cosine(grams, entry["grams"])
+                if score > best_score:
+                    best, best_score = key, score
+            if best is None or best_score < self.threshold:
+                return None
+            entries.move_to_end(best)
+            return entries[best]["answer"]
+
+    def store(self, topic_key, question, answer):
+        normalized = normalize_question(question)
+        if not normalized or not answer:
+            return
+        with self._lock:
+            entries = self._topics.setdefault(topic_key, OrderedDict())
+            self._topics.move_to_end(topic_key)
+            entries[normalized] = {
+                "grams": _ngrams(normalized),
+                "marks": _marks(question),
+                "answer": answer,
+                "created_at": time.time(),
+            }
+            entries.move_to_end(normalized)
+            while len(entries) > self.per_topic:
+                entries.popitem(last=False)
+            while len(self._topics) > self.max_topics:
+                self._topics.popitem(last=False)
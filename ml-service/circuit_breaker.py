@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class CircuitOpenError(Exception):
+    """斷路器開啟中，直接失敗讓呼叫端走快取或備用邏輯"""
+
+
+class CircuitBreaker:
+    """
+    每個模型一個斷路器：
+    - 以最近 window 次呼叫的失敗率判斷，超過 error_threshold 就開啟 open_seconds 秒
+    - 成功但超過 slow_after 秒的呼叫也算失敗，上游變慢時同樣會開啟
+    - 開啟期間 allow() 直接回 False；時間到後進入半開，只放一個探測請求
+    - 探測成功就關閉，失敗就再開啟一輪
+    - 另外依呼叫點記錄成功呼叫的延遲，供 hedged request 計算 p95
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, window=50, min_calls=10, error_threshold=0.5,
+                 open_seconds=30, latency_window=200):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.open_seconds = open_seconds
+        self.latency_window = latency_window
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # True = 成功
+        self._latencies = {}                   # endpoint -> deque(秒)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probing = False
+            # 半開：同時只放行一個探測請求
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self, endpoint, latency, slow_after=None):
+        """latency 為 None 時只記成功、不加入延遲統計（例如呼叫端提早結束的串流）"""
+        with self._lock:
+            if latency is not None:
+                self._latencies.setdefault(endpoint, deque(maxlen=self.latency_window)).append(latency)
+            if latency is not None and slow_after and latency >= slow_after:
+                print(f"🐢 斷路器 {self.name}: {endpoint} 耗時 {latency:.1f}s 超過 {slow_after:.1f}s，計為失敗")
+                self._record_failure()
+                return
+            self._outcomes.append(True)
+            if self._state == self.HALF_OPEN:
+                print(f"✅ 斷路器 {self.name} 探測成功，恢復正常")
+                self._state = self.CLOSED
+                self._outcomes.clear()
+                self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._record_failure()
+
+    def _record_failure(self):
+        self._outcomes.append(False)
+        if self._state == self.HALF_OPEN:
+            self._trip()
+            return
+        calls = len(self._outcomes)
+        failures = calls - sum(self._outcomes)
+        if calls >= self.min_calls and failures / calls >= self.error_threshold:
+            self._trip()
+
+    def release_probe(self):
+        """探測請求沒有產生成功/失敗結果時（例如參數錯誤），讓下一個請求可以再探測"""
+        with self._lock:
+            self._probing = False
+
+    def p95_latency(self, endpoint):
+        with self._lock:
+            samples = sorted(self._latencies.get(endpoint, ()))
+        if len(samples) < self.min_calls:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def _trip(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        print(f"❌ 斷路器 {self.name} 開啟 {self.open_seconds} 秒")
+
+
+def hedged_call(executor, fn, delay):
+    """
+    先送出一個請求，超過 delay 秒還沒回來就再送一個相同的請求，
+    取先成功回來的結果；兩個都失敗時拋出最後的錯誤
+    """
+    first = executor.submit(fn)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    print(f"⏱️ 請求超過 p95 ({delay:.1f}s)，送出 hedged request")
+    pending = {first, executor.submit(fn)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+async def async_hedged_call(fn, delay):
+    """hedged_call 的 async 版本，fn 每次呼叫回傳一個新的 coroutine"""
+    first = asyncio.ensure_future(fn())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    print(f"⏱️ 請求超過 p95 ({delay:.1f}s)，送出 hedged request")
+    pending = {first, asyncio.ensure_future(fn())}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # 取得結果（或呼叫端被取消）後，取消還在跑的另一個請求
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,371 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, async_hedged_call, hedged_call
+
+# 連線池設定：整個 process 共用一個 httpx.Client，保持 keep-alive 重複使用 TLS 連線
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+# async 服務同時進行中的上游呼叫上限，超過的請求排隊等待
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "64"))
+
+# 各呼叫點的逾時（秒）與重試次數，統一在這裡調整
+# 重試由這裡自己做（SDK 的 max_retries 設為 0），每一次嘗試的結果都會算進斷路器
+ENDPOINT_TIMEOUTS = {
+    "quiz": float(os.getenv("QUIZ_GENERATION_TIMEOUT", "60")),
+    "chat": float(os.getenv("LLM_TIMEOUT_CHAT", "30")),
+    "chat_summary": float(os.getenv("LLM_TIMEOUT_CHAT_SUMMARY", "20")),
+    "retest": float(os.getenv("LLM_TIMEOUT_RETEST", "20")),
+    "parse_answer": float(os.getenv("LLM_TIMEOUT_PARSE_ANSWER", "30")),
+    "topic_from_note": float(os.getenv("LLM_TIMEOUT_TOPIC_FROM_NOTE", "15")),
+}
+ENDPOINT_RETRIES = {
+    "quiz": int(os.getenv("LLM_RETRIES_QUIZ", "1")),
+    "chat": int(os.getenv("LLM_RETRIES_CHAT", "1")),
+    "chat_summary": int(os.getenv("LLM_RETRIES_CHAT_SUMMARY", "1")),
+    "retest": int(os.getenv("LLM_RETRIES_RETEST", "1")),
+    "parse_answer": int(os.getenv("LLM_RETRIES_PARSE_ANSWER", "1")),
+    "topic_from_note": int(os.getenv("LLM_RETRIES_TOPIC_FROM_NOTE", "0")),
+}
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_RETRIES = 1
+# 重試間隔：0.5s、1s、2s… 加上抖動，最多 LLM_RETRY_MAX_DELAY 秒
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+
+# 斷路器：最近 N 次呼叫失敗率超過門檻就暫停呼叫該模型一段時間
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "50"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_ERROR_THRESHOLD = float(os.getenv("LLM_BREAKER_ERROR_THRESHOLD", "0.5"))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+# 成功但耗時超過「該呼叫點逾時 × 比例」的呼叫也算失敗，設為 0 關閉
+LLM_BREAKER_SLOW_CALL_RATIO = float(os.getenv("LLM_BREAKER_SLOW_CALL_RATIO", "0.8"))
+
+# Hedged request：超過該呼叫點 p95 延遲時再送一個相同請求，取先回來的
+# 生成題目很耗 token，預設只對短回應的呼叫點啟用
+LLM_HEDGE_ENDPOINTS = {
+    e.strip() for e in os.getenv("LLM_HEDGE_ENDPOINTS", "chat,retest,parse_answer,topic_from_note").split(",") if e.strip()
+}
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "32"))
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+_inflight = None
+_breakers = {}
+_breakers_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+
+
+def get_api_key():
+    api_key = os.getenv('OPENAI_API_KEY', '')
+    if api_key == 'your-api-key-here':
+        return ''
+    return api_key
+
+
+def has_api_key():
+    return bool(get_api_key())
+
+
+def get_client():
+    """取得 process 共用的 OpenAI client（第一次呼叫時建立）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                http_client = httpx.Client(
+                    limits=_http_limits(),
+                    timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                )
+                _client = OpenAI(api_key=get_api_key(), http_client=http_client, max_retries=0)
+    return _client
+
+
+def _http_limits():
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def client_for(endpoint):
+    """依呼叫點套用逾時設定（with_options 會沿用同一個連線池）"""
+    timeout = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+    return get_client().with_options(timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT))
+
+
+def breaker_for(model):
+    with _breakers_lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                model,
+                window=LLM_BREAKER_WINDOW,
+                min_calls=LLM_BREAKER_MIN_CALLS,
+                error_threshold=LLM_BREAKER_ERROR_THRESHOLD,
+                open_seconds=LLM_BREAKER_OPEN_SECONDS,
+            )
+            _breakers[model] = breaker
+        return breaker
+
+
+def _is_upstream_failure(error):
+    """只有上游的問題（連線、逾時、429、5xx）才算進斷路器失敗率，參數錯誤不算"""
+    if isinstance(error, openai.APIConnectionError):  # 含 APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _is_stream_failure(error):
+    """串流讀到一半的錯誤：除了 create() 會遇到的之外，還有 httpx 讀取逾時 / 連線中斷與 SSE 的 error 事件"""
+    return _is_upstream_failure(error) or isinstance(error, (httpx.TransportError, openai.APIError))
+
+
+class _StreamOutcome:
+    """
+    串流呼叫的斷路器紀錄要等串流結束才決定，不能只看 create() 有沒有回來：
+    - 讀完：成功，延遲為整個串流的時間（記在「呼叫點:stream」，不影響非串流呼叫的 p95）
+    - 讀到一半出錯（含卡住到讀取逾時）：上游問題算失敗
+    - 呼叫端提早關閉：有收到內容就算成功但不計延遲，什麼都沒收到就只釋放探測名額
+    串流的卡頓會以讀取逾時出現，所以不再套用整體耗時的慢呼叫門檻
+    """
+
+    def _init_outcome(self, breaker, endpoint, start):
+        self._breaker = breaker
+        self._endpoint = endpoint
+        self._start = start
+        self._received = False
+        self._recorded = False
+
+    def _record(self, error=None, complete=False):
+        if self._recorded:
+            return
+        self._recorded = True
+        if error is not None:
+            if _is_stream_failure(error):
+                print(f"❌ {self._endpoint} 串流中斷: {type(error).__name__}: {str(error)}")
+                self._breaker.record_failure()
+            else:
+                self._breaker.release_probe()
+        elif complete:
+            self._breaker.record_success(f"{self._endpoint}:stream", time.monotonic() - self._start)
+        elif self._received:
+            self._breaker.record_success(self._endpoint, None)
+        else:
+            self._breaker.release_probe()
+
+
+class _BreakerStream(_StreamOutcome):
+    """包住 OpenAI 的 Stream，串流結束時才記錄斷路器"""
+
+    def __init__(self, stream, breaker, endpoint, start):
+        self._stream = stream
+        self._init_outcome(breaker, endpoint, start)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._stream)
+        except StopIteration:
+            self._record(complete=True)
+            raise
+        except Exception as e:
+            self._record(error=e)
+            raise
+        self._received = True
+        return chunk
+
+    def close(self):
+        self._record()
+        self._stream.close()
+
+
+def _slow_call_seconds(endpoint):
+    if LLM_BREAKER_SLOW_CALL_RATIO <= 0:
+        return None
+    return ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT) * LLM_BREAKER_SLOW_CALL_RATIO
+
+
+def _retry_delay(attempt):
+    delay = min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt)
+    return delay * random.uniform(0.75, 1.0)
+
+
+def _should_retry(error, attempt, retries, breaker):
+    """
+    上游失敗才記進斷路器並決定是否重試；參數錯誤等其他例外直接拋出
+    斷路器因這次失敗開啟時不再重試
+    """
+    if not _is_upstream_failure(error):
+        breaker.release_probe()
+        return False
+    breaker.record_failure()
+    return attempt < retries and breaker.allow()
+
+
+def _timed_create(endpoint, breaker, kwargs):
+    retries = ENDPOINT_RETRIES.get(endpoint, DEFAULT_RETRIES)
+    for attempt in range(retries + 1):
+        start = time.monotonic()
+        try:
+            response = client_for(endpoint).chat.completions.create(**kwargs)
+        except Exception as e:
+            if not _should_retry(e, attempt, retries, breaker):
+                raise
+            print(f"🔁 {endpoint} 呼叫失敗，第 {attempt + 1} 次重試: {str(e)}")
+            time.sleep(_retry_delay(attempt))
+            continue
+        if kwargs.get("stream"):
+            return _BreakerStream(response, breaker, endpoint, start)
+        breaker.record_success(endpoint, time.monotonic() - start, slow_after=_slow_call_seconds(endpoint))
+        return response
+
+
+def chat_completion(endpoint, **kwargs):
+    """
+    所有 chat.completions 呼叫的單一入口
+    - 斷路器開啟時直接拋出 CircuitOpenError，讓呼叫端立即走快取或備用邏輯
+    - 非串流且啟用 hedging 的呼叫點，超過 p95 延遲會送出第二個請求
+    """
+    breaker = breaker_for(kwargs.get("model", ""))
+    if not breaker.allow():
+        raise CircuitOpenError(f"模型 {kwargs.get('model')} 的斷路器開啟中，暫停呼叫")
+
+    call = lambda: _timed_create(endpoint, breaker, kwargs)
+    if endpoint in LLM_HEDGE_ENDPOINTS and not kwargs.get("stream") and breaker.state == CircuitBreaker.CLOSED:
+        p95 = breaker.p95_latency(endpoint)
+        if p95 is not None:
+            return hedged_call(_hedge_executor, call, max(LLM_HEDGE_MIN_DELAY, p95))
+    return call()
+
+
+# ---------- async 服務（async_apps.py）使用 ----------
+
+def get_async_client():
+    """取得 async 服務共用的 AsyncOpenAI client（只在 event loop 內使用，不需要鎖）"""
+    global _async_client
+    if _async_client is None:
+        http_client = httpx.AsyncClient(
+            limits=_http_limits(),
+            timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+        _async_client = AsyncOpenAI(api_key=get_api_key(), http_client=http_client, max_retries=0)
+    return _async_client
+
+
+def async_client_for(endpoint):
+    timeout = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+    return get_async_client().with_options(timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT))
+
+
+def _inflight_semaphore():
+    global _inflight
+    if _inflight is None:
+        _inflight = asyncio.Semaphore(LLM_MAX_INFLIGHT)
+    return _inflight
+
+
+class _AsyncPermitStream(_StreamOutcome):
+    """
+    包住 AsyncStream：串流讀完、出錯或被關閉時才釋放 LLM_MAX_INFLIGHT 名額並記錄斷路器
+    上游連線在整個串流期間都佔著，名額也要跟著串流走，不能在 create() 回來時就釋放
+    呼叫端提早停止讀取時請用 contextlib.aclosing 確保關閉
+    """
+
+    def __init__(self, stream, semaphore, breaker, endpoint, start):
+        self._stream = stream
+        self._semaphore = semaphore
+        self._closed = False
+        self._init_outcome(breaker, endpoint, start)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            self._record(complete=True)
+            await self.aclose()
+            raise
+        except Exception as e:
+            self._record(error=e)
+            await self.aclose()
+            raise
+        except BaseException:
+            # CancelledError：呼叫端放棄，與提早關閉相同
+            await self.aclose()
+            raise
+        self._received = True
+        return chunk
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._record()
+        self._semaphore.release()
+        await self._stream.close()
+
+
+async def _timed_create_async(endpoint, breaker, kwargs):
+    retries = ENDPOINT_RETRIES.get(endpoint, DEFAULT_RETRIES)
+    semaphore = _inflight_semaphore()
+    for attempt in range(retries + 1):
+        # 排隊時間不算進延遲統計，拿到名額後才開始計時；等待重試時不佔名額
+        await semaphore.acquire()
+        handed_off = False
+        try:
+            start = time.monotonic()
+            try:
+                response = await async_client_for(endpoint).chat.completions.create(**kwargs)
+            except Exception as e:
+                if not _should_retry(e, attempt, retries, breaker):
+                    raise
+                print(f"🔁 {endpoint} 呼叫失敗，第 {attempt + 1} 次重試: {str(e)}")
+                response = None
+            latency = time.monotonic() - start
+            if response is not None and kwargs.get("stream"):
+                response = _AsyncPermitStream(response, semaphore, breaker, endpoint, start)
+                handed_off = True
+        finally:
+            if not handed_off:
+                semaphore.release()
+        if response is None:
+            await asyncio.sleep(_retry_delay(attempt))
+            continue
+        if handed_off:
+            return response
+        breaker.record_success(endpoint, latency, slow_after=_slow_call_seconds(endpoint))
+        return response
+
+
+async def async_chat_completion(endpoint, **kwargs):
+    """chat_completion 的 async 版本：同樣套用斷路器與 hedging，並以 LLM_MAX_INFLIGHT 限制同時呼叫數"""
+    breaker = breaker_for(kwargs.get("model", ""))
+    if not breaker.allow():
+        raise CircuitOpenError(f"模型 {kwargs.get('model')} 的斷路器開啟中，暫停呼叫")
+
+    call = lambda: _timed_create_async(endpoint, breaker, kwargs)
+    if endpoint in LLM_HEDGE_ENDPOINTS and not kwargs.get("stream") and breaker.state == CircuitBreaker.CLOSED:
+        p95 = breaker.p95_latency(endpoint)
+        if p95 is not None:
+            return await async_hedged_call(call, max(LLM_HEDGE_MIN_DELAY, p95))
+    return await call()
@@ -0,0 +1,25 @@
+import threading
+from collections import OrderedDict
+
+
+class PromptLRU:
+    """編譯好的 system prompt 快取（key 含題目版本，題目修改後舊版本自然被 LRU 淘汰）"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            prompt = self._entries.get(key)
+            if prompt is not None:
+                self._entries.move_to_end(key)
+            return prompt
+
+    def put(self, key, prompt):
+        with self._lock:
+            self._entries[key] = prompt
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
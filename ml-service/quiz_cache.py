@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from copy import deepcopy
+from pathlib import Path
+
+
+def normalize_topic(topic):
+    """正規化主題：全半形統一、去頭尾空白、合併連續空白、轉小寫"""
+    topic = unicodedata.normalize("NFKC", str(topic or ""))
+    return re.sub(r"\s+", " ", topic).strip().lower()
+
+
+def _title_key(question):
+    """題庫去重用的題目標題 key"""
+    return re.sub(r"[\s\W_]+", "", str(question.get("title") or "")).lower()
+
+
+class QuestionBankCache:
+    """
+    以正規化後的 (topic, difficulty) 為 key 的題庫快取
+    - 每個 key 累積多次生成的題目（依標題去重，最多 bank_size 題）
+    - ttl 內且題庫夠大時直接抽題回傳，不呼叫 OpenAI
+    - stale_ttl 內的過期題庫只在 AI 失敗或逾時時拿來補題
+    - 記憶體內以 LRU 淘汰，cache_dir 有設定時同時寫入磁碟
+    """
+
+    def __init__(self, ttl=3600, stale_ttl=7 * 24 * 3600, max_entries=512,
+                 bank_size=60, min_bank_ratio=2, cache_dir=None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.bank_size = bank_size
+        self.min_bank_ratio = min_bank_ratio
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(topic, difficulty):
+        """內容定址 key：正規化參數的 sha256"""
+        raw = json.dumps([normalize_topic(topic), str(difficulty or "").strip().lower()], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_fresh(self, key, count):
+        """ttl 內且題庫至少有 count * min_bank_ratio 題時，隨機抽出 count 題"""
+        with self._lock:
+            entry = self._get_entry(key)
+            if not entry or time.time() - entry["updated_at"] > self.ttl:
+                return None
+            bank = entry["questions"]
+            if len(bank) < count * self.min_bank_ratio:
+                return None
+            return deepcopy(random.sample(bank, count))
+
+    def get_stale(self, key, count, exclude=None):
+        """AI 失敗時的備援：stale_ttl 內的題庫最多取 count 題（可排除已有的題目）"""
+        with self._lock:
+            entry = self._get_entry(key)
+            if not entry or time.time() - entry["updated_at"] > self.stale_ttl:
+                return []
+            excluded = {_title_key(q) for q in (exclude or [])}
+            candidates = [q for q in entry["questions"] if _title_key(q) not in excluded]
+            return deepcopy(random.sample(candidates, min(count, len(candidates))))
+
+    def put(self, key, questions):
+        """把新生成的題目加入題庫（依標題去重，保留最新的 bank_size 題）"""
+        if not questions:
+            return
+        with self._lock:
+            entry = self._get_entry(key) or {"questions": [], "updated_at": 0}
+            bank = {_title_key(q): q for q in entry["questions"]}
+            for q in questions:
+                title_key = _title_key(q)
+                if title_key:
+                    bank.pop(title_key, None)
+                    bank[title_key] = deepcopy(q)
+            entry = {
+                "questions": list(bank.values())[-self.bank_size:],
+                "updated_at": time.time(),
+            }
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._write_disk(key, entry)
+
+    def _get_entry(self, key):
+        """先查記憶體，沒有再查磁碟（呼叫端需持有 lock）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._read_disk(key)
+            if entry is None:
+                return None
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(key)
+        return entry
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("updated_at", 0) > self.stale_ttl:
+            # 超過 stale_ttl 的檔案直接清掉
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        tmp_path = self._path(key).with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"⚠️ 題庫快取寫入磁碟失敗: {str(e)}")
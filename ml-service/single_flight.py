@@ -0,0 +1,72 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    合併同時進行的相同請求：
+    同一個 key 第一個進來的請求（leader）實際執行 fn，
+    執行期間進來的相同請求（follower）等待並共用 leader 的結果或錯誤
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """回傳 (結果, 是否為共用別人的結果)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            if call.followers:
+                print(f"✅ 合併 {call.followers} 個相同的生成請求")
+            call.event.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """SingleFlight 的 async 版本（同一個 event loop 內使用，不需要鎖）"""
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, fn):
+        """fn 回傳 coroutine；回傳 (結果, 是否為共用別人的結果)"""
+        task = self._tasks.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # shield：leader 的連線斷掉時，follower 仍可拿到結果
+        return await asyncio.shield(task), False
@@ -0,0 +1,113 @@
+import os
+import threading
+import unittest
+from contextlib import aclosing
+from unittest import mock
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import async_apps
+import llm_client
+
+
+class FakeAsyncStream:
+    def __init__(self, chunks, error=None):
+        self._chunks = iter(chunks)
+        self._error = error
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            if self._error is not None:
+                raise self._error
+            raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+
+class InflightPermitTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        llm_client._breakers.clear()
+        for patcher in [
+            mock.patch.object(llm_client, "_inflight", None),
+            mock.patch.object(llm_client, "LLM_MAX_INFLIGHT", 1),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.create = mock.AsyncMock()
+        client = mock.Mock()
+        client.chat.completions.create = self.create
+        patcher = mock.patch.object(llm_client, "async_client_for", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _available(self):
+        return llm_client._inflight_semaphore()._value
+
+    async def test_stream_holds_permit_until_exhausted(self):
+        upstream = FakeAsyncStream(["a", "b"])
+        self.create.return_value = upstream
+        stream = await llm_client.async_chat_completion("chat", model="m", stream=True)
+        self.assertEqual(self._available(), 0)
+        self.assertEqual([chunk async for chunk in stream], ["a", "b"])
+        self.assertEqual(self._available(), 1)
+        self.assertTrue(upstream.closed)
+
+    async def test_early_close_releases_permit(self):
+        upstream = FakeAsyncStream(["a", "b"])
+        self.create.return_value = upstream
+        stream = await llm_client.async_chat_completion("chat", model="m", stream=True)
+        async with aclosing(stream):
+            async for _ in stream:
+                break
+        self.assertEqual(self._available(), 1)
+        self.assertTrue(upstream.closed)
+
+    async def test_broken_stream_releases_permit_and_counts_failure(self):
+        self.create.return_value = FakeAsyncStream(["a"], error=httpx.ReadTimeout("stalled"))
+        stream = await llm_client.async_chat_completion("chat", model="m", stream=True)
+        with self.assertRaises(httpx.ReadTimeout):
+            async for _ in stream:
+                pass
+        self.assertEqual(self._available(), 1)
+        self.assertEqual(list(llm_client.breaker_for("m")._outcomes), [False])
+
+    async def test_non_stream_releases_after_create(self):
+        self.create.return_value = "ok"
+        self.assertEqual(await llm_client.async_chat_completion("chat", model="m"), "ok")
+        self.assertEqual(self._available(), 1)
+
+    async def test_failed_create_releases_permit(self):
+        self.create.side_effect = ValueError("bad")
+        with self.assertRaises(ValueError):
+            await llm_client.async_chat_completion("chat", model="m", stream=True)
+        self.assertEqual(self._available(), 1)
+
+
+class AsyncQuestionCacheTests(unittest.IsolatedAsyncioTestCase):
+    async def test_cache_lookup_runs_off_the_event_loop(self):
+        threads = []
+
+        def get_fresh(key, count):
+            threads.append(threading.current_thread())
+            return [{"title": "cached"}]
+
+        with mock.patch.object(async_apps, "has_api_key", return_value=True), \
+                mock.patch.object(async_apps, "_take_from_warm_pool", return_value=None), \
+                mock.patch.object(async_apps.question_cache, "get_fresh", side_effect=get_fresh), \
+                mock.patch.object(async_apps, "_reshuffle_cached", side_effect=lambda qs: qs):
+            questions = await async_apps.generate_quiz_questions("t", "beginner", 1)
+        self.assertEqual(questions, [{"title": "cached"}])
+        self.assertNotEqual(threads, [threading.current_thread()])
+
+
+if __name__ == "__main__":
+    unittest.main()
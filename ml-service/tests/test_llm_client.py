@@ -0,0 +1,148 @@
+import os
+import unittest
+from unittest import mock
+
+import httpx
+import openai
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import llm_client
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+def _timeout_error():
+    return openai.APITimeoutError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def test_slow_success_counts_as_failure(self):
+        breaker = CircuitBreaker("m", min_calls=4, error_threshold=0.5)
+        for _ in range(2):
+            breaker.record_success("chat", 0.1, slow_after=1.0)
+        for _ in range(2):
+            breaker.record_success("chat", 5.0, slow_after=1.0)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_slow_probe_reopens(self):
+        breaker = CircuitBreaker("m", min_calls=1, error_threshold=0.5, open_seconds=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record_success("chat", 5.0, slow_after=1.0)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+class ChatCompletionRetryTests(unittest.TestCase):
+    def setUp(self):
+        llm_client._breakers.clear()
+        patcher = mock.patch.object(llm_client, "_retry_delay", return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.create = mock.Mock()
+        client = mock.Mock()
+        client.chat.completions.create = self.create
+        patcher = mock.patch.object(llm_client, "client_for", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sdk_retries_disabled(self):
+        self.assertEqual(llm_client.get_client().max_retries, 0)
+
+    def test_each_retry_is_recorded(self):
+        self.create.side_effect = [_timeout_error(), "ok"]
+        with mock.patch.dict(llm_client.ENDPOINT_RETRIES, {"quiz": 1}):
+            self.assertEqual(llm_client.chat_completion("quiz", model="m1"), "ok")
+        self.assertEqual(list(llm_client.breaker_for("m1")._outcomes), [False, True])
+
+    def test_retries_stop_once_breaker_opens(self):
+        self.create.side_effect = _timeout_error()
+        with mock.patch.multiple(llm_client, LLM_BREAKER_MIN_CALLS=2), \
+                mock.patch.dict(llm_client.ENDPOINT_RETRIES, {"quiz": 5}):
+            with self.assertRaises(openai.APITimeoutError):
+                llm_client.chat_completion("quiz", model="m2")
+            self.assertEqual(self.create.call_count, 2)
+            with self.assertRaises(CircuitOpenError):
+                llm_client.chat_completion("quiz", model="m2")
+
+    def test_bad_request_is_not_retried(self):
+        self.create.side_effect = ValueError("bad")
+        with self.assertRaises(ValueError):
+            llm_client.chat_completion("quiz", model="m3")
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual(list(llm_client.breaker_for("m3")._outcomes), [])
+
+
+class FakeStream:
+    def __init__(self, chunks, error=None):
+        self._chunks = iter(chunks)
+        self._error = error
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            if self._error is not None:
+                raise self._error
+            raise
+
+    def close(self):
+        self.closed = True
+
+
+class StreamBreakerTests(unittest.TestCase):
+    def setUp(self):
+        llm_client._breakers.clear()
+        self.create = mock.Mock()
+        client = mock.Mock()
+        client.chat.completions.create = self.create
+        patcher = mock.patch.object(llm_client, "client_for", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = llm_client.breaker_for("m")
+
+    def _stream(self, upstream):
+        self.create.return_value = upstream
+        return llm_client.chat_completion("chat", model="m", stream=True)
+
+    def test_nothing_is_recorded_until_the_stream_ends(self):
+        stream = self._stream(FakeStream(["a", "b"]))
+        self.assertEqual(list(self.breaker._outcomes), [])
+        self.assertEqual(list(stream), ["a", "b"])
+        self.assertEqual(list(self.breaker._outcomes), [True])
+        self.assertEqual(len(self.breaker._latencies["chat:stream"]), 1)
+        self.assertNotIn("chat", self.breaker._latencies)
+
+    def test_broken_stream_counts_as_failure(self):
+        read_timeout = httpx.ReadTimeout("stalled")
+        stream = self._stream(FakeStream(["a"], error=read_timeout))
+        with self.assertRaises(httpx.ReadTimeout):
+            list(stream)
+        self.assertEqual(list(self.breaker._outcomes), [False])
+
+    def test_early_close_is_success_without_latency(self):
+        upstream = FakeStream(["a", "b"])
+        stream = self._stream(upstream)
+        next(stream)
+        stream.close()
+        self.assertTrue(upstream.closed)
+        self.assertEqual(list(self.breaker._outcomes), [True])
+        self.assertEqual(self.breaker._latencies, {})
+
+    def test_half_open_probe_decided_by_stream(self):
+        breaker = llm_client.breaker_for("m")
+        breaker.open_seconds = 0
+        breaker._trip()
+        stream = self._stream(FakeStream(["a"], error=httpx.RemoteProtocolError("reset")))
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(httpx.RemoteProtocolError):
+            list(stream)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import json
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import topic_apps
+from topic_apps import IncrementalQuestionParser, recover_question_list, split_valid_questions
+
+
+def make_question(i):
+    return {
+        "title": f"第 {i} 題",
+        "option_A": f"甲{i}", "option_B": f"乙{i}", "option_C": f"丙{i}", "option_D": f"丁{i}",
+        "Ai_answer": "A",
+        "explanation_text": f"解析 {i}",
+    }
+
+
+class IncrementalQuestionParserTests(unittest.TestCase):
+    def test_objects_split_across_chunks(self):
+        text = "```json\n" + json.dumps([make_question(1), make_question(2)], ensure_ascii=False) + "\n```"
+        parser = IncrementalQuestionParser()
+        found = []
+        for i in range(0, len(text), 7):
+            found += parser.feed(text[i:i + 7])
+        self.assertEqual([q["title"] for q in found], ["第 1 題", "第 2 題"])
+
+    def test_braces_and_quotes_inside_strings(self):
+        q = {"title": 'a {b} "c" \\ }', "nested": {"x": 1}}
+        text = json.dumps(q)
+        parser = IncrementalQuestionParser()
+        found = [obj for ch in text for obj in parser.feed(ch)]
+        self.assertEqual(found, [q])
+
+    def test_truncated_tail_is_not_emitted(self):
+        text = json.dumps([make_question(1)], ensure_ascii=False)[:-1] + ', {"title": "被截斷'
+        self.assertEqual([q["title"] for q in IncrementalQuestionParser().feed(text)], ["第 1 題"])
+
+    def test_malformed_object_is_skipped(self):
+        text = '[{"title": 1,,}, ' + json.dumps(make_question(2), ensure_ascii=False) + "]"
+        self.assertEqual([q["title"] for q in IncrementalQuestionParser().feed(text)], ["第 2 題"])
+
+
+class RecoverQuestionListTests(unittest.TestCase):
+    def test_full_array_in_code_fence(self):
+        text = "```json\n" + json.dumps([make_question(1), make_question(2)], ensure_ascii=False) + "\n```"
+        questions, missing = recover_question_list(text, 2)
+        self.assertEqual(([q["title"] for q in questions], missing), (["第 1 題", "第 2 題"], 0))
+
+    def test_truncated_array_reports_missing(self):
+        text = json.dumps([make_question(1), make_question(2)], ensure_ascii=False)[:-20]
+        questions, missing = recover_question_list(text, 3)
+        self.assertEqual(([q["title"] for q in questions], missing), (["第 1 題"], 2))
+
+    def test_extra_questions_are_trimmed(self):
+        text = json.dumps([make_question(i) for i in range(4)], ensure_ascii=False)
+        questions, missing = recover_question_list(text, 2)
+        self.assertEqual((len(questions), missing), (2, 0))
+
+    def test_split_valid_questions_rejects_placeholders(self):
+        bad = {**make_question(2), "option_B": "選項B", "Ai_answer": "E"}
+        accepted, notes = split_valid_questions([make_question(1), bad])
+        self.assertEqual([q["title"] for q in accepted], ["第 1 題"])
+        self.assertEqual(len(notes), 2)
+
+
+class FakeStream:
+    """模擬 OpenAI 串流：記錄被讀了幾段、有沒有被關閉"""
+
+    def __init__(self, text, size=10):
+        self.chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for piece in self.chunks:
+            self.consumed += 1
+            yield SimpleNamespace(choices=[SimpleNamespace(finish_reason=None, delta=SimpleNamespace(content=piece))])
+
+    def close(self):
+        self.closed = True
+
+
+class StreamQuestionsTests(unittest.TestCase):
+    def setUp(self):
+        for target, value in [
+            ("has_api_key", True),
+            ("_take_from_warm_pool", None),
+        ]:
+            patcher = mock.patch.object(topic_apps, target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache = mock.Mock()
+        cache.get_fresh.return_value = None
+        cache.get_stale.return_value = []
+        patcher = mock.patch.object(topic_apps, "question_cache", cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _stream(self, n):
+        text = json.dumps([make_question(i) for i in range(n)], ensure_ascii=False)
+        return FakeStream(text)
+
+    def test_stops_reading_once_count_reached(self):
+        stream = self._stream(5)
+        with mock.patch.object(topic_apps, "chat_completion", return_value=stream):
+            questions = list(topic_apps.stream_questions_with_ai("t", "beginner", 2))
+        self.assertEqual(len(questions), 2)
+        self.assertTrue(stream.closed)
+        self.assertLess(stream.consumed, len(stream.chunks))
+
+    def test_consumer_disconnect_closes_upstream(self):
+        stream = self._stream(5)
+        with mock.patch.object(topic_apps, "chat_completion", return_value=stream):
+            gen = topic_apps.stream_questions_with_ai("t", "beginner", 5)
+            next(gen)
+            gen.close()
+        self.assertTrue(stream.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,19 +1,57 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-# 更新 OpenAI 導入方式
-from openai import OpenAI
+# OpenAI client 統一由 llm_client 管理（共用連線池、逾時與重試）
+from llm_client import chat_completion, has_api_key
 import os , requests
 import json
+import hashlib
 from dotenv import load_dotenv  
 import re
 import random
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from quiz_cache import QuestionBankCache
+from warm_pool import WarmPool
+from single_flight import SingleFlight
+from chat_cache import ChatAnswerCache
+from prompt_cache import PromptLRU
 
 
 # 載入 .env 檔案
 ROOT = Path(__file__).resolve().parent.parent
 load_dotenv(ROOT / ".env")
 DJANGO_BASE_URL = os.getenv("DJANGO_BASE_URL", "http://localhost:8000")
+# 平行生成題目：每批題數、同時進行的批次上限、補題輪數
+QUIZ_BATCH_SIZE = int(os.getenv("QUIZ_BATCH_SIZE", "5"))
+QUIZ_MAX_WORKERS = int(os.getenv("QUIZ_MAX_WORKERS", "4"))
+QUIZ_TOPUP_ROUNDS = int(os.getenv("QUIZ_TOPUP_ROUNDS", "2"))
+# 回應被截斷時，只針對缺少的題數重新要求的次數上限
+QUIZ_REMAINDER_ROUNDS = int(os.getenv("QUIZ_REMAINDER_ROUNDS", "2"))
+# 題庫快取：新鮮期、過期備援期、LRU 筆數、每個 key 的題庫大小、磁碟目錄（可選）
+question_cache = QuestionBankCache(
+    ttl=int(os.getenv("QUIZ_CACHE_TTL", "3600")),
+    stale_ttl=int(os.getenv("QUIZ_CACHE_STALE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("QUIZ_CACHE_MAX_ENTRIES", "512")),
+    bank_size=int(os.getenv("QUIZ_CACHE_BANK_SIZE", "60")),
+    min_bank_ratio=int(os.getenv("QUIZ_CACHE_MIN_BANK_RATIO", "2")),
+    cache_dir=os.getenv("QUIZ_CACHE_DIR") or None,
+)
+# 相同參數同時進來的生成請求只打一次 OpenAI
+quiz_flight = SingleFlight()
+# 熱門主題預熱池（預設關閉，會在背景持續消耗 token）
+WARM_POOL_ENABLED = os.getenv("WARM_POOL_ENABLED", "false").lower() == "true"
+# 對話回答快取：同一題的相似提問直接回覆（只用在對話剛開始、沒有摘要的提問）
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "true").lower() == "true"
+CHAT_CACHE_MAX_HISTORY = int(os.getenv("CHAT_CACHE_MAX_HISTORY", "1"))
+chat_answer_cache = ChatAnswerCache(
+    threshold=float(os.getenv("CHAT_CACHE_THRESHOLD", "0.85")),
+    per_topic=int(os.getenv("CHAT_CACHE_PER_TOPIC", "50")),
+    max_topics=int(os.getenv("CHAT_CACHE_MAX_TOPICS", "2000")),
+    ttl=int(os.getenv("CHAT_CACHE_TTL", str(7 * 24 * 3600))),
+)
+# 題目的對話 system prompt：Django 只送題目版本，命中時不需要完整題目內容
+topic_prompts = PromptLRU(int(os.getenv("TOPIC_PROMPT_CACHE_SIZE", "1024")))
 app = Flask(__name__)
 # 配置CORS，允許前端跨域調用
 CORS(app)
@@ -62,21 +100,11 @@ def generate_mock_questions(topic, count):
     
     return mock_questions
 
-def generate_questions_with_ai(topic, difficulty, count):
-    """使用 AI 生成題目，一次生成完所有題目"""
-    print(f"=== 開始生成題目 ===")
-    print(f"主題: {topic}, 難度: {difficulty}, 數量: {count}")
-
-    # 檢查 API Key
-    api_key = os.getenv('OPENAI_API_KEY', 'your-api-key-here')
-    
-
-    if api_key == 'your-api-key-here' or not api_key:
-        return generate_mock_questions(topic, count)
+QUIZ_SYSTEM_PROMPT = "你是一個題目生成助手，請根據使用者的需求生成題目。"
 
-    # 使用新版 OpenAI 客戶端
-    client = OpenAI(api_key=api_key)
 
+def build_quiz_prompt(topic, difficulty, count, avoid_titles=None, fix_notes=None):
+    """組出生成題目的提示詞，avoid_titles 為需要避開的既有題目，fix_notes 為上一批被退回的原因"""
     prompt = f"""
     你是一個全知的ai，你精通各式各樣的領域。你擅於根據人們給你的主題及難度，生成出與該主題、難度相符的選擇題，提意必須清楚、完整、、邏輯嚴謹、無語病。在你把題目跟選項生成前請你先思考題目及選項是否正確，你習慣先將題目出完後再思考選項怎麼出適合，選項(A/B/C/D)中必有且只有一個正確答案，必須將正確答案隨機分配到(A/B/C/D)四個選項。
     請根據以下條件生成 {count} 道選擇題：
@@ -160,86 +188,506 @@ def generate_questions_with_ai(topic, difficulty, count):
     - advanced: 3
     - master: 4
     """
+    if avoid_titles:
+        avoid_list = "\n".join(f"    - {title}" for title in avoid_titles)
+        prompt += f"""
+    以下題目已經出過，請勿重複或只做些微改寫：
+{avoid_list}
+    """
+    if fix_notes:
+        notes_list = "\n".join(f"    - {note}" for note in fix_notes)
+        prompt += f"""
+    上一批有題目因以下問題被退回，請特別注意不要再犯：
+{notes_list}
+    """
+    return prompt
 
 
-    try:
-        # 使用新版 API 語法
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "你是一個題目生成助手，請根據使用者的需求生成題目。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.8,  # 適中溫度，保持創意性
-            max_tokens=4000   # 限制長度，提升生成速度
+def build_quiz_request(topic, difficulty, count, avoid_titles=None, fix_notes=None):
+    """生成題目的 chat.completions 參數（同步與 async 服務共用）"""
+    return dict(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": QUIZ_SYSTEM_PROMPT},
+            {"role": "user", "content": build_quiz_prompt(topic, difficulty, count, avoid_titles, fix_notes)}
+        ],
+        temperature=0.8,  # 適中溫度，保持創意性
+        max_tokens=4000   # 限制長度，提升生成速度
+    )
+
+
+def _request_question_list(topic, difficulty, count, avoid_titles=None, fix_notes=None):
+    """呼叫一次 OpenAI，回傳 (救回的原始題目列表, finish_reason)"""
+    response = chat_completion("quiz", **build_quiz_request(topic, difficulty, count, avoid_titles, fix_notes))
+    return parse_question_list_response(response, count)
+
+
+def parse_question_list_response(response, count):
+    """從 OpenAI 回應救回題目列表，回傳 (原始題目列表, finish_reason)"""
+    ai_response = response.choices[0].message.content or ""
+    finish_reason = getattr(response.choices[0], 'finish_reason', None)
+    print(f"=== OpenAI API 回應詳情 ===")
+    print(f"使用的 tokens: {response.usage.total_tokens if hasattr(response, 'usage') else '未知'}")
+    print(f"完成原因: {finish_reason or '未知'}")
+    print(f"回應長度: {len(ai_response)} 字元")
+    print(f"AI 回應: {ai_response}")
+    print(f"===+++++++++++++++++++===")
+
+    questions, missing = recover_question_list(ai_response, count)
+    if missing:
+        print(f"⚠️ 回應只救回 {len(questions)} 題，缺 {missing} 題（finish_reason={finish_reason}）")
+    return questions, finish_reason
+
+
+def _generate_questions_batch(topic, difficulty, count, avoid_titles=None):
+    """
+    生成一批題目，回傳格式化後的題目
+    - 回應被截斷（finish_reason == "length"）時保留已完整的題目，只針對缺少的題數再要求一次
+    - 每題先經過 validate_question，沒通過的題目不採用，只針對這幾題附上退回原因重新生成
+    API 錯誤直接拋出，完全無法解析時回傳空列表，由呼叫端決定如何補題
+    """
+    questions = []
+    fix_notes = None
+    for _ in range(QUIZ_REMAINDER_ROUNDS + 1):
+        missing = count - len(questions)
+        if missing <= 0:
+            break
+        avoid = list(avoid_titles or []) + [q["title"] for q in questions]
+        raw_questions, finish_reason = _request_question_list(
+            topic, difficulty, missing, avoid or None, fix_notes
         )
+        accepted, rejected_notes = split_valid_questions(raw_questions[:missing])
+        questions.extend(format_question(q) for q in accepted)
+        fix_notes = rejected_notes or None
+        # 沒被截斷卻一題都解析不出來（例如「主題無法產生合理題目。」）就不再重試
+        if finish_reason != "length" and not raw_questions:
+            break
+    return questions
+
+
+def _normalize_title(title):
+    """題目去重用：去掉空白與標點、轉小寫"""
+    return re.sub(r"[\s\W_]+", "", str(title or "")).lower()
+
+
+def _split_batches(count, batch_size):
+    """把題數切成多個不超過 batch_size 的子批次"""
+    batch_size = max(1, batch_size)
+    return [min(batch_size, count - start) for start in range(0, count, batch_size)]
+
+
+def generate_questions_parallel(topic, difficulty, count, batch_size=None, pad_with_mock=True):
+    """
+    平行生成題目：
+    1. 把 count 切成多個子批次，同時送出（受 QUIZ_MAX_WORKERS 限制）
+    2. 合併結果並依題目標題去重
+    3. 不足的題數再補生成（最多 QUIZ_TOPUP_ROUNDS 輪），仍不足才用模擬題目補齊
+       （pad_with_mock=False 時只回傳實際生成的題目）
+    """
+    batch_size = batch_size or QUIZ_BATCH_SIZE
+    print(f"=== 開始平行生成題目 ===")
+    print(f"主題: {topic}, 難度: {difficulty}, 數量: {count}, 每批: {batch_size}")
+
+    if not has_api_key():
+        return generate_mock_questions(topic, count)
 
-        ai_response = response.choices[0].message.content
-        print(f"=== OpenAI API 回應詳情 ===")
-        print(f"使用的 tokens: {response.usage.total_tokens if hasattr(response, 'usage') else '未知'}")
-        print(f"完成原因: {response.choices[0].finish_reason if hasattr(response.choices[0], 'finish_reason') else '未知'}")
-        print(f"回應長度: {len(ai_response)} 字元")
-        print(f"AI 回應: {ai_response}")
-        print(f"===+++++++++++++++++++===")
-        return parse_ai_response(ai_response, count)
+    questions = []
+    seen_titles = set()
 
+    for round_no in range(QUIZ_TOPUP_ROUNDS + 1):
+        missing = count - len(questions)
+        if missing <= 0:
+            break
+
+        batches = _split_batches(missing, batch_size)
+        avoid_titles = [q["title"] for q in questions] or None
+        print(f"第 {round_no + 1} 輪：缺 {missing} 題，分成 {len(batches)} 批")
+
+        with ThreadPoolExecutor(max_workers=max(1, min(QUIZ_MAX_WORKERS, len(batches)))) as executor:
+            futures = [
+                executor.submit(_generate_questions_batch, topic, difficulty, size, avoid_titles)
+                for size in batches
+            ]
+            for future in as_completed(futures):
+                try:
+                    batch_questions = future.result()
+                except Exception as e:
+                    print(f"❌ 子批次生成失敗: {type(e).__name__}: {str(e)}")
+                    continue
+                for q in batch_questions:
+                    key = _normalize_title(q.get("title"))
+                    if not key or key in seen_titles:
+                        continue
+                    seen_titles.add(key)
+                    questions.append(q)
+
+    questions = questions[:count]
+    if len(questions) < count and pad_with_mock:
+        print(f"⚠️ 平行生成後仍缺 {count - len(questions)} 題，使用模擬題目補齊")
+        questions.extend(generate_mock_questions(topic, count - len(questions)))
+    return questions
+
+
+def _reshuffle_cached(questions):
+    """快取題目再打亂一次選項，避免每個人拿到相同的答案位置"""
+    return [format_question(q) for q in questions]
+
+
+def _generate_for_warm_pool(topic, difficulty, count):
+    """預熱池的補題函式：只回傳實際生成的題目，並順便寫入題庫快取"""
+    questions = generate_questions_parallel(topic, difficulty, count, pad_with_mock=False)
+    question_cache.put(question_cache.make_key(topic, difficulty), questions)
+    return questions
+
+
+warm_pool = WarmPool(
+    _generate_for_warm_pool,
+    depth=int(os.getenv("WARM_POOL_DEPTH", "20")),
+    hot_topics=int(os.getenv("WARM_POOL_HOT_TOPICS", "10")),
+    min_requests=int(os.getenv("WARM_POOL_MIN_REQUESTS", "3")),
+    concurrency=int(os.getenv("WARM_POOL_CONCURRENCY", "2")),
+    interval=int(os.getenv("WARM_POOL_INTERVAL", "30")),
+    batch_size=QUIZ_BATCH_SIZE,
+)
+
+
+def _take_from_warm_pool(topic, difficulty, count):
+    """記錄請求熱度並嘗試從預熱池取題；未啟用或池中不足時回傳 None"""
+    if not WARM_POOL_ENABLED:
+        return None
+    # 第一次請求時才啟動背景執行緒，避免在 gunicorn fork 前就建立執行緒
+    warm_pool.start()
+    warm_pool.record_request(topic, difficulty)
+    questions = warm_pool.take(topic, difficulty, count)
+    if questions:
+        print(f"✅ 預熱池命中: {topic} / {difficulty}, 取 {count} 題")
+    return questions
+
+
+def generate_quiz_questions(topic, difficulty, count, parallel=False, batch_size=None):
+    """
+    /api/quiz 的題目來源，依序嘗試：
+    1. 熱門主題預熱池（WARM_POOL_ENABLED 時）
+    2. 新鮮的題庫快取（命中時不呼叫 OpenAI）
+    3. AI 生成（成功的題目會寫回題庫）
+    4. AI 失敗或逾時時，用過期但仍在備援期內的題庫補題
+    5. 最後才用模擬題目補齊
+    """
+    if not has_api_key():
+        return generate_mock_questions(topic, count)
+
+    pooled = _take_from_warm_pool(topic, difficulty, count)
+    if pooled:
+        return pooled
+
+    cache_key = question_cache.make_key(topic, difficulty)
+    cached = question_cache.get_fresh(cache_key, count)
+    if cached:
+        print(f"✅ 題庫快取命中: {topic} / {difficulty}, 取 {count} 題")
+        return _reshuffle_cached(cached)
+
+    # 同參數的請求同時進來時只生成一次，其他請求共用結果並各自重新打亂選項
+    flight_key = (cache_key, count, bool(parallel), batch_size)
+    questions, shared = quiz_flight.do(
+        flight_key,
+        lambda: _generate_fresh_questions(topic, difficulty, count, parallel, batch_size, cache_key)
+    )
+    if shared:
+        return _reshuffle_cached(questions)
+    return questions
+
+
+def _generate_fresh_questions(topic, difficulty, count, parallel, batch_size, cache_key):
+    """實際呼叫 AI 生成題目，不足時依序以過期題庫、模擬題目補齊"""
+    questions = []
+    try:
+        if parallel:
+            questions = generate_questions_parallel(topic, difficulty, count, batch_size, pad_with_mock=False)
+        else:
+            questions = _generate_questions_batch(topic, difficulty, count)
     except Exception as e:
         print(f"❌ OpenAI API 錯誤: {str(e)}")
         print(f"錯誤類型: {type(e).__name__}")
-        return generate_mock_questions(topic, count)
 
+    question_cache.put(cache_key, questions)
 
-def parse_ai_response(ai_text, count=1):
-    """解析 AI 回應格式化為標準格式"""
-    try:
-        # 先印出 AI 的原始回應來除錯
-        print(f"AI 原始回應: {ai_text}")
-        print(f"回應長度: {len(ai_text)} 字元")
-
-        # 移除 markdown code block 標記
-        ai_text = re.sub(r"^```json\s*|```$", "", ai_text.strip(), flags=re.MULTILINE)
-
-        # 嘗試直接解析 JSON
-        questions = json.loads(ai_text)
-        print(f"解析出的題目數量: {len(questions)} , 內容: {questions}")
-        # 驗證格式並補充缺失欄位
-        formatted_questions = []
-        for q in questions:
-            # 處理 difficulty_id 轉換
-            difficulty_id = q.get("difficulty_id", 1)
-            if isinstance(difficulty_id, str):
-                difficulty_mapping = {
-                    'beginner': 1,
-                    'intermediate': 2,
-                    'advanced': 3,
-                    'master': 4
-                }
-                difficulty_id = difficulty_mapping.get(difficulty_id, 1)
-            
-            formatted_q = {
-            "title": q.get("title", "預設題目"),
-            "option_A": q.get("option_A", "選項A"),
-            "option_B": q.get("option_B", "選項B"),
-            "option_C": q.get("option_C", "選項C"),
-            "option_D": q.get("option_D", "選項D"),
-            "User_answer": "",  # 預設空值
-            "explanation_text": q.get("explanation_text", "這是題目的解析"),
-            "Ai_answer": q.get("Ai_answer", "A"),
-            "difficulty_id": difficulty_id
-            }
-            shuffle_options(formatted_q)
-            ai_ans = formatted_q["Ai_answer"]
-            formatted_q["explanation_text"] = re.sub(r"(答案是\s*[ABCD])", f"答案是 {ai_ans}", formatted_q["explanation_text"])
-            formatted_q["explanation_text"] = re.sub(r"(即選項\s*[ABCD])", f"即選項 {ai_ans}", formatted_q["explanation_text"])
-            formatted_questions.append(formatted_q)
-            print(f"格式化後的題目formatted_questions: {formatted_questions}")
-        return formatted_questions
+    if len(questions) < count:
+        stale = question_cache.get_stale(cache_key, count - len(questions), exclude=questions)
+        if stale:
+            print(f"⚠️ AI 生成不足，使用快取題庫補 {len(stale)} 題")
+            questions.extend(_reshuffle_cached(stale))
 
+    if len(questions) < count:
+        questions.extend(generate_mock_questions(topic, count - len(questions)))
+    return questions
+
+
+# 模型偷懶時常見的佔位內容
+PLACEHOLDER_TEXTS = {"", "選項a", "選項b", "選項c", "選項d", "預設題目", "題目描述", "題目描述（繁體中文）", "這是題目的解析"}
+ANSWER_MENTION_PATTERN = re.compile(r"(?:答案是|答案為|正確答案[是為：:]?|即選項)\s*[（(]?\s*([ABCD])\b")
+
+
+def validate_question(q):
+    """
+    檢查 AI 回傳的單一題目（格式化前），回傳 (分數 0~1, 問題列表)
+    分數為 1 代表全部檢查通過
+    """
+    checks = 6
+    problems = []
+
+    title = str(q.get("title") or "").strip()
+    if title.lower() in PLACEHOLDER_TEXTS:
+        problems.append("題目敘述為空或是佔位文字")
+
+    options = [str(q.get(f"option_{letter}") or "").strip() for letter in "ABCD"]
+    if any(opt.lower() in PLACEHOLDER_TEXTS for opt in options):
+        problems.append("選項缺漏或是佔位文字")
+    normalized = {re.sub(r"\s+", "", opt).lower() for opt in options if opt}
+    if len(normalized) < 4:
+        problems.append("四個選項內容必須互不相同")
+
+    answer = str(q.get("Ai_answer") or "").strip().upper()
+    if answer not in ("A", "B", "C", "D"):
+        problems.append("Ai_answer 必須是 A/B/C/D 其中之一")
+
+    explanation = str(q.get("explanation_text") or "").strip()
+    if explanation.lower() in PLACEHOLDER_TEXTS:
+        problems.append("explanation_text 為空或是佔位文字")
+
+    mentioned = set(ANSWER_MENTION_PATTERN.findall(explanation))
+    if answer in ("A", "B", "C", "D") and mentioned and answer not in mentioned:
+        problems.append("explanation_text 中的答案與 Ai_answer 不一致")
+
+    return round(1 - len(problems) / checks, 2), problems
+
+
+def split_valid_questions(raw_questions):
+    """把題目分成通過檢查的題目與退回原因（退回原因給重新生成時的提示詞使用）"""
+    accepted = []
+    rejected_notes = []
+    for q in raw_questions:
+        score, problems = validate_question(q)
+        if problems:
+            print(f"⚠️ 題目未通過檢查（分數 {score}）: {q.get('title')} -> {problems}")
+            rejected_notes.extend(p for p in problems if p not in rejected_notes)
+        else:
+            accepted.append(q)
+    return accepted, rejected_notes
+
+
+def format_question(q):
+    """將 AI 回傳的單一題目補齊欄位、打亂選項並修正解析中的答案代號"""
+    # 處理 difficulty_id 轉換
+    difficulty_id = q.get("difficulty_id", 1)
+    if isinstance(difficulty_id, str):
+        difficulty_mapping = {
+            'beginner': 1,
+            'intermediate': 2,
+            'advanced': 3,
+            'master': 4
+        }
+        difficulty_id = difficulty_mapping.get(difficulty_id, 1)
+
+    formatted_q = {
+    "title": q.get("title", "預設題目"),
+    "option_A": q.get("option_A", "選項A"),
+    "option_B": q.get("option_B", "選項B"),
+    "option_C": q.get("option_C", "選項C"),
+    "option_D": q.get("option_D", "選項D"),
+    "User_answer": "",  # 預設空值
+    "explanation_text": q.get("explanation_text", "這是題目的解析"),
+    "Ai_answer": str(q.get("Ai_answer", "A")).strip().upper(),
+    "difficulty_id": difficulty_id
+    }
+    shuffle_options(formatted_q)
+    ai_ans = formatted_q["Ai_answer"]
+    formatted_q["explanation_text"] = re.sub(r"(答案是\s*[ABCD])", f"答案是 {ai_ans}", formatted_q["explanation_text"])
+    formatted_q["explanation_text"] = re.sub(r"(即選項\s*[ABCD])", f"即選項 {ai_ans}", formatted_q["explanation_text"])
+    return formatted_q
+
+
+class IncrementalQuestionParser:
+    """
+    增量 JSON 陣列解析器：
+    一邊接收模型串流回來的文字片段，一邊找出已經完整的題目物件 {...}
+    不需要等整個陣列結束才 json.loads
+    """
+
+    def __init__(self):
+        self._buffer = []      # 目前物件已累積的字元
+        self._depth = 0        # 大括號層數（0 代表不在物件中）
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk):
+        """餵入一段文字，回傳這段文字中完成的題目物件（dict）列表"""
+        completed = []
+        for ch in chunk:
+            if self._depth == 0:
+                # 物件外的字元（[ , ] 空白 ```json 等）直接略過
+                if ch == "{":
+                    self._depth = 1
+                    self._buffer = [ch]
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    raw = "".join(self._buffer)
+                    self._buffer = []
+                    try:
+                        obj = json.loads(raw)
+                    except json.JSONDecodeError as e:
+                        print(f"增量解析略過無法解析的物件: {str(e)}")
+                        continue
+                    if isinstance(obj, dict):
+                        completed.append(obj)
+        return completed
+
+
+def recover_question_list(ai_text, expected=None):
+    """
+    容錯解析題目陣列：
+    先嘗試完整 json.loads，失敗（例如 finish_reason == "length" 被截斷）時
+    改用增量解析器保留每一個已完整的題目物件
+    回傳 (題目列表, 缺少的題數)
+    """
+    cleaned = re.sub(r"^```json\s*|```$", "", (ai_text or "").strip(), flags=re.MULTILINE)
+    try:
+        questions = json.loads(cleaned)
+        if isinstance(questions, dict):
+            questions = [questions]
+        questions = [q for q in questions if isinstance(q, dict)] if isinstance(questions, list) else []
     except json.JSONDecodeError as e:
-        # 如果解析失敗，回傳模擬資料
-        print(f"JSON 解析錯誤: {str(e)}")
-        print(f"無法解析的內容: {ai_text[:200]}...")  # 只顯示前200字元
-        return generate_mock_questions("解析失敗", count)
+        print(f"JSON 解析錯誤: {str(e)}，改用增量解析救回完整題目")
+        questions = IncrementalQuestionParser().feed(cleaned)
+
+    if expected is not None:
+        questions = questions[:expected]
+        return questions, max(0, expected - len(questions))
+    return questions, 0
+
+
+def stream_questions_with_ai(topic, difficulty, count):
+    """使用 OpenAI 串流生成題目，每完成一題就 yield 一題（已打亂選項）"""
+    print(f"=== 開始串流生成題目 ===")
+    print(f"主題: {topic}, 難度: {difficulty}, 數量: {count}")
+
+    if not has_api_key():
+        yield from generate_mock_questions(topic, count)
+        return
+
+    pooled = _take_from_warm_pool(topic, difficulty, count)
+    if pooled:
+        yield from pooled
+        return
+
+    cache_key = question_cache.make_key(topic, difficulty)
+    cached = question_cache.get_fresh(cache_key, count)
+    if cached:
+        print(f"✅ 題庫快取命中: {topic} / {difficulty}, 取 {count} 題")
+        yield from _reshuffle_cached(cached)
+        return
+
+    parser = IncrementalQuestionParser()
+    emitted = 0
+    rejected = 0
+    generated = []
+
+    try:
+        stream = chat_completion("quiz", stream=True, **build_quiz_request(topic, difficulty, count))
+        finish_reason = None
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta.content or ""
+                for q in parser.feed(delta):
+                    accepted, _ = split_valid_questions([q])
+                    if not accepted:
+                        rejected += 1
+                        continue
+                    emitted += 1
+                    formatted_q = format_question(q)
+                    generated.append(formatted_q)
+                    yield formatted_q
+                    if emitted >= count:
+                        break
+                if emitted >= count:
+                    break
+        finally:
+            # 題數已足夠或前端中途斷線時關閉上游串流，不再接收（並付費）多餘的 token
+            stream.close()
+        print(f"串流完成，共產生 {emitted} 題，退回 {rejected} 題（finish_reason={finish_reason}）")
+
+        # 串流被截斷或有題目被退回時，只補要缺少的題數
+        if emitted < count and (finish_reason == "length" or rejected):
+            remainder = _generate_questions_batch(
+                topic, difficulty, count - emitted, [q["title"] for q in generated]
+            )
+            for formatted_q in remainder:
+                emitted += 1
+                generated.append(formatted_q)
+                yield formatted_q
+
+    except Exception as e:
+        print(f"❌ OpenAI 串流錯誤: {str(e)}")
+        print(f"錯誤類型: {type(e).__name__}")
+
+    question_cache.put(cache_key, generated)
+
+    # 串流中斷或題數不足時，先用快取題庫補，再以模擬題目補齊
+    if emitted < count:
+        stale = question_cache.get_stale(cache_key, count - emitted, exclude=generated)
+        emitted += len(stale)
+        yield from _reshuffle_cached(stale)
+    if emitted < count:
+        yield from generate_mock_questions(topic, count - emitted)
+
+
+def _format_stream_event(event, payload, stream_format):
+    """把事件轉成 NDJSON 一行或 SSE 一個事件"""
+    data = json.dumps(payload, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {data}\n\n"
+    return json.dumps({"type": event, **payload}, ensure_ascii=False) + "\n"
+
+
+def stream_quiz_response(topic, difficulty, question_count, stream_format="ndjson"):
+    """將串流生成的題目包成 Flask 串流回應（NDJSON 或 SSE）"""
+
+    def generate():
+        index = 0
+        for q in stream_questions_with_ai(topic, difficulty, question_count):
+            index += 1
+            yield _format_stream_event("question", {"index": index, "question": q}, stream_format)
+        yield _format_stream_event("done", {
+            "quiz_topic": topic,
+            "count": index,
+            "message": "Questions generated successfully"
+        }, stream_format)
+
+    mimetype = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    response = Response(stream_with_context(generate()), status=201, mimetype=mimetype)
+    # 避免 nginx 等反向代理緩衝整個回應
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 @app.route('/api/quiz', methods=['POST'])
 def create_quiz():
@@ -263,12 +711,15 @@ def create_quiz():
         
         topic = data.get('topic', '')
         difficulty = data.get('difficulty', 'test')
-        question_count = data.get('question_count', 1)
+        question_count = int(data.get('question_count', 1))
+        # 題數超過一批時預設平行分批生成，也可由請求指定
+        parallel = data.get('parallel', question_count > QUIZ_BATCH_SIZE)
         
         print(f"解析的參數:")
         print(f"  topic: {topic}")
         print(f"  difficulty: {difficulty}")
         print(f"  question_count: {question_count}")
+        print(f"  parallel: {parallel}")
         print("=" * 50)
 
         # 驗證難度等級
@@ -280,9 +731,18 @@ def create_quiz():
 
         if not topic:
             return jsonify({"error": "Topic is required"}), 400
+
+        # 串流模式：每生成一題就以 NDJSON / SSE 回傳一題
+        if data.get('stream', False):
+            stream_format = data.get('stream_format', 'ndjson')
+            if stream_format not in ('ndjson', 'sse'):
+                return jsonify({"error": "Invalid stream_format. Valid options are: ndjson, sse"}), 400
+            return stream_quiz_response(topic, difficulty, question_count, stream_format)
         
-        # 呼叫 AI 生成題目
-        generated_questions = generate_questions_with_ai(topic, difficulty, question_count)
+        # 呼叫 AI 生成題目（先查題庫快取，失敗時以快取備援）
+        generated_questions = generate_quiz_questions(
+            topic, difficulty, question_count, parallel, data.get('batch_size')
+        )
         print(f"生成的題目數量: {len(generated_questions)}, 內容: {generated_questions}")
         # 直接返回生成的題目，讓 Django 處理儲存
         return jsonify({
@@ -346,75 +806,62 @@ def chat_with_ai():
         topic_id = data.get('topic_id')
         user_id = data.get('user_id')
         content = data.get('content')
-        topic_data = data.get('topic_data', {})
         chat_history = data.get('chat_history', [])
+        history_summary = data.get('history_summary', '')
 
         if not topic_id or not user_id or not content:
             return jsonify({"error": "topic_id, user_id, and content are required"}), 400
 
+        topic_key, topic_prompt = resolve_topic_prompt(data)
+        if topic_prompt is None:
+            # 沒有這個題目版本的 prompt，請 Django 附上完整題目內容重送
+            return jsonify({"error": "topic_context_required"}), 409
+
         print(f"=== 處理聊天請求 ===")
         print(f"用戶ID: {user_id}, 主題ID: {topic_id}")
         print(f"用戶訊息: {content}")
         print(f"歷史對話數量: {len(chat_history)}")
 
-        # 檢查 API Key
-        api_key = os.getenv('OPENAI_API_KEY', 'your-api-key-here')
+        # 串流模式：以 NDJSON 逐段回傳 AI 回覆
+        if data.get('stream', False):
+            return stream_chat_response(
+                topic_id, user_id, content, topic_key, topic_prompt, chat_history, history_summary
+            )
 
-        if api_key == 'your-api-key-here' or not api_key:
+        # 檢查 API Key
+        if not has_api_key():
             # 使用假資料回應
             mock_response = {
                 "topic_id": topic_id,
                 "user_id": user_id,
-                "response": f"這是針對您的問題「{content}」的 AI 回應。基於您的對話歷史，我理解您想了解更多相關內容。",
+                "response": mock_chat_reply(content),
                 "sender": "ai"
             }
             return jsonify(mock_response), 200
 
+        cache_key = chat_cache_key(topic_key, chat_history, history_summary)
+        cached = chat_answer_cache.lookup(cache_key, content) if cache_key else None
+        if cached:
+            print(f"✅ 對話快取命中: {content}")
+            return jsonify({
+                "topic_id": topic_id,
+                "user_id": user_id,
+                "response": cached,
+                "sender": "ai",
+                "tokens_used": 0,
+                "cached": True
+            }), 200
+
         # 使用真實 OpenAI API
         try:
-            client = OpenAI(api_key=api_key)
-            
-            # 構建對話上下文
-            messages = [
-                {
-                    "role": "system", 
-                    "content": "你是一個有用的學習助手，專門協助學生理解題目和相關知識。請用繁體中文回答，並根據對話歷史提供連貫的回應。"
-                    "這是題目的敘述與選項：\n"
-                    f"題目: {topic_data.get('title', '未知題目')}\n"
-                    f"選項:\n"
-                    f"A. {topic_data.get('option_A', '未知選項')}\n"
-                    f"B. {topic_data.get('option_B', '未知選項')}\n"
-                    f"C. {topic_data.get('option_C', '未知選項')}\n"
-                    f"D. {topic_data.get('option_D', '未知選項')}\n"
-                    f"AI 答案: {topic_data.get('Ai_answer', '未知答案')}\n"
-                    f"解釋: {topic_data.get('explanation_text', '未知解釋')}\n"
-                }
-            ]
-            
-            # 添加歷史對話
-            for chat in chat_history[:-1]:  # 排除最後一條（當前用戶訊息）
-                role = "user" if chat['sender'] == 'user' else "assistant"
-                messages.append({
-                    "role": role,
-                    "content": chat['content']
-                })
-            
-            # 添加當前用戶訊息
-            messages.append({
-                "role": "user",
-                "content": content
-            })
-            
+            messages = build_chat_messages(content, topic_prompt, chat_history, history_summary)
             print(f"發送給 OpenAI 的訊息數量: {len(messages)}")
             
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500
-            )
+            response = chat_completion("chat", **build_chat_request(messages))
             
             ai_response = response.choices[0].message.content
+            if cache_key:
+                chat_answer_cache.store(cache_key, content, ai_response)
             
             return jsonify({
                 "topic_id": topic_id,
@@ -440,6 +887,203 @@ def chat_with_ai():
         return jsonify({"error": str(e)}), 500
 
 
+def build_topic_system_prompt(topic_data):
+    """題目資訊的 system prompt"""
+    return (
+        "你是一個有用的學習助手，專門協助學生理解題目和相關知識。請用繁體中文回答，並根據對話歷史提供連貫的回應。"
+        "這是題目的敘述與選項：\n"
+        f"題目: {topic_data.get('title', '未知題目')}\n"
+        f"選項:\n"
+        f"A. {topic_data.get('option_A', '未知選項')}\n"
+        f"B. {topic_data.get('option_B', '未知選項')}\n"
+        f"C. {topic_data.get('option_C', '未知選項')}\n"
+        f"D. {topic_data.get('option_D', '未知選項')}\n"
+        f"AI 答案: {topic_data.get('Ai_answer', '未知答案')}\n"
+        f"解釋: {topic_data.get('explanation_text', '未知解釋')}\n"
+    )
+
+
+def resolve_topic_prompt(data):
+    """
+    取得題目的 (key, system prompt)
+    - Django 送 topic_ref（題目 id + 內容版本）時先查 LRU，命中就不需要 topic_data
+    - 有 topic_data 時編譯 prompt 並放進 LRU
+    - 只有 topic_ref 且 LRU 沒有時 prompt 為 None，由呼叫端要求重送
+    """
+    ref = data.get('topic_ref') or {}
+    topic_data = data.get('topic_data')
+    if ref.get('version'):
+        key = f"{ref.get('id')}:{ref['version']}"
+    else:
+        topic_data = topic_data or {}
+        raw = json.dumps(topic_data, sort_keys=True, ensure_ascii=False, default=str)
+        key = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    prompt = topic_prompts.get(key)
+    if prompt is None and topic_data is not None:
+        prompt = build_topic_system_prompt(topic_data)
+        topic_prompts.put(key, prompt)
+    return key, prompt
+
+
+def build_chat_messages(content, topic_prompt, chat_history, history_summary=''):
+    """構建對話上下文：題目資訊的 system prompt（含先前對話摘要）+ 最近的歷史對話 + 當前用戶訊息"""
+    messages = [{"role": "system", "content": topic_prompt}]
+    if history_summary:
+        messages[0]["content"] += f"先前對話摘要: {history_summary}\n"
+    
+    # 添加歷史對話
+    for chat in chat_history[:-1]:  # 排除最後一條（當前用戶訊息）
+        role = "user" if chat['sender'] == 'user' else "assistant"
+        messages.append({
+            "role": role,
+            "content": chat['content']
+        })
+    
+    # 添加當前用戶訊息
+    messages.append({
+        "role": "user",
+        "content": content
+    })
+    return messages
+
+
+def build_chat_request(messages):
+    return dict(model="gpt-4o", messages=messages, temperature=0.7, max_tokens=500)
+
+
+def chat_cache_key(topic_key, chat_history, history_summary=''):
+    """可以使用對話快取時回傳題目 key（含內容版本，題目被修改後 key 會改變），否則回傳 None"""
+    if not CHAT_CACHE_ENABLED or history_summary or len(chat_history) > CHAT_CACHE_MAX_HISTORY:
+        return None
+    return topic_key
+
+
+def mock_chat_reply(content):
+    return f"這是針對您的問題「{content}」的 AI 回應。基於您的對話歷史，我理解您想了解更多相關內容。"
+
+
+def stream_chat_with_ai(content, topic_key, topic_prompt, chat_history, history_summary=''):
+    """
+    串流 AI 回覆：yield ("delta", 文字片段)，最後 yield ("done", 附加欄位)
+    - 沒有 API Key 或一開始就失敗時，整段備用回應當作一個 delta 送出
+    - 串流中途中斷時保留已收到的內容
+    """
+    if not has_api_key():
+        yield "delta", mock_chat_reply(content)
+        yield "done", {}
+        return
+
+    cache_key = chat_cache_key(topic_key, chat_history, history_summary)
+    cached = chat_answer_cache.lookup(cache_key, content) if cache_key else None
+    if cached:
+        print(f"✅ 對話快取命中: {content}")
+        yield "delta", cached
+        yield "done", {"tokens_used": 0, "cached": True}
+        return
+
+    parts = []
+    tokens_used = 0
+    try:
+        messages = build_chat_messages(content, topic_prompt, chat_history, history_summary)
+        stream = chat_completion(
+            "chat", stream=True, stream_options={"include_usage": True}, **build_chat_request(messages)
+        )
+        # 前端中途斷線時也要關閉上游串流（同時結束斷路器的紀錄）
+        with closing(stream):
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    tokens_used = chunk.usage.total_tokens
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                if delta:
+                    parts.append(delta)
+                    yield "delta", delta
+        if cache_key:
+            chat_answer_cache.store(cache_key, content, "".join(parts))
+        yield "done", {"tokens_used": tokens_used}
+    except Exception as e:
+        print(f"❌ OpenAI 串流錯誤: {type(e).__name__}: {str(e)}")
+        if parts:
+            yield "done", {"note": "AI 回應中斷"}
+        else:
+            yield "delta", generate_smart_response(content, chat_history)
+            yield "done", {"note": "使用本地回應（OpenAI API 不可用）"}
+
+
+def stream_chat_response(topic_id, user_id, content, topic_key, topic_prompt, chat_history, history_summary=''):
+    """將 stream_chat_with_ai 包成 NDJSON 串流回應，done 事件帶完整回覆"""
+
+    def generate():
+        parts = []
+        for event, payload in stream_chat_with_ai(content, topic_key, topic_prompt, chat_history, history_summary):
+            if event == "delta":
+                parts.append(payload)
+                yield _format_stream_event("delta", {"content": payload}, "ndjson")
+            else:
+                yield _format_stream_event("done", {
+                    "topic_id": topic_id,
+                    "user_id": user_id,
+                    "response": "".join(parts),
+                    "sender": "ai",
+                    **payload
+                }, "ndjson")
+
+    response = Response(stream_with_context(generate()), status=200, mimetype="application/x-ndjson")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+CHAT_SUMMARY_SYSTEM_PROMPT = "你是對話摘要助手，負責把學生與學習助手的對話壓縮成精簡的繁體中文摘要。"
+
+
+def build_chat_summary_request(previous_summary, messages, topic_title=''):
+    """把舊摘要與新的對話合併成新摘要（摘要長度固定上限，讓每輪 prompt 大小維持不變）"""
+    dialogue = "\n".join(
+        f"{'學生' if m.get('sender') == 'user' else '助手'}: {m.get('content', '')}" for m in messages
+    )
+    prompt = f"""
+    題目：{topic_title}
+    先前的摘要：{previous_summary or '（無）'}
+    新的對話：
+{dialogue}
+
+    請整合先前的摘要與新的對話，輸出一段 200 字以內的摘要，
+    保留學生已經理解與仍有疑問的重點，不要加任何格式標記。
+    """
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": CHAT_SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.3,
+        max_tokens=300
+    )
+
+
+@app.route('/api/chat/summary', methods=['POST'])
+def summarize_chat():
+    """Django 的對話歷史管理呼叫：把較舊的對話併入滾動摘要"""
+    try:
+        data = request.json
+        messages = data.get('messages', [])
+        if not messages:
+            return jsonify({"error": "messages are required"}), 400
+        if not has_api_key():
+            return jsonify({"error": "API key is missing"}), 503
+
+        response = chat_completion("chat_summary", **build_chat_summary_request(
+            data.get('previous_summary', ''), messages, data.get('topic_title', '')
+        ))
+        return jsonify({"summary": response.choices[0].message.content.strip()}), 200
+    except Exception as e:
+        print(f"❌ 對話摘要失敗: {type(e).__name__}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
 def generate_smart_response(user_content, chat_history):
     """基於用戶輸入和歷史生成智能假回應"""
     # 分析用戶問題類型
@@ -471,34 +1115,36 @@ def generate_smart_response(user_content, chat_history):
 
 # GPT統整note content 資料
 
+def build_retest_request(content):
+    prompt = f"""
+        1. 分析文章內容，提取關鍵主題。
+        2. 根據主題，設計一個測驗標題。
+        3. 測驗標題需簡短、清晰、有吸引力，且字數不超過30字。
+        4. 只輸出測驗標題，不需要多餘解釋。
+        需整理內容：{content}
+
+        請直接回傳整理後的內容，不要使用任何格式標記。
+        """
+    return dict(
+        model="gpt-4o",
+        messages=[
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.8
+    )
+
+
 def parse_note_content(content):
     print("----content內容------")
     print(content)
     print("----content內容------")
-    api_key = os.getenv('OPENAI_API_KEY', '')
-    if api_key == '' or not api_key:
+    if not has_api_key():
         print("API key is missing.")
         return content  # 直接返回原始內容
 
     print("~~~~~~~~~~~~~~~~~")
     try:
-        client = OpenAI(api_key=api_key)
-        prompt = f"""
-        1. 分析文章內容，提取關鍵主題。
-        2. 根據主題，設計一個測驗標題。
-        3. 測驗標題需簡短、清晰、有吸引力，且字數不超過30字。
-        4. 只輸出測驗標題，不需要多餘解釋。
-        需整理內容：{content}
-
-        請直接回傳整理後的內容，不要使用任何格式標記。
-        """
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.8
-        )
+        response = chat_completion("retest", **build_retest_request(content))
         
         processed_content = response.choices[0].message.content.strip()
         print("----以下GPT彙整content內容----")
@@ -543,18 +1189,17 @@ def parse_answer():
         return jsonify({"error": "Title and AI answer are required"}), 400
 
     # Call OpenAI API to parse the question
-    api_key = os.getenv('OPENAI_API_KEY', '')
-    if not api_key:
+    if not has_api_key():
         return jsonify({"error": "API key is missing"}), 400
 
     try:
-        client = OpenAI(api_key=api_key)
         prompt = f"""
         你是一個題目解析專家，請根據以下內容進行詳細解釋：
         題目:{title},解答:{Ai_answer}
         直接回傳整理後的內容，不要使用任何格式標記。
         """
-        response = client.chat.completions.create(
+        response = chat_completion(
+            "parse_answer",
             model="gpt-4.0",
             messages=[
                 {
@@ -578,7 +1223,7 @@ def parse_answer():
 # 目前整合在一起 暫時保留
 # GPT 解析題目
 
-# 移除 SocketIO 相關函數
+# 移除 SocketIO 相關函數（逐批推送題目改由 /api/quiz 的 stream 模式處理）
 # @socketio.on('generate_quiz')
 # def handle_generate_quiz(data):
 #     topic = data.get('topic')
@@ -616,9 +1261,7 @@ def generate_topic_from_note():
             return jsonify({"success": False, "message": "筆記內容過長，請縮短後再試"}), 400
         
         # 檢查 API Key
-        api_key = os.getenv('OPENAI_API_KEY', 'your-api-key-here')
-        
-        if api_key == 'your-api-key-here' or not api_key:
+        if not has_api_key():
             # 如果沒有API Key，使用改進的備用邏輯
             fallback_topic = generate_enhanced_fallback_topic_from_note(note_content, note_title)
             return jsonify({
@@ -628,11 +1271,34 @@ def generate_topic_from_note():
                 "is_fallback": True
             })
         
-        # 使用 OpenAI API 生成主題
-        client = OpenAI(api_key=api_key)
+        # 使用 OpenAI API 生成主題（共用連線池的 client）
+        response = chat_completion("topic_from_note", **build_topic_from_note_request(note_content, note_title))
+        ai_response = response.choices[0].message.content.strip()
+        return jsonify(topic_from_note_result(ai_response, note_content, note_title))
         
-        # 改進的AI提示詞
-        prompt = f"""
+    except Exception as e:
+        print(f"生成主題時發生錯誤: {str(e)}")
+        
+        # 發生錯誤時使用改進的備用邏輯
+        try:
+            fallback_topic = generate_enhanced_fallback_topic_from_note(note_content, note_title)
+            return jsonify({
+                "success": True,
+                "topic": fallback_topic,
+                "message": "AI服務錯誤，使用改進的備用邏輯",
+                "is_fallback": True
+            })
+        except Exception as fallback_error:
+            print(f"改進的備用邏輯也失敗: {str(fallback_error)}")
+            return jsonify({
+                "success": False,
+                "message": f"生成主題失敗: {str(e)}"
+            }), 500
+
+def build_topic_from_note_request(note_content, note_title=''):
+    """根據筆記生成主題的 chat.completions 參數（同步與 async 服務共用）"""
+    # 改進的AI提示詞
+    prompt = f"""
         你是一個專業的學習主題生成專家，擅長分析各種類型的筆記內容並提取核心概念。
 
         請分析以下筆記標題和內容，生成一個適合製作練習題的遊戲主題名稱：
@@ -689,57 +1355,39 @@ def generate_topic_from_note():
 
         請直接回傳主題名稱，不要加任何其他內容、格式標記或解釋。
         """
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "你是一個學習主題生成助手，請根據筆記內容生成合適的練習題主題。只回傳主題名稱，不要其他內容。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,  # 降低溫度，提高一致性
-            max_tokens=50      # 減少token使用
-        )
-        
-        ai_response = response.choices[0].message.content.strip()
-        
-        # 改進的AI回應清理邏輯
-        topic = clean_ai_response(ai_response)
-        
-        if not topic or len(topic) > 25 or len(topic) < 3:
-            # 如果AI生成的主題無效，使用改進的備用邏輯
-            fallback_topic = generate_enhanced_fallback_topic_from_note(note_content, note_title)
-            return jsonify({
-                "success": True,
-                "topic": fallback_topic,
-                "message": "AI生成主題無效，使用改進的備用邏輯",
-                "is_fallback": True
-            })
-        
-        return jsonify({
+    return dict(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": "你是一個學習主題生成助手，請根據筆記內容生成合適的練習題主題。只回傳主題名稱，不要其他內容。"},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.3,  # 降低溫度，提高一致性
+        max_tokens=50      # 減少token使用
+    )
+
+
+def topic_from_note_result(ai_response, note_content, note_title=''):
+    """清理 AI 回應並驗證主題，無效時改用備用邏輯"""
+    # 改進的AI回應清理邏輯
+    topic = clean_ai_response(ai_response)
+    
+    if not topic or len(topic) > 25 or len(topic) < 3:
+        # 如果AI生成的主題無效，使用改進的備用邏輯
+        fallback_topic = generate_enhanced_fallback_topic_from_note(note_content, note_title)
+        return {
             "success": True,
-            "topic": topic,
-            "message": "成功生成主題",
-            "is_fallback": False
-        })
-        
-    except Exception as e:
-        print(f"生成主題時發生錯誤: {str(e)}")
-        
-        # 發生錯誤時使用改進的備用邏輯
-        try:
-            fallback_topic = generate_enhanced_fallback_topic_from_note(note_content, note_title)
-            return jsonify({
-                "success": True,
-                "topic": fallback_topic,
-                "message": "AI服務錯誤，使用改進的備用邏輯",
-                "is_fallback": True
-            })
-        except Exception as fallback_error:
-            print(f"改進的備用邏輯也失敗: {str(fallback_error)}")
-            return jsonify({
-                "success": False,
-                "message": f"生成主題失敗: {str(e)}"
-            }), 500
+            "topic": fallback_topic,
+            "message": "AI生成主題無效，使用改進的備用邏輯",
+            "is_fallback": True
+        }
+    
+    return {
+        "success": True,
+        "topic": topic,
+        "message": "成功生成主題",
+        "is_fallback": False
+    }
+
 
 def clean_ai_response(ai_response):
     """清理AI回應，提取純淨的主題名稱"""
@@ -0,0 +1,116 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from quiz_cache import QuestionBankCache
+
+
+class WarmPool:
+    """
+    熱門主題的預先生成題目池
+    - record_request 記錄每個 (topic, difficulty) 的請求次數（每輪依 decay 衰減，只看近期熱度）
+    - 背景執行緒定期挑出最熱門的 hot_topics 組，把題目池補到 depth 題
+    - take 直接從池中取出題目（每題只會被取走一次），請求路徑上不呼叫 OpenAI
+    """
+
+    def __init__(self, generate_fn, depth=20, hot_topics=10, min_requests=3,
+                 concurrency=2, interval=30, batch_size=5, decay=0.9):
+        self.generate_fn = generate_fn  # generate_fn(topic, difficulty, count) -> list
+        self.depth = depth
+        self.hot_topics = hot_topics
+        self.min_requests = min_requests
+        self.concurrency = concurrency
+        self.interval = interval
+        self.batch_size = batch_size
+        self.decay = decay
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._hits = {}        # key -> 近期請求次數（已衰減）
+        self._params = {}      # key -> (topic, difficulty) 原始參數
+        self._pools = {}       # key -> deque(題目)
+        self._refilling = set()
+        self._executor = None
+        self._thread = None
+
+    def record_request(self, topic, difficulty):
+        key = QuestionBankCache.make_key(topic, difficulty)
+        with self._lock:
+            self._hits[key] = self._hits.get(key, 0) + 1
+            self._params.setdefault(key, (topic, difficulty))
+        return key
+
+    def take(self, topic, difficulty, count):
+        """池中題目足夠時取出 count 題，不足則回傳 None（不拆開取，避免混用）"""
+        key = QuestionBankCache.make_key(topic, difficulty)
+        with self._lock:
+            pool = self._pools.get(key)
+            if not pool or len(pool) < count:
+                return None
+            questions = [pool.popleft() for _ in range(count)]
+            low = len(pool) < self.depth // 2
+        if low:
+            # 池子低於一半就提早叫醒補題執行緒
+            self._wake.set()
+        return questions
+
+    def start(self):
+        """啟動背景補題執行緒（可重複呼叫，只會啟動一次）"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=max(1, self.concurrency),
+                                                thread_name_prefix="warm-pool")
+            self._thread = threading.Thread(target=self._run, name="warm-pool-refiller", daemon=True)
+            self._thread.start()
+            print(f"=== 題目預熱池啟動 depth={self.depth}, hot_topics={self.hot_topics}, "
+                  f"concurrency={self.concurrency} ===")
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.refill_once()
+            except Exception as e:
+                print(f"❌ 預熱池補題排程錯誤: {type(e).__name__}: {str(e)}")
+
+    def refill_once(self):
+        """挑出熱門組合並送出補題工作（同一組合同時只會有一個補題工作）"""
+        with self._lock:
+            hot = sorted(
+                (item for item in self._hits.items() if item[1] >= self.min_requests),
+                key=lambda item: item[1], reverse=True
+            )[:self.hot_topics]
+            jobs = []
+            for key, _ in hot:
+                ready = len(self._pools.get(key, ()))
+                if ready >= self.depth or key in self._refilling:
+                    continue
+                self._refilling.add(key)
+                topic, difficulty = self._params[key]
+                jobs.append((key, topic, difficulty, min(self.batch_size, self.depth - ready)))
+
+            # 衰減請求次數，冷掉的組合連同題目池一起移除
+            for key in list(self._hits):
+                self._hits[key] *= self.decay
+                if self._hits[key] < 0.5 and key not in self._refilling:
+                    self._hits.pop(key)
+                    self._params.pop(key, None)
+                    self._pools.pop(key, None)
+
+        for job in jobs:
+            self._executor.submit(self._refill, *job)
+
+    def _refill(self, key, topic, difficulty, count):
+        try:
+            questions = self.generate_fn(topic, difficulty, count)
+            with self._lock:
+                pool = self._pools.setdefault(key, deque())
+                pool.extend(questions[:max(0, self.depth - len(pool))])
+            print(f"✅ 預熱池補題: {topic} / {difficulty} +{len(questions)} 題")
+        except Exception as e:
+            print(f"❌ 預熱池補題失敗: {topic} / {difficulty}: {type(e).__name__}: {str(e)}")
+        finally:
+            with self._lock:
+                self._refilling.discard(key)